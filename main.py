@@ -1,6 +1,10 @@
 import tkinter as tk
-from tkinter import messagebox, filedialog
+from tkinter import messagebox, filedialog, ttk
 from PIL import Image, ImageTk, ImageGrab
+try:
+    import numpy as np  # 可选依赖：感知哈希、图像增强和自动切图需要
+except ImportError:
+    np = None
 import os
 import glob
 import json
@@ -10,6 +14,27 @@ import re
 import tempfile
 import time
 import sys
+import threading
+import queue
+import sqlite3
+import argparse
+import csv
+import hashlib
+import copy
+import platform
+import statistics
+import gzip
+import lzma
+import bisect
+import math
+import uuid
+import getpass
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qs, unquote
 
 """
 0319(2)
@@ -20,8 +45,3949 @@ import sys
 1.修改截图保存逻辑,目前支持同音截图
 2.文件排序逻辑更新,现在会先根据页数排序,页数相同再根据字数排序
 """
+
+CONFIG_PATH = "config.json"
+CACHE_DIR = "cache"
+JOURNAL_DIR = "journal"
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+IMAGE_NAME_PATTERN = re.compile(r"^zhuang_(\d+)_crop_(\d+)$")
+
+
+def load_config(config_path=CONFIG_PATH):
+    """读取配置文件，文件不存在或损坏时返回空字典"""
+    if os.path.exists(config_path):
+        try:
+            with open(config_path, "r") as f:
+                config = json.load(f)
+                if isinstance(config, dict):
+                    return config
+        except Exception:
+            pass
+    return {}
+
+
+def save_config(updates, config_path=CONFIG_PATH):
+    """合并写入配置文件，保留未修改的键"""
+    config = load_config(config_path)
+    config.update(updates)
+    write_json_atomic(config_path, config)
+
+
+def parse_image_key(file_path):
+    """解析zhuang_<页>_crop_<序号>格式的文件名，返回(页, 序号)，不符合时返回None"""
+    main_name = os.path.splitext(os.path.basename(file_path))[0]
+    match = IMAGE_NAME_PATTERN.match(main_name)
+    if not match:
+        return None
+    return int(match.group(1)), int(match.group(2))
+
+
+def write_json_atomic(path, data, **dump_kwargs):
+    """先写临时文件再替换，避免中途崩溃留下半截JSON"""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_", suffix=".json")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, **dump_kwargs)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class RecordModel:
+    """
+    标注记录模型的基类。
+
+    子类用FIELDS声明 (JSON键, 属性名, 子类型, 默认值工厂)，子类型为None表示普通值，
+    ("one", 类)表示嵌套对象，("many", 类)表示对象列表。_keys保存原始JSON中键的顺序，
+    未知的键放在extra中，因此from_dict(d).to_dict()与d完全一致。
+    紧凑格式去掉等于默认值的字段；键与new()生成的不同（旧记录缺少字段、有未知字段或顺序不同）时
+    另存原始的键顺序（KEYS_MARK），因此from_dict(to_compact(), fill_defaults=True)也与原记录一致。
+    """
+
+    __slots__ = ("_keys", "extra")
+    FIELDS = ()
+    NEW_KEYS = None  # new()生成的键，None表示全部字段
+    KEYS_MARK = "~keys"
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._FIELD_MAP = {key: (attr, kind, default) for key, attr, kind, default in cls.FIELDS}
+
+    @classmethod
+    def canonical_keys(cls):
+        return tuple(cls.NEW_KEYS or (key for key, _, _, _ in cls.FIELDS))
+
+    @classmethod
+    def new(cls, **values):
+        """规范的默认记录（新建页面/读音/词性/例句时使用）"""
+        obj = cls.__new__(cls)
+        obj._keys = cls.canonical_keys()
+        obj.extra = {}
+        for key, attr, kind, default in cls.FIELDS:
+            setattr(obj, attr, default())
+        for attr, value in values.items():
+            setattr(obj, attr, value)
+        return obj
+
+    @classmethod
+    def from_dict(cls, data, fill_defaults=False):
+        """fill_defaults为True时按KEYS_MARK（没有时按new()的键）补齐紧凑格式中省略的字段"""
+        obj = cls.__new__(cls)
+        obj.extra = {}
+        keys = [key for key in data if key != cls.KEYS_MARK]
+        if fill_defaults:
+            if cls.KEYS_MARK in data:
+                keys = list(data[cls.KEYS_MARK])
+            else:
+                canonical = cls.canonical_keys()
+                keys = list(canonical) + [key for key in keys if key not in canonical]
+        for key, attr, kind, default in cls.FIELDS:
+            if key not in data:
+                setattr(obj, attr, default())
+                continue
+            raw = data[key]
+            if kind and kind[0] == "one" and isinstance(raw, dict):
+                raw = kind[1].from_dict(raw, fill_defaults)
+            elif kind and kind[0] == "many" and isinstance(raw, list):
+                raw = [kind[1].from_dict(item, fill_defaults) if isinstance(item, dict) else item for item in raw]
+            setattr(obj, attr, raw)
+        for key in data:
+            if key not in cls._FIELD_MAP and key != cls.KEYS_MARK:
+                obj.extra[key] = data[key]
+        obj._keys = tuple(keys)
+        return obj
+
+    @staticmethod
+    def _dump(value, compact=False):
+        if isinstance(value, RecordModel):
+            return value.to_compact() if compact else value.to_dict()
+        if isinstance(value, list):
+            return [RecordModel._dump(item, compact) for item in value]
+        return value
+
+    def to_dict(self):
+        result = {}
+        for key in self._keys:
+            if key in self._FIELD_MAP:
+                result[key] = self._dump(getattr(self, self._FIELD_MAP[key][0]))
+            else:
+                result[key] = self.extra[key]
+        return result
+
+    def to_compact(self):
+        """去掉等于默认值的字段，用于紧凑存储"""
+        result = {}
+        for key in self._keys:
+            if key not in self._FIELD_MAP:
+                result[key] = self.extra[key]
+                continue
+            attr, kind, default = self._FIELD_MAP[key]
+            value = self._dump(getattr(self, attr), compact=True)
+            if value == default() or (kind and kind[0] == "one" and value == {}):
+                continue
+            result[key] = value
+        if self._keys != self.canonical_keys():
+            result[self.KEYS_MARK] = list(self._keys)
+        return result
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+class Example(RecordModel):
+    __slots__ = ("zhuang", "chinese")
+    FIELDS = (
+        ("壮文", "zhuang", None, str),
+        ("中文", "chinese", None, str),
+    )
+
+
+class Entry(RecordModel):
+    __slots__ = ("part_of_speech", "meaning", "examples")
+    FIELDS = (
+        ("part_of_speech", "part_of_speech", None, str),
+        ("meaning", "meaning", None, str),
+        ("examples", "examples", ("many", Example), list),
+    )
+
+    @classmethod
+    def new(cls, **values):
+        values.setdefault("examples", [Example.new()])
+        return super().new(**values)
+
+
+class Pronunciation(RecordModel):
+    __slots__ = ("zhuang_spelling", "ipa", "imported_source_path", "old_image_path", "imported_image",
+                 "dialect_type", "entries")
+    FIELDS = (
+        ("zhuang_spelling", "zhuang_spelling", None, str),
+        ("ipa", "ipa", None, str),
+        ("imported_source_path", "imported_source_path", None, str),
+        ("old_image_path", "old_image_path", None, str),
+        ("imported_image", "imported_image", None, list),
+        ("dialect_type", "dialect_type", None, int),
+        ("entries", "entries", ("many", Entry), list),
+    )
+
+    @classmethod
+    def new(cls, **values):
+        values.setdefault("entries", [Entry.new()])
+        return super().new(**values)
+
+
+class PageInfo(RecordModel):
+    __slots__ = ("page_num", "word_num")
+    FIELDS = (
+        ("page_num", "page_num", None, str),
+        ("word_num", "word_num", None, str),
+    )
+
+
+class Annotation(RecordModel):
+    __slots__ = ("image", "annotator", "page_info", "simplified_Chinese_character", "imported_source_path",
+                 "imported_image", "pronunciations")
+    FIELDS = (
+        ("image", "image", None, str),
+        ("annotator", "annotator", None, str),
+        ("page_info", "page_info", ("one", PageInfo), PageInfo.new),
+        ("simplified_Chinese_character", "simplified_Chinese_character", None, str),
+        ("imported_source_path", "imported_source_path", None, str),
+        ("imported_image", "imported_image", None, list),
+        ("pronunciations", "pronunciations", ("many", Pronunciation), list),
+    )
+    # 早期版本的顶层imported_source_path/imported_image已不再使用，新记录不再生成
+    NEW_KEYS = ("image", "annotator", "page_info", "simplified_Chinese_character", "pronunciations")
+
+    @classmethod
+    def new(cls, **values):
+        values.setdefault("pronunciations", [Pronunciation.new()])
+        return super().new(**values)
+
+
+RECORD_COMPRESSIONS = {
+    None: (lambda data: data, lambda data: data),
+    "gzip": (gzip.compress, gzip.decompress),
+    "lzma": (lzma.compress, lzma.decompress),
+}
+
+
+def encode_compact(record, compression=None):
+    """把记录（dict或Annotation）编码为去掉默认值、无缩进的UTF-8 JSON，可选gzip/lzma压缩"""
+    if isinstance(record, dict):
+        record = Annotation.from_dict(record)
+    data = json.dumps(record.to_compact(), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return RECORD_COMPRESSIONS[compression][0](data)
+
+
+def decode_compact(data, compression=None):
+    """encode_compact的逆过程，返回补齐省略字段的Annotation，to_dict()与编码前的记录一致"""
+    raw = json.loads(RECORD_COMPRESSIONS[compression][1](data).decode("utf-8"))
+    return Annotation.from_dict(raw, fill_defaults=True)
+
+
+def load_display_image(path, size=(1000, 1000)):
+    """解码图片并缩小到显示尺寸（load_current_image使用的主图）"""
+    with TRACER.span("decode"):
+        img = Image.open(path)
+        img.thumbnail(size)
+        img.load()
+    return img
+
+
+def pronunciation_thumbnail_paths(pron, input_dir="output_image"):
+    """按显示优先级返回读音可用的截图路径：临时图片 > 已提交的最新一张"""
+    paths = []
+    temp_path = pron.get("imported_source_path", "")
+    if temp_path and os.path.exists(temp_path):
+        paths.append(temp_path)
+    if pron.get("imported_image"):
+        img_path = os.path.join(input_dir, pron["imported_image"][-1])
+        if img_path != temp_path and os.path.exists(img_path):
+            paths.append(img_path)
+    return paths
+
+
+def record_thumbnail_items(record, pron_index=None, input_dir="output_image"):
+    """
+    缩略图条显示的(路径, 是否为未提交的截图)列表：每个读音先列未提交的截图，再按顺序列出全部已提交截图。
+
+    pron_index为None时包含页面中的全部读音。
+    """
+    prons = record.get("pronunciations") or []
+    if pron_index is not None:
+        prons = prons[pron_index:pron_index + 1]
+    items = []
+    seen = set()
+    for pron in prons:
+        committed = [os.path.join(input_dir, name) for name in pron.get("imported_image") or [] if name]
+        temp_path = pron.get("imported_source_path", "")
+        candidates = [(path, False) for path in committed]
+        if temp_path and normalize_reference(temp_path) not in {normalize_reference(p) for p in committed}:
+            candidates.insert(0, (temp_path, True))
+        for path, pending in candidates:
+            key = normalize_reference(path)
+            if key not in seen:
+                seen.add(key)
+                items.append((path, pending))
+    return items
+
+
+def plan_submission(record, input_dir="output_image"):
+    """
+    为记录中新导入的截图分配output_image中的文件名并更新记录，返回(移动列表, 待删除列表)。
+
+    先检查所有源文件，有文件缺失时抛出FileNotFoundError且不修改记录。
+    """
+    pending = []
+    for pron in record["pronunciations"]:
+        temp_source = pron.get("imported_source_path", "")
+        old_source_path = pron.get("old_image_path", "")
+        if temp_source == old_source_path:
+            continue  # 没有需要处理的文件
+        if not os.path.exists(temp_source):
+            raise FileNotFoundError(
+                f"找不到文件\n读音：{pron.get('zhuang_spelling', '未知')}\n原路径：{temp_source}")
+        pending.append(pron)
+
+    moves = []  # (源路径, 目标路径)
+    removes = []  # 提交完成后删除的旧文件
+    for pron in pending:
+        temp_source = pron["imported_source_path"]
+        old_source_path = pron.get("old_image_path", "")
+        # 生成时间戳（每个文件独立）
+        timestamp = datetime.now().strftime("%Y%m%d%H%M%S%f")#怎么生成毫秒级时间戳 a:datetime.now()返回当前日期和时间。strftime()方法用于将日期时间对象转换为字符串。
+
+        # 获取读音名称并清理非法字符
+        pron_name = pron.get("zhuang_spelling", "unnamed")
+        pron_name_clean = re.sub(r'[\\/*?:"<>|]', "", pron_name)
+
+        # 处理文件扩展名
+        _, ext = os.path.splitext(temp_source)
+        ext = ext if ext else ".jpg"
+
+        # 生成新文件名和路径
+        new_filename = f"{pron_name_clean}_{timestamp}{ext}"
+        dest_path = os.path.join(input_dir, new_filename)
+        moves.append((temp_source, dest_path))
+
+        # 更新数据
+        pron["imported_source_path"] = dest_path
+        pron["old_image_path"] = dest_path
+        pron["imported_image"] = [new_filename]
+
+        # 删除旧的source文件（如果与新文件不同）
+        if old_source_path and old_source_path != dest_path:
+            removes.append(old_source_path)
+    return moves, removes
+
+
+class StageTimer:
+    """按阶段记录耗时（毫秒）"""
+
+    def __init__(self):
+        self.timings = OrderedDict()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            with TRACER.span(name):
+                yield
+        finally:
+            self.timings[name] = (time.perf_counter() - start) * 1000
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "category", "args", "start")
+
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.args = dict(self.args or {}, error=f"{exc_type.__name__}: {exc}")
+        self.tracer.record(self.name, self.category, self.start, time.perf_counter() - self.start, self.args)
+        return False
+
+
+class Tracer:
+    """
+    界面回调和内部阶段（解码、缩略图、JSON读写、文件移动等）的耗时追踪。
+
+    事件保存在定长的环形缓冲中，超过slow_ms的界面回调在控制台提示；可以导出Chrome trace-event JSON
+    （用chrome://tracing或ui.perfetto.dev打开）以及按事件名统计的分位数。
+    未开启时span()返回同一个空上下文、wrap()原样返回函数，几乎没有开销。
+    """
+
+    def __init__(self, enabled=False, capacity=20000, slow_ms=200):
+        self.enabled = enabled
+        self.slow_ms = slow_ms
+        self.events = deque(maxlen=capacity)
+        self._origin = time.perf_counter()
+        self._threads = {}
+
+    def configure(self, enabled, capacity=20000, slow_ms=200):
+        self.enabled = enabled
+        self.slow_ms = slow_ms
+        self.events = deque(self.events, maxlen=capacity)
+
+    def span(self, name, category="stage", **args):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, category, args or None)
+
+    def wrap(self, func, name=None, category="callback"):
+        """返回计时的func，用于按钮command、事件绑定等界面回调"""
+        if not self.enabled:
+            return func
+        name = name or func.__name__
+
+        def traced(*args, **kwargs):
+            with _Span(self, name, category, None):
+                return func(*args, **kwargs)
+
+        traced.__name__ = name
+        return traced
+
+    def record(self, name, category, start, duration, args=None):
+        thread = threading.current_thread()
+        self._threads[thread.ident] = thread.name
+        # deque.append线程安全，后台线程的阶段也记录在同一个缓冲中
+        self.events.append((name, category, start - self._origin, duration, thread.ident, args))
+        if category == "callback" and duration * 1000 > self.slow_ms:
+            print(f"界面回调过慢: {name} {duration * 1000:.0f}ms")
+
+    def instant(self, name, **args):
+        """记录一个瞬时事件（例如错误）"""
+        if self.enabled:
+            self.record(name, "instant", time.perf_counter(), 0.0, args or None)
+
+    def chrome_trace(self):
+        trace_events = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}}
+                        for tid, name in self._threads.items()]
+        for name, category, start, duration, tid, args in list(self.events):
+            event = {"name": name, "cat": category, "pid": os.getpid(), "tid": tid, "ts": round(start * 1e6, 1)}
+            if category == "instant":
+                event.update(ph="i", s="t")
+            else:
+                event.update(ph="X", dur=round(duration * 1e6, 1))
+            if args:
+                event["args"] = args
+            trace_events.append(event)
+        return {"traceEvents": trace_events, "displayTimeUnit": "ms"}
+
+    def summary(self):
+        return summarize_trace_events(self.chrome_trace()["traceEvents"])
+
+    def export(self, directory="traces"):
+        """写入trace_<时间>.json和对应的summary_<时间>.json，返回trace文件路径"""
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        trace_path = os.path.join(directory, f"trace_{stamp}.json")
+        trace = self.chrome_trace()
+        write_json_atomic(trace_path, trace, ensure_ascii=False)
+        write_json_atomic(os.path.join(directory, f"summary_{stamp}.json"),
+                          summarize_trace_events(trace["traceEvents"]), ensure_ascii=False, indent=2)
+        return trace_path
+
+
+def summarize_trace_events(trace_events):
+    """按(类别, 事件名)汇总Chrome trace中各事件的耗时分位数，按合计耗时从大到小排列"""
+    samples = {}
+    for event in trace_events:
+        if event.get("ph") == "X":
+            samples.setdefault(f"{event.get('cat', '')}:{event['name']}", []).append(event["dur"] / 1000)
+    summary = {key: summarize_timings(values) for key, values in samples.items()}
+    return dict(sorted(summary.items(), key=lambda item: -item[1]["total_ms"]))
+
+
+TRACER = Tracer()
+
+
+class ImageDirectoryIndex:
+    """
+    image目录的持久化索引。
+
+    索引记录每个文件解析出的(页, 序号)以及mtime/size，并保存排好序的文件列表。
+    目录mtime未变化时只需一次stat即可直接使用上次的顺序；否则用os.scandir增量刷新，
+    只重新解析新增或变化的文件。不符合命名规则的文件放入fallback，按文件名排在最后。
+    """
+
+    VERSION = 2  # 2: 加入.webp，旧索引需要重新扫描
+
+    def __init__(self, image_dir="image", index_path=None):
+        self.image_dir = image_dir
+        self.index_path = index_path or os.path.join(CACHE_DIR, "image_index.json")
+        self.files = {}  # 文件名 -> {"key": [页, 序号]或None, "mtime": ns, "size": 字节}
+        self.order = []
+        self.dir_mtime = None
+        self._load()
+
+    @property
+    def fallback(self):
+        return [name for name in self.order if self.files[name]["key"] is None]
+
+    def _load(self):
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") != self.VERSION or data.get("image_dir") != self.image_dir:
+                return
+            self.files = data["files"]
+            self.order = data["order"]
+            self.dir_mtime = data["dir_mtime"]
+        except Exception as e:
+            print(f"图片索引读取失败，将重新扫描: {str(e)}")
+            self.files, self.order, self.dir_mtime = {}, [], None
+
+    def _save(self):
+        write_json_atomic(self.index_path, {
+            "version": self.VERSION,
+            "image_dir": self.image_dir,
+            "dir_mtime": self.dir_mtime,
+            "files": self.files,
+            "order": self.order
+        }, ensure_ascii=False)
+
+    @staticmethod
+    def _order_key(item):
+        name, key = item
+        if key is None:
+            return (1, 0, 0, name)
+        return (0, key[0], key[1], name)
+
+    def refresh(self):
+        """返回按(页, 序号)排好序的图片路径列表"""
+        try:
+            dir_mtime = os.stat(self.image_dir).st_mtime_ns
+        except OSError:
+            return []
+        if dir_mtime == self.dir_mtime:
+            return self.paths()
+
+        files = {}
+        changed = False
+        with os.scandir(self.image_dir) as it:
+            for entry in it:
+                if entry.name.startswith(".") or not entry.is_file():
+                    continue
+                if os.path.splitext(entry.name)[1].lower() not in IMAGE_EXTENSIONS:
+                    continue
+                st = entry.stat()
+                old = self.files.get(entry.name)
+                if old and old["mtime"] == st.st_mtime_ns and old["size"] == st.st_size:
+                    files[entry.name] = old
+                    continue
+                key = parse_image_key(entry.name)
+                files[entry.name] = {
+                    "key": list(key) if key else None,
+                    "mtime": st.st_mtime_ns,
+                    "size": st.st_size
+                }
+                changed = True
+
+        if changed or files.keys() != self.files.keys():
+            self.files = files
+            self.order = [name for name, _ in sorted(
+                ((name, info["key"]) for name, info in files.items()), key=self._order_key)]
+        self.dir_mtime = dir_mtime
+        try:
+            self._save()
+        except Exception as e:
+            print(f"图片索引保存失败: {str(e)}")
+        return self.paths()
+
+    def paths(self):
+        return [os.path.join(self.image_dir, name) for name in self.order]
+
+
+class FileAnnotationStore:
+    """默认存储方式：每张图片一个output/<图片名>.json，内容为[记录]"""
+
+    name = "file"
+
+    def __init__(self, output_dir="output"):
+        self.output_dir = output_dir
+        self._lock = threading.Lock()
+
+    def path_for(self, stem):
+        return os.path.join(self.output_dir, f"{stem}.json")
+
+    def describe(self, stem):
+        return self.path_for(stem)
+
+    def load(self, stem):
+        path = self.path_for(stem)
+        if not os.path.exists(path):
+            return None
+        with TRACER.span("json_load"), open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if isinstance(data, list) and len(data) > 0:
+            return data[0]
+        return None
+
+    def version(self, stem):
+        """记录的版本号（文件的inode、修改时间和大小），记录不存在时返回None"""
+        try:
+            st = os.stat(self.path_for(stem))
+        except FileNotFoundError:
+            return None
+        return f"{st.st_ino}:{st.st_mtime_ns}:{st.st_size}"
+
+    def versions(self):
+        """{图片名: version()}"""
+        return {stem: self.version(stem) for stem in self.stems()}
+
+    def updated_at(self, stem):
+        """最后一次提交的时间（秒），取文件的修改时间，记录不存在时返回None"""
+        try:
+            return os.path.getmtime(self.path_for(stem))
+        except FileNotFoundError:
+            return None
+
+    def save(self, stem, record):
+        with self._lock, TRACER.span("json_dump"):
+            write_json_atomic(self.path_for(stem), [record], ensure_ascii=False, indent=2)
+
+    def stems(self):
+        if not os.path.isdir(self.output_dir):
+            return []
+        result = []
+        with os.scandir(self.output_dir) as it:
+            for entry in it:
+                stem, ext = os.path.splitext(entry.name)
+                if ext == ".json" and not entry.name.startswith("."):
+                    result.append(stem)
+        return result
+
+    def items(self):
+        for stem in self.stems():
+            record = self.load(stem)
+            if record is not None:
+                yield stem, record
+
+    def close(self):
+        pass
+
+
+class JsonlAnnotationStore:
+    """
+    追加写入的JSONL日志，每行{"image": 图片名, "data": 记录, "time": 提交时间}，同一图片以最后一行为准。
+
+    偏移索引保存在<日志>.idx中并记录对应的日志长度，启动时只需补扫描新增部分。
+    多个程序可以同时打开同一日志：追加时持有<日志>.lease文件锁，先补读其他程序追加的行再写到文件末尾；
+    只有在持锁时确认末尾是未写完的残行（写入者崩溃留下）才截断。读取和version()前都会补读新增的行，
+    因此版本号（记录所在行的偏移）在各程序之间一致。
+    """
+
+    name = "jsonl"
+    LOCK_TTL = 30  # 追加锁的有效期（秒），持锁程序崩溃后超时可被接管
+
+    def __init__(self, output_dir="output", filename="annotations.jsonl"):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, filename)
+        self.index_path = self.path + ".idx"
+        self._lock = threading.Lock()
+        self.offsets = {}
+        self._indexed_size = 0
+        self._append_lock = None
+        self._load_index()
+        with self._lock:
+            self._scan_tail()
+
+    def describe(self, stem):
+        return self.path
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if os.path.exists(self.path) and data["size"] <= os.path.getsize(self.path):
+                self.offsets = data["offsets"]
+                self._indexed_size = data["size"]
+        except Exception as e:
+            print(f"JSONL索引读取失败，将重新扫描: {str(e)}")
+
+    def _scan_tail(self):
+        """补读_indexed_size之后的完整行（调用方持有self._lock），末尾未写完的行留到持锁追加时处理"""
+        try:
+            if os.path.getsize(self.path) == self._indexed_size:
+                return
+        except FileNotFoundError:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self._indexed_size)
+            offset = self._indexed_size
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # 末尾未写完的行：可能是其他程序正在写入
+                try:
+                    self.offsets[json.loads(line)["image"]] = offset
+                except Exception as e:
+                    print(f"JSONL记录损坏，已跳过（偏移{offset}）: {str(e)}")
+                offset += len(line)
+        self._indexed_size = offset
+
+    def _save_index(self):
+        write_json_atomic(self.index_path, {"size": self._indexed_size, "offsets": self.offsets},
+                          ensure_ascii=False)
+
+    def _read_line(self, stem):
+        with self._lock:
+            self._scan_tail()
+            offset = self.offsets.get(stem)
+        if offset is None:
+            return None
+        with TRACER.span("json_load"), open(self.path, "rb") as f:
+            f.seek(offset)
+            return json.loads(f.readline())
+
+    def load(self, stem):
+        line = self._read_line(stem)
+        return line["data"] if line else None
+
+    def versions(self):
+        """{图片名: version()}"""
+        with self._lock:
+            self._scan_tail()
+            return dict(self.offsets)
+
+    def updated_at(self, stem):
+        """最后一次提交的时间（秒），旧版本写入的行没有记录时返回None"""
+        line = self._read_line(stem)
+        return line.get("time") if line else None
+
+    def version(self, stem):
+        """以记录所在行的偏移作为版本号，先补读其他程序追加的行"""
+        with self._lock:
+            self._scan_tail()
+            return self.offsets.get(stem)
+
+    def save(self, stem, record):
+        line = {"image": stem, "data": record, "time": time.time()}
+        data = (json.dumps(line, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock, TRACER.span("json_dump"):
+            os.makedirs(self.output_dir, exist_ok=True)
+            if self._append_lock is None:
+                owner = f"{platform.node()}:{os.getpid()}:{uuid.uuid4().hex}"
+                self._append_lock = LeaseManager(self.output_dir, owner, self.LOCK_TTL)
+            with self._append_lock.locked(os.path.basename(self.path)):
+                self._scan_tail()
+                with open(self.path, "ab") as f:
+                    if f.tell() > self._indexed_size:
+                        # 持锁时没有其他写入者，剩下的不完整内容只能是崩溃留下的残行
+                        print(f"JSONL末尾有未写完的记录，已截断（偏移{self._indexed_size}）")
+                        f.truncate(self._indexed_size)
+                        f.seek(self._indexed_size)
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                self.offsets[stem] = self._indexed_size
+                self._indexed_size += len(data)
+
+    def stems(self):
+        with self._lock:
+            self._scan_tail()
+            return list(self.offsets)
+
+    def items(self):
+        with self._lock:
+            self._scan_tail()
+            offsets = sorted(self.offsets.items(), key=lambda item: item[1])
+        if not offsets:
+            return
+        with open(self.path, "rb") as f:
+            for stem, offset in offsets:
+                f.seek(offset)
+                yield stem, json.loads(f.readline())["data"]
+
+    def close(self):
+        with self._lock:
+            if self.offsets or os.path.exists(self.index_path):
+                self._save_index()
+
+
+class SqliteAnnotationStore:
+    """单个SQLite数据库，表annotations以图片名为主键"""
+
+    name = "sqlite"
+
+    def __init__(self, output_dir="output", filename="annotations.sqlite3"):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, filename)
+        os.makedirs(output_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS annotations ("
+            "image TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self.conn.commit()
+
+    def describe(self, stem):
+        return f"{self.path} ({stem})"
+
+    def load(self, stem):
+        with self._lock, TRACER.span("json_load"):
+            row = self.conn.execute("SELECT data FROM annotations WHERE image = ?", (stem,)).fetchone()
+            return json.loads(row[0]) if row else None
+
+    def version(self, stem):
+        with self._lock:
+            row = self.conn.execute("SELECT updated_at FROM annotations WHERE image = ?", (stem,)).fetchone()
+        return row[0] if row else None
+
+    def versions(self):
+        """{图片名: version()}"""
+        with self._lock:
+            return dict(self.conn.execute("SELECT image, updated_at FROM annotations"))
+
+    def updated_at(self, stem):
+        """最后一次提交的时间（秒），与version()相同取updated_at列"""
+        return self.version(stem)
+
+    def save(self, stem, record):
+        data = json.dumps(record, ensure_ascii=False)
+        with self._lock, TRACER.span("json_dump"):
+            self.conn.execute(
+                "INSERT OR REPLACE INTO annotations (image, data, updated_at) VALUES (?, ?, ?)",
+                (stem, data, time.time())
+            )
+            self.conn.commit()
+
+    def stems(self):
+        with self._lock:
+            return [row[0] for row in self.conn.execute("SELECT image FROM annotations")]
+
+    def items(self):
+        with self._lock:
+            rows = self.conn.execute("SELECT image, data FROM annotations").fetchall()
+        for stem, data in rows:
+            yield stem, json.loads(data)
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+ANNOTATION_STORES = {
+    FileAnnotationStore.name: FileAnnotationStore,
+    JsonlAnnotationStore.name: JsonlAnnotationStore,
+    SqliteAnnotationStore.name: SqliteAnnotationStore,
+}
+
+
+def open_annotation_store(backend="file", output_dir="output"):
+    """按名称打开标注存储，backend为file/jsonl/sqlite之一"""
+    if backend not in ANNOTATION_STORES:
+        raise ValueError(f"未知的存储方式: {backend}，可选: {', '.join(ANNOTATION_STORES)}")
+    return ANNOTATION_STORES[backend](output_dir)
+
+
+def migrate_annotations(source, target):
+    """把source中的全部记录写入target，返回迁移条数"""
+    count = 0
+    for stem, record in source.items():
+        target.save(stem, record)
+        count += 1
+    return count
+
+
+EXPORT_FORMATS = ("jsonl", "csv", "sqlite")
+EXPORT_CSV_COLUMNS = [
+    "image", "annotator", "page_num", "word_num", "simplified_Chinese_character",
+    "pronunciation_index", "zhuang_spelling", "ipa", "dialect_type", "imported_image",
+    "entry_index", "part_of_speech", "meaning", "example_index", "example_zhuang", "example_chinese"
+]
+
+
+def list_annotation_files(output_dir="output"):
+    """返回output目录中的(路径, 图片名, mtime)，按sort_key排序"""
+    files = []
+    if not os.path.isdir(output_dir):
+        return files
+    with os.scandir(output_dir) as it:
+        for entry in it:
+            stem, ext = os.path.splitext(entry.name)
+            if ext == ".json" and not entry.name.startswith("."):
+                files.append((entry.path, stem, entry.stat().st_mtime_ns))
+    files.sort(key=lambda item: ImageViewerApp.sort_key(item[0]))
+    return files
+
+
+def annotation_versions(store):
+    """
+    逐个产出(图片名, 版本标记)，派生索引据此增量刷新：file存储为文件的mtime（纳秒，扫描目录一次即可得到），
+    其他存储为store.version()。
+    """
+    if isinstance(store, FileAnnotationStore):
+        for _, stem, mtime in list_annotation_files(store.output_dir):
+            yield stem, mtime
+    else:
+        yield from store.versions().items()
+
+
+def derived_cache_path(name, output_dir):
+    """派生索引在cache中的路径，按output目录区分（cache/<名称>_<目录哈希>.json）"""
+    digest = hashlib.sha1(os.path.abspath(output_dir).encode("utf-8")).hexdigest()[:12]
+    return os.path.join(CACHE_DIR, f"{name}_{digest}.json")
+
+
+def read_annotation_file(path):
+    """读取单个标注文件，返回记录列表"""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return data if isinstance(data, list) else [data]
+
+
+def _read_annotation_file_safe(path):
+    # 进程池中执行，异常以字符串返回，避免一个坏文件中断整个导出
+    try:
+        return read_annotation_file(path), None
+    except Exception as e:
+        return None, str(e)
+
+
+def iter_parsed_annotation_files(files, workers=None, batch_size=512):
+    """
+    按files的顺序逐个产出(图片名, mtime, 记录列表, 错误)。
+
+    workers大于1时用进程池并行解析，分批提交，内存中最多只保留一批结果。
+    """
+    if workers == 1:
+        for path, stem, mtime in files:
+            records, error = _read_annotation_file_safe(path)
+            yield stem, mtime, records, error
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for start in range(0, len(files), batch_size):
+            batch = files[start:start + batch_size]
+            results = pool.map(_read_annotation_file_safe, [path for path, _, _ in batch], chunksize=32)
+            for (path, stem, mtime), (records, error) in zip(batch, results):
+                yield stem, mtime, records, error
+
+
+def flatten_annotation_rows(record):
+    """把一条嵌套记录展开为CSV行，每个例句一行"""
+    page_info = record.get("page_info") or {}
+    base = {
+        "image": record.get("image", ""),
+        "annotator": record.get("annotator", ""),
+        "page_num": page_info.get("page_num", ""),
+        "word_num": page_info.get("word_num", ""),
+        "simplified_Chinese_character": record.get("simplified_Chinese_character", ""),
+    }
+    for p_index, pron in enumerate(record.get("pronunciations") or []):
+        pron_row = dict(base, pronunciation_index=p_index,
+                        zhuang_spelling=pron.get("zhuang_spelling", ""),
+                        ipa=pron.get("ipa", ""),
+                        dialect_type=pron.get("dialect_type", 0),
+                        imported_image="|".join(pron.get("imported_image") or []))
+        for e_index, entry in enumerate(pron.get("entries") or []):
+            entry_row = dict(pron_row, entry_index=e_index,
+                             part_of_speech=entry.get("part_of_speech", ""),
+                             meaning=entry.get("meaning", ""))
+            for x_index, example in enumerate(entry.get("examples") or []):
+                yield dict(entry_row, example_index=x_index,
+                           example_zhuang=example.get("壮文", ""),
+                           example_chinese=example.get("中文", ""))
+
+
+class AnnotationExportWriter:
+    """
+    导出目标文件，先写临时文件，close时整体替换，导出中断不会破坏旧结果。
+
+    compact为True时jsonl/sqlite中的记录去掉默认值且不缩进；compression可对jsonl/csv使用gzip或lzma压缩。
+    """
+
+    def __init__(self, fmt, out_path, compact=False, compression=None):
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"未知的导出格式: {fmt}，可选: {', '.join(EXPORT_FORMATS)}")
+        if compression not in RECORD_COMPRESSIONS:
+            raise ValueError(f"未知的压缩方式: {compression}")
+        if compression and fmt == "sqlite":
+            raise ValueError("sqlite导出不支持压缩")
+        self.fmt = fmt
+        self.compact = compact
+        self.out_path = out_path
+        self.tmp_path = out_path + ".tmp"
+        self.count = 0
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+        os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+        if fmt == "sqlite":
+            self.conn = sqlite3.connect(self.tmp_path)
+            self.conn.execute(
+                "CREATE TABLE records (seq INTEGER PRIMARY KEY, image TEXT, page INTEGER, crop INTEGER, "
+                "annotator TEXT, data TEXT NOT NULL)"
+            )
+        else:
+            opener = {None: open, "gzip": gzip.open, "lzma": lzma.open}[compression]
+            self.file = opener(self.tmp_path, "wt", encoding="utf-8", newline="")
+            if fmt == "csv":
+                self.csv_writer = csv.DictWriter(self.file, fieldnames=EXPORT_CSV_COLUMNS)
+                self.csv_writer.writeheader()
+
+    def _encode(self, record):
+        if self.compact:
+            return json.dumps(Annotation.from_dict(record).to_compact(), ensure_ascii=False, separators=(",", ":"))
+        return json.dumps(record, ensure_ascii=False)
+
+    def write(self, stem, records):
+        key = parse_image_key(stem)
+        for record in records:
+            if self.fmt == "jsonl":
+                self.file.write(self._encode(record) + "\n")
+            elif self.fmt == "csv":
+                self.csv_writer.writerows(flatten_annotation_rows(record))
+            else:
+                self.conn.execute(
+                    "INSERT INTO records (image, page, crop, annotator, data) VALUES (?, ?, ?, ?, ?)",
+                    (stem, key[0] if key else None, key[1] if key else None,
+                     record.get("annotator", ""), self._encode(record))
+                )
+            self.count += 1
+
+    def close(self):
+        if self.fmt == "sqlite":
+            self.conn.execute("CREATE INDEX idx_records_image ON records (image)")
+            self.conn.commit()
+            self.conn.close()
+        else:
+            self.file.close()
+        os.replace(self.tmp_path, self.out_path)
+
+    def abort(self):
+        if self.fmt == "sqlite":
+            self.conn.close()
+        else:
+            self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+class ExportState:
+    """
+    增量导出的状态缓存（cache/export_state.sqlite3）。
+
+    按导出目标记录每个标注文件的mtime和解析后的记录，增量导出时只重新解析mtime变化的文件，
+    其余记录直接从缓存按页数/序号顺序流式写出。
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(CACHE_DIR, "export_state.sqlite3")
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS exported (target TEXT, image TEXT, mtime INTEGER, page INTEGER, "
+            "crop INTEGER, records TEXT, PRIMARY KEY (target, image))"
+        )
+
+    def mtimes(self, target):
+        rows = self.conn.execute("SELECT image, mtime FROM exported WHERE target = ?", (target,))
+        return dict(rows.fetchall())
+
+    def update(self, target, stem, mtime, records):
+        key = parse_image_key(stem)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO exported (target, image, mtime, page, crop, records) VALUES (?, ?, ?, ?, ?, ?)",
+            (target, stem, mtime, key[0] if key else None, key[1] if key else None,
+             json.dumps(records, ensure_ascii=False))
+        )
+
+    def remove(self, target, stems):
+        self.conn.executemany("DELETE FROM exported WHERE target = ? AND image = ?",
+                              [(target, stem) for stem in stems])
+
+    def iter_records(self, target):
+        # 与sort_key一致：先页数再序号，不符合命名的文件排在最后
+        rows = self.conn.execute(
+            "SELECT image, records FROM exported WHERE target = ? "
+            "ORDER BY page IS NULL, page, crop, image", (target,)
+        )
+        for stem, records in rows:
+            yield stem, json.loads(records)
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+def export_annotations(fmt, out_path, output_dir="output", incremental=False, workers=None,
+                       compact=False, compression=None):
+    """
+    把output目录中的标注文件合并导出为jsonl/csv/sqlite，返回统计信息。
+
+    incremental为True时只重新解析mtime变化的文件。
+    """
+    files = list_annotation_files(output_dir)
+    stats = {"files": len(files), "parsed": 0, "removed": 0, "errors": [], "records": 0}
+    writer = AnnotationExportWriter(fmt, out_path, compact, compression)
+    try:
+        if not incremental:
+            for stem, _, records, error in iter_parsed_annotation_files(files, workers):
+                stats["parsed"] += 1
+                if error:
+                    stats["errors"].append((stem, error))
+                    continue
+                writer.write(stem, records)
+        else:
+            target = os.path.abspath(out_path)
+            state = ExportState()
+            try:
+                known = state.mtimes(target)
+                changed = [item for item in files if known.get(item[1]) != item[2]]
+                current = {stem for _, stem, _ in files}
+                removed = [stem for stem in known if stem not in current]
+                state.remove(target, removed)
+                stats["removed"] = len(removed)
+                for stem, mtime, records, error in iter_parsed_annotation_files(changed, workers):
+                    stats["parsed"] += 1
+                    if error:
+                        stats["errors"].append((stem, error))
+                        continue
+                    state.update(target, stem, mtime, records)
+                state.commit()
+                for stem, records in state.iter_records(target):
+                    writer.write(stem, records)
+            finally:
+                state.close()
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+    stats["records"] = writer.count
+    return stats
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def perceptual_hash(img, hash_size=16):
+    """差值感知哈希(dHash)：缩成(hash_size+1)xhash_size灰度图，比较相邻像素，返回hash_size²位的bytes"""
+    if np is None:
+        return None
+    gray = img.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = np.asarray(gray, dtype=np.int16)
+    return np.packbits(pixels[:, 1:] > pixels[:, :-1]).tobytes()
+
+
+def hamming_distances(hashes, query):
+    """hashes为(N, 字节数)的uint8数组，返回每行与query的汉明距离"""
+    query = np.frombuffer(query, dtype=np.uint8)
+    return np.unpackbits(np.bitwise_xor(hashes, query), axis=1).sum(axis=1)
+
+
+def images_nearly_identical(path_a, path_b, tolerance=32, max_fraction=0.0001):
+    """
+    逐像素核对两张同尺寸图片：灰度差超过tolerance的像素比例不超过max_fraction时视为同一截图。
+    感知哈希分不清只差一个字母的词条，因此只用它找候选，最终以像素比较为准（只容忍压缩噪声）。
+    """
+    with Image.open(path_a) as img_a, Image.open(path_b) as img_b:
+        if img_a.size != img_b.size:
+            return False
+        a = np.asarray(img_a.convert("L"), dtype=np.int16)
+        b = np.asarray(img_b.convert("L"), dtype=np.int16)
+    return np.count_nonzero(np.abs(a - b) > tolerance) <= a.size * max_fraction
+
+
+def hash_image_file(path):
+    """计算(文件名, sha256, 感知哈希, 宽, 高)，供进程池批量调用"""
+    with Image.open(path) as img:
+        width, height = img.size
+        phash = perceptual_hash(img)
+    return os.path.basename(path), file_sha256(path), phash, width, height
+
+
+class OutputImageIndex:
+    """
+    output_image的内容寻址索引（output_image/.content_index.sqlite3）。
+
+    按sha256识别完全相同的截图，按感知哈希找出候选并逐像素核对几乎相同的截图（同音截图重复截取），
+    相同内容只保存一份，多个imported_image共用同一个文件并记录引用数，引用数归零时才删除。
+    感知哈希按16位分段建桶，只和至少一段完全相同的候选做向量化的汉明距离比较。
+
+    提交日志重放时同一步骤可能执行两次：add/release带上op（提交编号和步骤）时，已计入的引用数变化
+    记录在ops表中，重复执行不会再次加减引用数；提交完成后由finish_job清除。
+    """
+
+    BANDS = 16
+
+    def __init__(self, image_dir="output_image", threshold=10, db_path=None):
+        self.image_dir = image_dir
+        self.threshold = threshold
+        os.makedirs(image_dir, exist_ok=True)
+        self.db_path = db_path or os.path.join(image_dir, ".content_index.sqlite3")
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS files (name TEXT PRIMARY KEY, sha256 TEXT NOT NULL, phash BLOB, "
+            "width INTEGER, height INTEGER, refs INTEGER NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_files_sha256 ON files (sha256)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS ops (job TEXT NOT NULL, op TEXT NOT NULL, PRIMARY KEY (job, op))")
+        self.conn.commit()
+        self._bands = {}  # (段序号, 段内容) -> [文件名]
+        self._phashes = {}  # 文件名 -> (感知哈希, 宽, 高)
+        for name, phash, width, height in self.conn.execute("SELECT name, phash, width, height FROM files"):
+            self._remember(name, phash, width, height)
+
+    def _band_keys(self, phash):
+        step = len(phash) // self.BANDS
+        return [(i, phash[i * step:(i + 1) * step]) for i in range(self.BANDS)]
+
+    def _remember(self, name, phash, width, height):
+        if phash is None:
+            return
+        self._phashes[name] = (phash, width, height)
+        for key in self._band_keys(phash):
+            self._bands.setdefault(key, []).append(name)
+
+    def _forget(self, name):
+        entry = self._phashes.pop(name, None)
+        if entry:
+            for key in self._band_keys(entry[0]):
+                names = self._bands.get(key)
+                if names and name in names:
+                    names.remove(name)
+
+    def find_duplicate(self, sha256, phash, width, height, path=None):
+        """返回内容相同或几乎相同的已有文件名，没有时返回None；path为待比较的图片，用于逐像素核对"""
+        for (name,) in self.conn.execute("SELECT name FROM files WHERE sha256 = ?", (sha256,)):
+            if os.path.exists(os.path.join(self.image_dir, name)):
+                return name
+        if phash is None or np is None or self.threshold <= 0 or path is None:
+            return None
+        candidates = {name for key in self._band_keys(phash) for name in self._bands.get(key, ())}
+        candidates = [name for name in candidates
+                      if self._phashes[name][1] == width and self._phashes[name][2] == height]
+        if not candidates:
+            return None
+        hashes = np.frombuffer(b"".join(self._phashes[name][0] for name in candidates), dtype=np.uint8)
+        distances = hamming_distances(hashes.reshape(len(candidates), -1), phash)
+        for i in distances.argsort():
+            if distances[i] > self.threshold:
+                break
+            candidate_path = os.path.join(self.image_dir, candidates[i])
+            if os.path.exists(candidate_path) and images_nearly_identical(candidate_path, path):
+                return candidates[i]
+        return None
+
+    def _claim_op(self, op):
+        """op为(提交编号, 步骤)，第一次执行时记录并返回True，已执行过返回False；op为None时总是True"""
+        if op is None:
+            return True
+        return self.conn.execute("INSERT OR IGNORE INTO ops (job, op) VALUES (?, ?)", op).rowcount > 0
+
+    def add(self, src, dest, op=None):
+        """
+        把src存入output_image（目标文件名为dest）。已有相同内容时不移动，返回(已有文件路径, True)，
+        src由调用方在记录保存后删除；否则移动到dest并返回(dest, False)。
+        """
+        name, sha256, phash, width, height = hash_image_file(src)
+        with self._lock:
+            existing = self.find_duplicate(sha256, phash, width, height, src)
+            if existing:
+                if self._claim_op(op):
+                    self.conn.execute("UPDATE files SET refs = refs + 1 WHERE name = ?", (existing,))
+                self.conn.commit()
+                return os.path.join(self.image_dir, existing), True
+            shutil.move(src, dest)
+            self._register(os.path.basename(dest), sha256, phash, width, height)
+            self.conn.commit()
+            return dest, False
+
+    def _register(self, name, sha256, phash, width, height, refs=1):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO files (name, sha256, phash, width, height, refs) VALUES (?, ?, ?, ?, ?, ?)",
+            (name, sha256, phash, width, height, refs)
+        )
+        self._remember(name, phash, width, height)
+
+    def release(self, path, op=None):
+        """不再引用path：索引中的文件引用数减一，归零时删除；索引外的文件直接删除。返回是否删除了文件"""
+        if not os.path.exists(path):
+            return False
+        with self._lock:
+            row = None
+            if os.path.abspath(os.path.dirname(path)) == os.path.abspath(self.image_dir):
+                name = os.path.basename(path)
+                row = self.conn.execute("SELECT refs FROM files WHERE name = ?", (name,)).fetchone()
+            if row is not None and not self._claim_op(op):
+                self.conn.commit()
+                return False  # 重放日志时已经减过
+            if row is not None and row[0] > 1:
+                self.conn.execute("UPDATE files SET refs = refs - 1 WHERE name = ?", (name,))
+                self.conn.commit()
+                return False
+            if row is not None:
+                self.conn.execute("DELETE FROM files WHERE name = ?", (name,))
+                self.conn.commit()
+                self._forget(name)
+            os.remove(path)
+            return True
+
+    def finish_job(self, job_id):
+        """提交完成后清除其步骤记录"""
+        with self._lock:
+            self.conn.execute("DELETE FROM ops WHERE job = ?", (job_id,))
+            self.conn.commit()
+
+    def prune_jobs(self, active):
+        """清除不在active（仍待重放的提交编号）中的步骤记录，例如完成后来不及清除的"""
+        active = set(active)
+        with self._lock:
+            stale = [(job,) for (job,) in self.conn.execute("SELECT DISTINCT job FROM ops") if job not in active]
+            self.conn.executemany("DELETE FROM ops WHERE job = ?", stale)
+            self.conn.commit()
+
+    def discard(self, path):
+        """删除没有任何记录引用的文件及其索引项（不论索引中的引用数）"""
+        name = os.path.basename(path)
+        with self._lock:
+            self.conn.execute("DELETE FROM files WHERE name = ?", (name,))
+            self.conn.commit()
+            self._forget(name)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def rebuild(self, entries, refs):
+        """用批量去重的结果重建索引：entries为hash_image_file的结果，refs为文件名->引用数"""
+        with self._lock:
+            self.conn.execute("DELETE FROM files")
+            self.conn.executemany(
+                "INSERT INTO files (name, sha256, phash, width, height, refs) VALUES (?, ?, ?, ?, ?, ?)",
+                [(name, sha, phash, width, height, max(1, refs.get(name, 0)))
+                 for name, sha, phash, width, height in entries]
+            )
+            self.conn.commit()
+            self._bands, self._phashes = {}, {}
+            for name, _, phash, width, height in entries:
+                self._remember(name, phash, width, height)
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+def replace_image_references(record, renames, image_dir="output_image"):
+    """把记录中引用的output_image文件名按renames（旧文件名->新文件名）替换，返回是否有修改"""
+    changed = False
+    for pron in record.get("pronunciations") or []:
+        images = pron.get("imported_image") or []
+        new_images = [renames.get(name, name) for name in images]
+        if new_images != images:
+            pron["imported_image"] = new_images
+            changed = True
+        for key in ("imported_source_path", "old_image_path"):
+            path = pron.get(key) or ""
+            if os.path.dirname(path) == image_dir and os.path.basename(path) in renames:
+                pron[key] = os.path.join(image_dir, renames[os.path.basename(path)])
+                changed = True
+    return changed
+
+
+def dedupe_output_images(store, image_dir="output_image", threshold=10, dry_run=True, workers=None):
+    """
+    批量去重output_image：进程池计算哈希，相同/几乎相同的截图保留最早的一份，
+    改写全部记录中的引用后删除其余文件（dry_run时只统计）。返回统计信息。
+    """
+    names = sorted(name for name in os.listdir(image_dir)
+                   if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS) if os.path.isdir(image_dir) else []
+    paths = [os.path.join(image_dir, name) for name in names]
+    entries = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for path, result in zip(paths, pool.map(_hash_image_file_safe, paths, chunksize=32)):
+            if result is None:
+                print(f"无法读取，已跳过: {path}")
+            else:
+                entries.append(result)
+
+    # 文件名中含时间戳，按名称排序后较早的一份作为保留版本
+    index = OutputImageIndex(image_dir, threshold, db_path=":memory:")
+    renames = {}
+    kept = []
+    for name, sha, phash, width, height in entries:
+        duplicate = index.find_duplicate(sha, phash, width, height, os.path.join(image_dir, name))
+        if duplicate:
+            renames[name] = duplicate
+            continue
+        index._register(name, sha, phash, width, height)
+        kept.append((name, sha, phash, width, height))
+    index.close()
+
+    stats = {"files": len(entries), "duplicates": len(renames), "records_updated": 0,
+             "bytes_reclaimed": sum(os.path.getsize(os.path.join(image_dir, name)) for name in renames)}
+    refs = {}
+    for stem in store.stems():
+        record = store.load(stem)
+        if record is None:
+            continue
+        if replace_image_references(record, renames, image_dir):
+            stats["records_updated"] += 1
+            if not dry_run:
+                store.save(stem, record)
+        for pron in record.get("pronunciations") or []:
+            for name in pron.get("imported_image") or []:
+                refs[name] = refs.get(name, 0) + 1
+    if not dry_run:
+        for name in renames:
+            os.remove(os.path.join(image_dir, name))
+        content_index = OutputImageIndex(image_dir, threshold)
+        content_index.rebuild(kept, refs)
+        content_index.close()
+    stats["groups"] = renames
+    return stats
+
+
+def _hash_image_file_safe(path):
+    try:
+        return hash_image_file(path)
+    except Exception:
+        return None
+
+
+ANY_VERSION = "*"
+
+
+class SubmitConflictError(Exception):
+    """提交时发现记录在打开后已被其他人修改"""
+
+
+def default_annotator_id():
+    """当前标注者的标识：环境变量PIC_TO_JSON_ANNOTATOR，否则为<用户名>@<主机名>"""
+    name = os.environ.get("PIC_TO_JSON_ANNOTATOR")
+    if not name:
+        try:
+            user = getpass.getuser()
+        except Exception:
+            user = "user"
+        name = f"{user}@{platform.node() or 'localhost'}"
+    # 用作文件名，去掉路径分隔符等特殊字符
+    return re.sub(r"[^\w.@-]", "_", name)
+
+
+class LeaseManager:
+    """
+    基于文件的租约，多人共用同一个output目录时防止两人同时标注同一张图片。
+
+    租约文件<目录>/<名称>.lease记录持有人和到期时间，用O_EXCL创建保证只有一人成功；
+    持有人需在到期前续约，过期的租约可以被其他人接管。只依赖文件系统，可用于网络共享目录。
+    """
+
+    def __init__(self, lease_dir, owner, ttl=300):
+        self.lease_dir = lease_dir
+        self.owner = owner
+        self.ttl = ttl
+        self.held = set()
+        os.makedirs(lease_dir, exist_ok=True)
+
+    def path_for(self, name):
+        return os.path.join(self.lease_dir, f"{name}.lease")
+
+    def read(self, name):
+        """返回租约内容，不存在时返回None"""
+        path = self.path_for(name)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            # 创建者写入内容前崩溃，按文件修改时间推算到期时间
+            try:
+                return {"owner": "?", "token": None, "expires": os.path.getmtime(path) + self.ttl}
+            except OSError:
+                return None
+
+    def _new_lease(self):
+        return {
+            "owner": self.owner,
+            "host": platform.node(),
+            "pid": os.getpid(),
+            "token": uuid.uuid4().hex,
+            "expires": time.time() + self.ttl
+        }
+
+    def acquire(self, name):
+        """获取或续约租约，成功返回None，被他人持有时返回对方的租约内容"""
+        path = self.path_for(name)
+        for _ in range(5):
+            current = self.read(name)
+            if current is not None:
+                if current.get("owner") == self.owner:
+                    write_json_atomic(path, self._new_lease(), ensure_ascii=False)
+                    self.held.add(name)
+                    return None
+                if current.get("expires", 0) > time.time():
+                    return current
+                self._break(path, current)
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                continue  # 其他人抢先创建，重新读取
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(self._new_lease(), f, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            self.held.add(name)
+            return None
+        return self.read(name) or {"owner": "?", "expires": 0}
+
+    def _break(self, path, stale):
+        """移走过期的租约；移走的若是刚被续约的租约则放回原处"""
+        tomb = f"{path}.{uuid.uuid4().hex}.stale"
+        try:
+            os.rename(path, tomb)
+        except FileNotFoundError:
+            return
+        try:
+            with open(tomb, "r", encoding="utf-8") as f:
+                moved = json.load(f)
+        except (OSError, ValueError):
+            moved = None
+        if moved is not None and moved.get("token") != stale.get("token") and not os.path.exists(path):
+            os.rename(tomb, path)
+        else:
+            os.remove(tomb)
+
+    def renew(self, name):
+        """续约自己持有的租约，租约已被他人接管时返回False"""
+        current = self.read(name)
+        if current is None or current.get("owner") != self.owner:
+            self.held.discard(name)
+            return False
+        write_json_atomic(self.path_for(name), self._new_lease(), ensure_ascii=False)
+        return True
+
+    def release(self, name):
+        self.held.discard(name)
+        current = self.read(name)
+        if current is not None and current.get("owner") == self.owner:
+            try:
+                os.remove(self.path_for(name))
+            except FileNotFoundError:
+                pass
+
+    def release_all(self):
+        for name in list(self.held):
+            self.release(name)
+
+    @contextmanager
+    def locked(self, name, timeout=10):
+        """把租约当作跨机器的互斥锁使用"""
+        deadline = time.time() + timeout
+        while self.acquire(name) is not None:
+            if time.time() > deadline:
+                raise TimeoutError(f"等待锁超时: {self.path_for(name)}")
+            time.sleep(0.1)
+        try:
+            yield
+        finally:
+            self.release(name)
+
+
+class PageAllocator:
+    """
+    多人标注时按sort_key顺序把图片分成互不重叠的连续范围分配给各标注者。
+
+    分配表保存在<目录>/allocations.json，每项记录范围首尾的图片名，修改时加锁。
+    超过expire_hours未再确认且仍有未提交图片的范围视为放弃，可重新分配给其他人。
+    """
+
+    def __init__(self, session_dir, owner, size=50, expire_hours=24):
+        self.path = os.path.join(session_dir, "allocations.json")
+        self.size = size
+        self.expire_seconds = expire_hours * 3600
+        self._locks = LeaseManager(session_dir, owner, ttl=30)
+
+    def _load(self):
+        data = load_config(self.path)
+        return data.get("allocations", [])
+
+    def allocate(self, annotator, stems, submitted, create=True):
+        """
+        返回annotator当前的范围(起始索引, 结束索引)（均包含），stems为按sort_key排好序的图片名。
+
+        已有范围全部提交后，create为True时从第一张未分配且未提交的图片开始分配新范围；
+        没有可分配的图片时返回None。
+        """
+        positions = {stem: index for index, stem in enumerate(stems)}
+        now = time.time()
+        with self._locks.locked("allocations"):
+            table = []
+            taken = bytearray(len(stems))
+            own = None
+            for item in self._load():
+                start, end = positions.get(item["start"]), positions.get(item["end"])
+                if start is None or end is None or start > end:
+                    continue  # 图片已被删除或改名
+                remaining = any(stems[i] not in submitted for i in range(start, end + 1))
+                if item["annotator"] == annotator:
+                    if remaining and own is None:
+                        own = (start, end)
+                        item["updated"] = now
+                elif remaining and now - item.get("updated", 0) > self.expire_seconds:
+                    continue  # 长时间未确认的范围收回
+                table.append(item)
+                taken[start:end + 1] = b"\x01" * (end - start + 1)
+
+            if own is None and create:
+                start = next((i for i in range(len(stems)) if not taken[i] and stems[i] not in submitted), None)
+                if start is not None:
+                    end = start
+                    while end + 1 < len(stems) and not taken[end + 1] and end + 1 - start < self.size:
+                        end += 1
+                    own = (start, end)
+                    table.append({"annotator": annotator, "start": stems[start], "end": stems[end],
+                                  "created": now, "updated": now})
+            write_json_atomic(self.path, {"allocations": table}, ensure_ascii=False, indent=2)
+        return own
+
+
+class SubmitWriter:
+    """
+    后台提交线程。
+
+    每次提交（图片移动、旧图片删除、记录写入）先作为一个整体写入journal/submit下的日志文件，
+    再由后台线程依次执行，完成后删除日志。各步骤可重复执行，因此启动时重放残留日志即可
+    补完崩溃前未完成的提交；无法完成的提交移到failed子目录并报告。
+
+    提交时可以带上打开记录时的版本号，写入前发现记录已被其他人修改则放弃本次提交。
+    """
+
+    def __init__(self, store, journal_dir=None, thumbnail_cache=None, image_index=None):
+        self.store = store
+        self.image_index = image_index
+        self.journal_dir = journal_dir or os.path.join(JOURNAL_DIR, "submit")
+        self.failed_dir = os.path.join(self.journal_dir, "failed")
+        self.thumbnail_cache = thumbnail_cache
+        os.makedirs(self.journal_dir, exist_ok=True)
+        self._queue = queue.Queue()
+        self._results = queue.Queue()
+        self._lock = threading.Lock()
+        self._sequence = 0
+        self._written_versions = {}  # 图片名 -> 本进程最近一次写入后的版本号
+        self.pending = 0
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def _enqueue(self, journal_path, job):
+        with self._lock:
+            self.pending += 1
+        self._queue.put((journal_path, job))
+
+    def recover(self):
+        """把残留的日志重新排入队列，返回数量"""
+        names = sorted(name for name in os.listdir(self.journal_dir) if name.endswith(".json"))
+        jobs = []
+        for name in names:
+            path = os.path.join(self.journal_dir, name)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    job = json.load(f)
+            except Exception as e:
+                print(f"提交日志损坏，已跳过: {path} {str(e)}")
+                continue
+            jobs.append((path, job))
+        if self.image_index:
+            self.image_index.prune_jobs(job.get("id") for _, job in jobs)
+        for path, job in jobs:
+            self._enqueue(path, job)
+        return len(names)
+
+    def submit(self, stem, record, moves, removes, expected_version=ANY_VERSION):
+        """expected_version为打开记录时store.version()的返回值，ANY_VERSION表示不检查"""
+        with self._lock:
+            self._sequence += 1
+            job_id = f"{datetime.now().strftime('%Y%m%d%H%M%S%f')}_{self._sequence:04d}"
+        job = {
+            "id": job_id,
+            "stem": stem,
+            "record": json.loads(json.dumps(record, ensure_ascii=False)),  # 当前数据的快照
+            "moves": [list(move) for move in moves],
+            "removes": list(removes),
+            "expected_version": expected_version
+        }
+        journal_path = os.path.join(self.journal_dir, f"{job_id}.json")
+        write_json_atomic(journal_path, job, ensure_ascii=False)
+        self._enqueue(journal_path, job)
+        return job_id
+
+    def _apply(self, job):
+        """执行一次提交，返回因内容重复而改用已有文件的映射{新文件名: 已有文件名}"""
+        self._check_version(job)
+        renames = {}
+        reused_sources = []
+        for step, (src, dest) in enumerate(job["moves"]):
+            if os.path.exists(src):
+                os.makedirs(os.path.dirname(dest) or ".", exist_ok=True)
+                thumb_key = self.thumbnail_cache.key_for(src) if self.thumbnail_cache else None
+                with TRACER.span("file_move"):
+                    if self.image_index:
+                        final_path, reused = self.image_index.add(src, dest, self._op(job, "add", step, dest))
+                    else:
+                        shutil.move(src, dest)
+                        final_path, reused = dest, False
+                if reused:
+                    renames[os.path.basename(dest)] = os.path.basename(final_path)
+                    reused_sources.append(src)
+                elif self.thumbnail_cache:
+                    try:
+                        self.thumbnail_cache.adopt(thumb_key, dest)
+                    except Exception as e:
+                        print(f"缩略图缓存更新失败: {str(e)}")
+            elif not os.path.exists(dest):
+                raise FileNotFoundError(f"找不到图片: {src}")
+        if renames:
+            replace_image_references(job["record"], renames, os.path.dirname(job["moves"][0][1]))
+        self.store.save(job["stem"], job["record"])
+        self._written_versions[job["stem"]] = self.store.version(job["stem"])
+        for step, path in enumerate(job["removes"] + reused_sources):
+            if self.image_index:
+                if self.image_index.release(path, self._op(job, "release", step, path)):
+                    print(f"已删除历史文件: {path}")
+            elif os.path.exists(path):
+                os.remove(path)
+                print(f"已删除历史文件: {path}")
+        return renames
+
+    @staticmethod
+    def _op(job, action, step, path):
+        """引用数变化的步骤标识（提交编号, 动作:序号:路径），重放日志时用于避免重复加减"""
+        return (job["id"], f"{action}:{step}:{path}") if job.get("id") else None
+
+    def _check_version(self, job):
+        expected = job.get("expected_version", ANY_VERSION)
+        if expected == ANY_VERSION:
+            return
+        stem = job["stem"]
+        current = self.store.version(stem)
+        if current == expected or current == self._written_versions.get(stem, expected):
+            return
+        if self.store.load(stem) == job["record"]:
+            return  # 崩溃前已写入，重放日志时出现
+        raise SubmitConflictError(f"{stem} 打开后已被其他人修改，请重新打开该图片核对后再提交")
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            journal_path, job = item
+            try:
+                with TRACER.span("submit_apply", stem=job["stem"]):
+                    renames = self._apply(job)
+                os.remove(journal_path)
+                if self.image_index and job.get("id"):
+                    self.image_index.finish_job(job["id"])
+                self._results.put((job["stem"], None, renames))
+            except Exception as e:
+                try:
+                    os.makedirs(self.failed_dir, exist_ok=True)
+                    os.replace(journal_path, os.path.join(self.failed_dir, os.path.basename(journal_path)))
+                except OSError:
+                    pass
+                self._results.put((job["stem"], str(e), {}))
+            finally:
+                with self._lock:
+                    self.pending -= 1
+
+    def poll_results(self):
+        """取出已完成的提交结果[(图片名, 错误或None, 改用已有文件的映射)]"""
+        results = []
+        while True:
+            try:
+                results.append(self._results.get_nowait())
+            except queue.Empty:
+                return results
+
+    def close(self, timeout=None):
+        """等待队列中的提交完成，全部完成时返回True"""
+        self._queue.put(None)
+        self._worker.join(timeout)
+        return not self._worker.is_alive()
+
+
+def diff_record(old, new, path=()):
+    """比较两份记录，返回把old变为new所需的[路径, 新值]列表；结构变化时整体替换该层"""
+    if type(old) is not type(new):
+        return [[list(path), new]]
+    if isinstance(new, dict):
+        if any(key not in new for key in old):
+            return [[list(path), new]]
+        ops = []
+        for key, value in new.items():
+            if key not in old:
+                ops.append([list(path) + [key], value])
+            else:
+                ops.extend(diff_record(old[key], value, path + (key,)))
+        return ops
+    if isinstance(new, list):
+        if len(old) != len(new):
+            return [[list(path), new]]
+        ops = []
+        for index, (old_item, new_item) in enumerate(zip(old, new)):
+            ops.extend(diff_record(old_item, new_item, path + (index,)))
+        return ops
+    return [] if old == new else [[list(path), new]]
+
+
+def apply_record_ops(record, ops):
+    """把diff_record生成的修改应用到record上，返回修改后的记录"""
+    for path, value in ops:
+        if not path:
+            record = copy.deepcopy(value)
+            continue
+        target = record
+        for key in path[:-1]:
+            target = target[key]
+        target[path[-1]] = copy.deepcopy(value)
+    return record
+
+
+def read_draft_journal(path):
+    """重放草稿日志，返回({图片名: 草稿记录}, 行数, {图片名: 草稿基于的存储版本})，不修改日志文件"""
+    drafts = {}
+    versions = {}
+    lines = 0
+    if not os.path.exists(path):
+        return drafts, lines, versions
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            lines += 1
+            try:
+                item = json.loads(line)
+                stem = item["stem"]
+                if "base" in item:
+                    drafts[stem] = item["base"]
+                    if "version" in item:
+                        versions[stem] = item["version"]
+                    else:
+                        versions.pop(stem, None)  # 旧版本程序写入的草稿没有记录版本
+                elif "set" in item and stem in drafts:
+                    drafts[stem] = apply_record_ops(drafts[stem], item["set"])
+                elif item.get("clear"):
+                    drafts.pop(stem, None)
+                    versions.pop(stem, None)
+            except Exception as e:
+                print(f"草稿日志记录损坏，已跳过: {str(e)}")
+    return drafts, lines, versions
+
+
+class DraftJournal:
+    """
+    未提交修改的草稿日志（journal/drafts.jsonl）。
+
+    每张图片第一次修改时写入一条完整记录和打开时的存储版本，之后只追加与上次写入相比变化的字段；
+    提交后写入clear标记。启动时重放日志得到所有未提交的草稿，日志过长时压缩重写。
+    恢复草稿后以草稿记录的版本提交，期间记录被其他人修改时提交会报冲突。
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(JOURNAL_DIR, "drafts.jsonl")
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.drafts = {}  # 图片名 -> 草稿记录（日志中存在未提交的修改）
+        self._snapshots = {}  # 图片名 -> 最近一次写入日志或从存储加载时的记录
+        self.versions = {}  # 图片名 -> 草稿基于的存储版本（store.version()）
+        self._lines = 0
+        self._replay()
+        if self._lines > 2 * len(self.drafts) + 100:
+            self.compact()
+
+    def _replay(self):
+        self.drafts, self._lines, self.versions = read_draft_journal(self.path)
+        self._snapshots = copy.deepcopy(self.drafts)
+
+    def _append(self, item):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(item, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._lines += 1
+
+    def compact(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for stem, record in self.drafts.items():
+                item = {"stem": stem, "base": record}
+                if stem in self.versions:
+                    item["version"] = self.versions[stem]
+                f.write(json.dumps(item, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._lines = len(self.drafts)
+
+    def get(self, stem):
+        draft = self.drafts.get(stem)
+        return copy.deepcopy(draft) if draft is not None else None
+
+    def begin(self, stem, record, version=ANY_VERSION):
+        """记录页面加载时的基准数据和存储版本，没有草稿时后续只在内容变化后才写日志"""
+        if stem not in self.drafts:
+            self._snapshots[stem] = copy.deepcopy(record)
+            self.versions[stem] = version
+
+    def base_version(self, stem, default=ANY_VERSION):
+        """草稿开始时记录的存储版本，旧日志中没有记录时返回default"""
+        return self.versions.get(stem, default)
+
+    def record(self, stem, record):
+        """把当前记录写入日志，有变化时返回True"""
+        if stem in self.drafts:
+            ops = diff_record(self._snapshots[stem], record)
+            if not ops:
+                return False
+            self._append({"stem": stem, "set": ops})
+        else:
+            if self._snapshots.get(stem) == record:
+                return False
+            self._append({"stem": stem, "base": record, "version": self.versions.get(stem, ANY_VERSION)})
+        self._snapshots[stem] = copy.deepcopy(record)
+        self.drafts[stem] = self._snapshots[stem]
+        return True
+
+    def clear(self, stem, record):
+        """提交后丢弃草稿，以提交的数据作为新的基准"""
+        if stem in self.drafts:
+            self._append({"stem": stem, "clear": True})
+            del self.drafts[stem]
+        self.versions.pop(stem, None)
+        self._snapshots[stem] = copy.deepcopy(record)
+
+
+def normalize_reference(path):
+    return os.path.normcase(os.path.abspath(path))
+
+
+def record_file_references(record, image_dir="output_image"):
+    """返回记录引用的全部文件路径（imported_source_path、old_image_path和imported_image）"""
+    paths = []
+    for item in [record] + list(record.get("pronunciations") or []):
+        for key in ("imported_source_path", "old_image_path"):
+            if item.get(key):
+                paths.append(item[key])
+        for name in item.get("imported_image") or []:
+            if name:
+                paths.append(os.path.join(image_dir, name))
+    return paths
+
+
+class OrphanCollector:
+    """
+    回收temp和output_image中没有被任何记录引用的文件（孤儿文件）。
+
+    先列出两个目录，再依次读取草稿日志、提交日志和标注存储中的引用。提交先写日志、再移动文件和写存储、
+    最后删日志，先读日志后读存储保证扫描期间完成的提交至少出现在其中一边，引用的文件不会被误删。
+    每条记录引用的文件按store.version()缓存在cache/gc_refs.json，再次运行时只重新读取修改过的记录。
+    修改时间不到min_age秒的文件视为正在使用（例如刚截取还未写入草稿的截图、刚移入output_image的截图）。
+    """
+
+    def __init__(self, store, temp_dir="temp", image_dir="output_image", journal_dir=JOURNAL_DIR,
+                 state_path=None, min_age=3600, image_index=None):
+        self.store = store
+        self.temp_dir = temp_dir
+        self.image_dir = image_dir
+        self.journal_dir = journal_dir
+        self.state_path = state_path or os.path.join(CACHE_DIR, "gc_refs.json")
+        self.min_age = min_age
+        self.image_index = image_index
+
+    def list_candidates(self):
+        """逐个产出(路径, 大小, 修改时间)：temp中的全部文件和output_image中的图片，跳过以.开头的文件"""
+        for directory, extensions in ((self.temp_dir, None), (self.image_dir, IMAGE_EXTENSIONS)):
+            if not os.path.isdir(directory):
+                continue
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if entry.name.startswith(".") or not entry.is_file():
+                        continue
+                    if extensions and os.path.splitext(entry.name)[1].lower() not in extensions:
+                        continue
+                    st = entry.stat()
+                    yield entry.path, st.st_size, st.st_mtime
+
+    def store_references(self):
+        state = load_config(self.state_path)
+        cached = state.get("records", {}) if state.get("store") == self.store.name else {}
+        records = {}
+        for stem in self.store.stems():
+            version = self.store.version(stem)
+            entry = cached.get(stem)
+            if entry is None or entry[0] != version:
+                record = self.store.load(stem)
+                if record is None:
+                    continue
+                entry = [version, record_file_references(record, self.image_dir)]
+            records[stem] = entry
+        try:
+            write_json_atomic(self.state_path, {"store": self.store.name, "records": records}, ensure_ascii=False)
+        except OSError as e:
+            print(f"引用缓存保存失败: {str(e)}")
+        for _, paths in records.values():
+            yield from paths
+
+    def journal_references(self):
+        """所有标注者的草稿和未完成（含失败）的提交日志中引用的文件"""
+        if not os.path.isdir(self.journal_dir):
+            return
+        for dirpath, _, filenames in os.walk(self.journal_dir):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                if filename == "drafts.jsonl":
+                    for record in read_draft_journal(path)[0].values():
+                        yield from record_file_references(record, self.image_dir)
+                elif filename.endswith(".json") and not filename.startswith("."):
+                    try:
+                        with open(path, "r", encoding="utf-8") as f:
+                            job = json.load(f)
+                    except (OSError, ValueError):
+                        continue  # 正在写入或已被删除
+                    for src, dest in job.get("moves", []):
+                        yield src
+                        yield dest
+                    yield from record_file_references(job.get("record") or {}, self.image_dir)
+
+    def collect(self, dry_run=True, extra_references=None):
+        """
+        找出并（dry_run为False时）删除孤儿文件，返回统计信息。
+
+        extra_references为返回额外引用路径的函数（例如界面中正在编辑的记录），在删除前调用。
+        """
+        candidates = list(self.list_candidates())
+        referenced = set()
+        # 顺序不能颠倒：两次读取之间完成的提交，日志中没有时存储中一定已有
+        for path in self.journal_references():
+            referenced.add(normalize_reference(path))
+        for path in self.store_references():
+            referenced.add(normalize_reference(path))
+        if extra_references:
+            referenced.update(normalize_reference(path) for path in extra_references())
+
+        now = time.time()
+        stats = {"scanned": len(candidates), "referenced": 0, "recent": 0, "orphans": [], "bytes": 0, "removed": 0}
+        for path, size, mtime in candidates:
+            key = normalize_reference(path)
+            if key in referenced:
+                stats["referenced"] += 1
+                continue
+            if now - mtime < self.min_age:
+                stats["recent"] += 1
+                continue
+            stats["orphans"].append(path)
+            stats["bytes"] += size
+            if dry_run:
+                continue
+            try:
+                if self.image_index and os.path.dirname(key) == normalize_reference(self.image_dir):
+                    self.image_index.discard(path)
+                elif os.path.exists(path):
+                    os.remove(path)
+                stats["removed"] += 1
+            except OSError as e:
+                print(f"删除失败: {path} {str(e)}")
+        return stats
+
+
+def _rule_empty_pronunciations(stem, record):
+    if not record.get("pronunciations"):
+        yield "pronunciations", "没有任何读音"
+
+
+def _rule_image_name(stem, record):
+    image = record.get("image", "")
+    if image and os.path.splitext(image)[0] != stem:
+        yield "image", f"image字段{image}与文件名{stem}不一致"
+    if parse_image_key(stem) is None:
+        yield "image", f"文件名{stem}不符合zhuang_<页>_crop_<序号>格式，排序时会放在最后"
+
+
+def _rule_page_info(stem, record):
+    key = parse_image_key(stem)
+    if key is None:
+        return
+    page_info = record.get("page_info") or {}
+    for field, expected in (("page_num", key[0]), ("word_num", key[1])):
+        value = str(page_info.get(field, "")).strip()
+        if not value:
+            continue  # 未填写不算不一致
+        if not value.isdigit() or int(value) != expected:
+            yield f"page_info.{field}", f"{field}为{value}，文件名中为{expected}"
+
+
+# 只依赖记录内容的规则，在进程池中执行，结果按文件修改时间缓存
+RECORD_RULES = {
+    "empty_pronunciations": _rule_empty_pronunciations,
+    "image_mismatch": _rule_image_name,
+    "page_info_mismatch": _rule_page_info,
+}
+# 依赖output_image等目录状态的规则，每次运行都用缓存的引用重新检查
+REFERENCE_RULES = ("missing_output_image", "stale_source_path")
+VALIDATION_RULES = tuple(RECORD_RULES) + REFERENCE_RULES + ("parse_error",)
+
+
+def validate_record(stem, record, rules=None):
+    """
+    检查一条记录，返回(问题列表, 引用列表)。
+
+    问题为{"rule", "field", "message"}；引用为(字段, 类型, 值)，类型为"image"（output_image中的文件名）
+    或"source"（imported_source_path），由check_record_references对照目录检查。
+    """
+    issues = []
+    for name, rule in RECORD_RULES.items():
+        if rules is None or name in rules:
+            for field, message in rule(stem, record):
+                issues.append({"rule": name, "field": field, "message": message})
+    references = []
+    items = [("", record)] + [(f"pronunciations[{i}].", pron)
+                              for i, pron in enumerate(record.get("pronunciations") or [])]
+    for prefix, item in items:
+        if not isinstance(item, dict):
+            continue
+        if item.get("imported_source_path"):
+            references.append((prefix + "imported_source_path", "source", item["imported_source_path"]))
+        for name in item.get("imported_image") or []:
+            if name:
+                references.append((prefix + "imported_image", "image", name))
+    return issues, references
+
+
+def check_record_references(references, image_names, rules=None):
+    """对照output_image的文件名集合检查引用，返回问题列表"""
+    issues = []
+    for field, kind, value in references:
+        if kind == "image":
+            if (rules is None or "missing_output_image" in rules) and value not in image_names:
+                issues.append({"rule": "missing_output_image", "field": field,
+                               "message": f"output_image中找不到{value}"})
+        elif rules is None or "stale_source_path" in rules:
+            if os.path.isabs(value):
+                exists = "" if os.path.exists(value) else "，且文件不存在"
+                issues.append({"rule": "stale_source_path", "field": field,
+                               "message": f"绝对路径{value}换一台电脑就会失效{exists}"})
+            elif not os.path.exists(value):
+                issues.append({"rule": "stale_source_path", "field": field, "message": f"文件不存在: {value}"})
+    return issues
+
+
+def _validate_annotation_file(path):
+    # 进程池中执行，一个文件中的全部记录合并返回
+    stem = os.path.splitext(os.path.basename(path))[0]
+    try:
+        records = read_annotation_file(path)
+    except Exception as e:
+        return [{"rule": "parse_error", "field": "", "message": str(e)}], []
+    issues, references = [], []
+    for index, record in enumerate(records):
+        if not isinstance(record, dict):
+            issues.append({"rule": "parse_error", "field": f"[{index}]", "message": "记录不是JSON对象"})
+            continue
+        record_issues, record_references = validate_record(stem, record)
+        issues.extend(record_issues)
+        references.extend(record_references)
+    return issues, references
+
+
+class AnnotationValidator:
+    """
+    检查output中全部记录的一致性，生成可供程序读取的报告。
+
+    只依赖记录内容的检查结果和记录中的引用按版本缓存在cache/validation.json（file存储的版本即文件的
+    修改时间和大小，由目录扫描直接得到，不需要逐个stat），再次运行时只重新读取修改过的文件，
+    file存储时用进程池分批并行解析。output_image只列一次目录，引用的检查每次都对照最新的目录重新进行。
+    """
+
+    def __init__(self, store, image_dir="output_image", state_path=None, rules=None):
+        self.store = store
+        self.image_dir = image_dir
+        self.state_path = state_path or os.path.join(CACHE_DIR, "validation.json")
+        unknown = set(rules or ()) - set(VALIDATION_RULES)
+        if unknown:
+            raise ValueError(f"未知的检查规则: {', '.join(sorted(unknown))}，可选: {', '.join(VALIDATION_RULES)}")
+        self.rules = set(rules) if rules else None
+
+    def _versions(self):
+        """(图片名, 版本, 文件路径)，文件路径仅file存储时有值"""
+        if self.store.name == "file":
+            return [(stem, f"{mtime}", path) for path, stem, mtime in list_annotation_files(self.store.output_dir)]
+        return [(stem, str(self.store.version(stem)), None) for stem in self.store.stems()]
+
+    def _check(self, changed, workers=None, batch_size=512):
+        """逐个产出(图片名, 版本, 问题, 引用)"""
+        in_store = [item for item in changed if item[2] is None]
+        for stem, version, _ in in_store:
+            try:
+                record = self.store.load(stem)
+            except Exception as e:
+                yield stem, version, [{"rule": "parse_error", "field": "", "message": str(e)}], []
+                continue
+            if record is None:
+                continue
+            yield (stem, version) + validate_record(stem, record)
+        files = [item for item in changed if item[2] is not None]
+        if workers == 1 or len(files) < batch_size:
+            for stem, version, path in files:
+                yield (stem, version) + _validate_annotation_file(path)
+            return
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for start in range(0, len(files), batch_size):
+                batch = files[start:start + batch_size]
+                results = pool.map(_validate_annotation_file, [path for _, _, path in batch], chunksize=32)
+                for (stem, version, _), (issues, references) in zip(batch, results):
+                    yield stem, version, issues, references
+
+    def validate(self, workers=None):
+        """检查全部记录，返回报告字典"""
+        start = time.perf_counter()
+        state = load_config(self.state_path)
+        cached = state.get("records", {}) if state.get("store") == self.store.name and \
+            state.get("rules") == sorted(RECORD_RULES) else {}
+        items = self._versions()
+        changed = [item for item in items if (cached.get(item[0]) or [None])[0] != item[1]]
+        records = {stem: cached[stem] for stem, _, _ in items if stem in cached}
+        with TRACER.span("validate_parse", files=len(changed)):
+            for stem, version, issues, references in self._check(changed, workers):
+                records[stem] = [version, issues, references]
+        try:
+            write_json_atomic(self.state_path, {"store": self.store.name, "rules": sorted(RECORD_RULES),
+                                                "records": records}, ensure_ascii=False)
+        except OSError as e:
+            print(f"检查缓存保存失败: {str(e)}")
+
+        image_names = set()
+        if os.path.isdir(self.image_dir):
+            with os.scandir(self.image_dir) as it:
+                image_names = {entry.name for entry in it}
+        report_issues = []
+        for stem in sorted(records, key=ImageViewerApp.sort_key):
+            _, issues, references = records[stem]
+            issues = [issue for issue in issues if self.rules is None or issue["rule"] in self.rules]
+            issues += check_record_references(references, image_names, self.rules)
+            report_issues.extend(dict(issue, image=stem) for issue in issues)
+        counts = {}
+        for issue in report_issues:
+            counts[issue["rule"]] = counts.get(issue["rule"], 0) + 1
+        return {
+            "generated_at": datetime.now().isoformat(timespec="seconds"),
+            "store": self.store.name,
+            "records": len(records),
+            "checked": len(changed),
+            "cached": len(items) - len(changed),
+            "elapsed_s": round(time.perf_counter() - start, 3),
+            "counts": counts,
+            "issues": report_issues,
+        }
+
+
+SEARCH_FIELDS = ("simplified_Chinese_character", "zhuang_spelling", "ipa", "meaning")
+SEARCH_TOKEN_PATTERN = re.compile(r"[\s,，;；、。.:：/()（）]+")
+
+
+def extract_search_terms(record):
+    """从记录中取出可检索的值：{字段: [值, ...]}，meaning同时按标点拆成词"""
+    fields = {field: [] for field in SEARCH_FIELDS}
+
+    def add(field, value):
+        value = str(value or "").strip().lower()
+        if value and value not in fields[field]:
+            fields[field].append(value)
+
+    add("simplified_Chinese_character", record.get("simplified_Chinese_character"))
+    for pron in record.get("pronunciations") or []:
+        add("zhuang_spelling", pron.get("zhuang_spelling"))
+        add("ipa", pron.get("ipa"))
+        for entry in pron.get("entries") or []:
+            meaning = entry.get("meaning") or ""
+            add("meaning", meaning)
+            for token in SEARCH_TOKEN_PATTERN.split(meaning):
+                add("meaning", token)
+    return fields
+
+
+def _ngrams(value):
+    # 一元和二元切分，单字查询也能命中
+    grams = set(value)
+    grams.update(value[i:i + 2] for i in range(len(value) - 1))
+    return grams
+
+
+class AnnotationSearchIndex:
+    """
+    标注内容的倒排索引，支持精确、前缀和包含（n-gram）查询。
+
+    文档（每张图片的可检索值和版本标记）按output目录分别持久化在cache/search_index_<目录哈希>.json，
+    加载时在内存中重建倒排表；刷新时按annotation_versions()的版本标记只重新索引变化的记录，
+    换用其他存储方式时全部重新索引。提交成功后由on_submit_saved即时更新。
+    """
+
+    VERSION = 2
+    MODES = ("exact", "prefix", "ngram")
+
+    def __init__(self, output_dir="output", path=None):
+        self.output_dir = output_dir
+        self.path = path or derived_cache_path("search_index", output_dir)
+        self.store_name = None  # 文档对应的存储方式
+        self.docs = {}  # 图片名 -> {"mtime": 版本标记或None, "fields": {字段: [值]}}
+        self._exact = {}  # (字段, 值) -> {图片名}
+        self._grams = {}  # (字段, gram) -> {图片名}
+        self._sorted_terms = {}  # 字段 -> 排序后的值列表，用于前缀查询；首次查询时建立，之后增量维护
+        self._dirty_fields = set(SEARCH_FIELDS)
+        self._lock = threading.Lock()
+        self.ready = False
+        self.dirty = False
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") != self.VERSION:
+                return
+            with self._lock:
+                self.store_name = data.get("store")
+                for stem, doc in data["docs"].items():
+                    self._add(stem, doc)
+        except Exception as e:
+            print(f"搜索索引读取失败，将重新建立: {str(e)}")
+
+    def save(self):
+        with self._lock:
+            docs = dict(self.docs)
+            self.dirty = False
+        write_json_atomic(self.path, {"version": self.VERSION, "store": self.store_name, "docs": docs},
+                          ensure_ascii=False)
+
+    def _add(self, stem, doc):
+        self.docs[stem] = doc
+        for field, values in doc["fields"].items():
+            for value in values:
+                postings = self._exact.get((field, value))
+                if postings is None:
+                    postings = self._exact[(field, value)] = set()
+                    if field not in self._dirty_fields:
+                        bisect.insort(self._sorted_terms[field], value)
+                postings.add(stem)
+                for gram in _ngrams(value):
+                    self._grams.setdefault((field, gram), set()).add(stem)
+
+    def _remove(self, stem):
+        doc = self.docs.pop(stem, None)
+        if not doc:
+            return
+        for field, values in doc["fields"].items():
+            for value in values:
+                postings = self._exact.get((field, value))
+                if postings is not None:
+                    postings.discard(stem)
+                    if not postings:
+                        del self._exact[(field, value)]
+                        if field not in self._dirty_fields:
+                            terms = self._sorted_terms[field]
+                            del terms[bisect.bisect_left(terms, value)]
+                for gram in _ngrams(value):
+                    postings = self._grams.get((field, gram))
+                    if postings is not None:
+                        postings.discard(stem)
+                        if not postings:
+                            del self._grams[(field, gram)]
+
+    def update(self, stem, record, mtime=None):
+        """索引（或重新索引）一条记录；mtime为版本标记，为None时下次刷新会再核对一次"""
+        doc = {"mtime": mtime, "fields": extract_search_terms(record)}
+        with self._lock:
+            self._remove(stem)
+            self._add(stem, doc)
+            self.dirty = True
+
+    def refresh(self, store):
+        """与标注存储同步：只重新索引版本标记变化的记录"""
+        with self._lock:
+            if self.store_name != store.name:
+                for stem in list(self.docs):
+                    self._remove(stem)
+                self.store_name = store.name
+                self.dirty = True
+        current = set()
+        for stem, mtime in annotation_versions(store):
+            current.add(stem)
+            doc = self.docs.get(stem)
+            if doc is None or doc["mtime"] != mtime:
+                try:
+                    record = store.load(stem)
+                except Exception as e:
+                    print(f"索引失败: {store.describe(stem)} {str(e)}")
+                    continue
+                if record is not None:
+                    self.update(stem, record, mtime)
+        with self._lock:
+            for stem in [stem for stem in self.docs if stem not in current]:
+                self._remove(stem)
+                self.dirty = True
+        self.ready = True
+
+    def _prefix_terms(self, field, prefix):
+        if field in self._dirty_fields:
+            self._sorted_terms[field] = sorted(value for f, value in self._exact if f == field)
+            self._dirty_fields.discard(field)
+        terms = self._sorted_terms[field]
+        start = bisect.bisect_left(terms, prefix)
+        result = []
+        for term in terms[start:]:
+            if not term.startswith(prefix):
+                break
+            result.append(term)
+        return result
+
+    def search(self, query, mode="exact", fields=SEARCH_FIELDS):
+        """返回命中的图片名集合"""
+        query = query.strip().lower()
+        if not query:
+            return set()
+        if mode not in self.MODES:
+            raise ValueError(f"未知的查询方式: {mode}，可选: {', '.join(self.MODES)}")
+        result = set()
+        with self._lock:
+            for field in fields:
+                if mode == "exact":
+                    result |= self._exact.get((field, query), set())
+                elif mode == "prefix":
+                    for term in self._prefix_terms(field, query):
+                        result |= self._exact[(field, term)]
+                else:
+                    grams = _ngrams(query) if len(query) < 2 else {query[i:i + 2] for i in range(len(query) - 1)}
+                    postings = sorted((self._grams.get((field, gram), set()) for gram in grams), key=len)
+                    candidates = set.intersection(*postings)
+                    if len(query) <= 2:
+                        result |= candidates
+                    else:
+                        # 二元组全部命中不代表连续出现，再核对一次原值
+                        result |= {stem for stem in candidates
+                                   if any(query in value for value in self.docs[stem]["fields"].get(field, []))}
+        return result
+
+
+class AnnotationStatusIndex:
+    """
+    所有图片的标注状态索引：未标注 / 草稿 / 已提交。
+
+    启动时只读取一次标注存储中的图片名；查找上一个/下一个未提交页面使用带路径压缩的
+    "下一个空位"并查集，摊还接近O(1)。页面从已提交退回未提交时重建并查集（很少发生）。
+    """
+
+    UNANNOTATED = "unannotated"
+    DRAFT = "draft"
+    SUBMITTED = "submitted"
+
+    def __init__(self, image_files, submitted_stems):
+        self.stems = [os.path.splitext(os.path.basename(path))[0] for path in image_files]
+        self.positions = {stem: i for i, stem in enumerate(self.stems)}
+        submitted = set(submitted_stems)
+        self.status = [self.SUBMITTED if stem in submitted else self.UNANNOTATED for stem in self.stems]
+        self._rebuild()
+
+    def _rebuild(self):
+        n = len(self.status)
+        # _next[i]指向 >=i 的候选位置，n为哨兵；_prev[k]指向 <=k-1 的候选位置加1，0为哨兵
+        self._next = list(range(n + 1))
+        self._prev = list(range(n + 1))
+        for i, state in enumerate(self.status):
+            if state == self.SUBMITTED:
+                self._next[i] = i + 1
+                self._prev[i + 1] = i
+
+    @staticmethod
+    def _find(parent, i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]  # 路径减半
+            i = parent[i]
+        return i
+
+    def set_status(self, index, state):
+        old = self.status[index]
+        if old == state:
+            return
+        self.status[index] = state
+        if state == self.SUBMITTED:
+            self._next[index] = index + 1
+            self._prev[index + 1] = index
+        elif old == self.SUBMITTED:
+            self._rebuild()
+
+    def set_status_by_stem(self, stem, state):
+        if stem in self.positions:
+            self.set_status(self.positions[stem], state)
+
+    def mark_submitted(self, stems):
+        """把启动后由其他程序提交的图片标记为已提交"""
+        for stem in stems:
+            self.set_status_by_stem(stem, self.SUBMITTED)
+
+    def get_status(self, index):
+        return self.status[index]
+
+    def next_unannotated(self, index):
+        """返回index之后第一个未提交的页面索引，没有时返回None"""
+        if index + 1 >= len(self.status):
+            return None
+        found = self._find(self._next, index + 1)
+        return found if found < len(self.status) else None
+
+    def previous_unannotated(self, index):
+        """返回index之前最后一个未提交的页面索引，没有时返回None"""
+        if index <= 0:
+            return None
+        found = self._find(self._prev, min(index, len(self.status))) - 1
+        return found if found >= 0 else None
+
+    def counts(self):
+        result = {self.UNANNOTATED: 0, self.DRAFT: 0, self.SUBMITTED: 0}
+        for state in self.status:
+            result[state] += 1
+        return result
+
+
+def record_counts(record):
+    """记录中的读音、词性、例句数"""
+    pronunciations = [pron for pron in record.get("pronunciations") or [] if isinstance(pron, dict)]
+    entries = [entry for pron in pronunciations for entry in pron.get("entries") or [] if isinstance(entry, dict)]
+    examples = sum(len(entry.get("examples") or []) for entry in entries)
+    return [len(pronunciations), len(entries), examples]
+
+
+class AnnotationStats:
+    """
+    标注量统计：每个标注者每小时/每天提交的记录数、每条记录的读音/词性/例句数、每页的完成情况。
+
+    每条记录的统计项（标注者、提交时间、页数、数量）按output目录分别持久化在
+    cache/annotation_stats_<目录哈希>.json，加载时在内存中累加成汇总表，之后只对变化的记录先减后加。提交成功后由on_submit_saved即时更新；
+    刷新时按annotation_versions()的版本标记只重新统计变化的记录，换用其他存储方式时全部重新统计。
+    提交时间取store.updated_at()（文件的mtime、sqlite的updated_at列、jsonl行中的time）。
+    记录重新提交后按最后一次提交计入。
+    """
+
+    VERSION = 2
+    UNKNOWN_ANNOTATOR = "(未填写)"
+    BUCKET_FORMATS = {"hour": "%Y-%m-%d %H:00", "day": "%Y-%m-%d"}
+
+    def __init__(self, output_dir="output", path=None):
+        self.output_dir = output_dir
+        self.path = path or derived_cache_path("annotation_stats", output_dir)
+        self.store_name = None  # 统计项对应的存储方式
+        self.docs = {}  # 图片名 -> {"mtime": 版本标记或None, "annotator", "time": 秒, "page": 页或None, "counts": [读音, 词性, 例句]}
+        self._buckets = {by: {} for by in self.BUCKET_FORMATS}  # 粒度 -> {(标注者, 时间段): 记录数}
+        self._totals = {}  # 标注者 -> [记录, 读音, 词性, 例句]
+        self._pages = {}  # 页 -> 已提交记录数
+        self._lock = threading.Lock()
+        self.ready = False
+        self.dirty = False
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") != self.VERSION:
+                return
+            with self._lock:
+                self.store_name = data.get("store")
+                for stem, doc in data["docs"].items():
+                    self._add(stem, doc)
+        except Exception as e:
+            print(f"统计数据读取失败，将重新统计: {str(e)}")
+
+    def save(self):
+        with self._lock:
+            docs = dict(self.docs)
+            self.dirty = False
+        write_json_atomic(self.path, {"version": self.VERSION, "store": self.store_name, "docs": docs},
+                          ensure_ascii=False)
+
+    def _apply(self, doc, sign):
+        annotator = doc["annotator"]
+        moment = datetime.fromtimestamp(doc["time"])
+        for by, fmt in self.BUCKET_FORMATS.items():
+            key = (annotator, moment.strftime(fmt))
+            count = self._buckets[by].get(key, 0) + sign
+            if count:
+                self._buckets[by][key] = count
+            else:
+                self._buckets[by].pop(key, None)
+        totals = self._totals.setdefault(annotator, [0, 0, 0, 0])
+        for i, value in enumerate([1] + doc["counts"]):
+            totals[i] += sign * value
+        if not totals[0]:
+            del self._totals[annotator]
+        if doc["page"] is not None:
+            count = self._pages.get(doc["page"], 0) + sign
+            if count:
+                self._pages[doc["page"]] = count
+            else:
+                del self._pages[doc["page"]]
+
+    def _add(self, stem, doc):
+        self.docs[stem] = doc
+        self._apply(doc, 1)
+
+    def _remove(self, stem):
+        doc = self.docs.pop(stem, None)
+        if doc:
+            self._apply(doc, -1)
+
+    def update(self, stem, record, mtime=None, submitted=None):
+        """
+        统计（或重新统计）一条记录。submitted为提交时间（秒），为None时按当前时间计入（刚提交时）；
+        mtime为版本标记，为None的记录下次刷新时会再核对一次。
+        """
+        key = parse_image_key(stem)
+        if submitted is None:
+            submitted = time.time()
+        doc = {
+            "mtime": mtime,
+            "annotator": (record.get("annotator") or "").strip() or self.UNKNOWN_ANNOTATOR,
+            "time": submitted,
+            "page": key[0] if key else None,
+            "counts": record_counts(record),
+        }
+        with self._lock:
+            self._remove(stem)
+            self._add(stem, doc)
+            self.dirty = True
+
+    def refresh(self, store):
+        """与标注存储同步：只重新统计版本标记变化的记录"""
+        with self._lock:
+            if self.store_name != store.name:
+                for stem in list(self.docs):
+                    self._remove(stem)
+                self.store_name = store.name
+                self.dirty = True
+        file_store = isinstance(store, FileAnnotationStore)
+        current = set()
+        for stem, mtime in annotation_versions(store):
+            current.add(stem)
+            doc = self.docs.get(stem)
+            if doc is None or doc["mtime"] != mtime:
+                try:
+                    record = store.load(stem)
+                except Exception as e:
+                    print(f"统计失败: {store.describe(stem)} {str(e)}")
+                    continue
+                if record is not None:
+                    submitted = mtime / 1e9 if file_store else store.updated_at(stem)
+                    self.update(stem, record, mtime, submitted)
+        with self._lock:
+            for stem in [stem for stem in self.docs if stem not in current]:
+                self._remove(stem)
+                self.dirty = True
+        self.ready = True
+
+    def throughput(self, by="day", annotator=None):
+        """{标注者: {时间段: 记录数}}，时间段按时间顺序排列"""
+        if by not in self.BUCKET_FORMATS:
+            raise ValueError(f"未知的统计粒度: {by}，可选: {', '.join(self.BUCKET_FORMATS)}")
+        result = {}
+        with self._lock:
+            items = sorted(self._buckets[by].items(), key=lambda item: item[0][1])
+        for (name, bucket), count in items:
+            if annotator is None or name == annotator:
+                result.setdefault(name, {})[bucket] = count
+        return result
+
+    def totals(self):
+        """{标注者: {"records", "pronunciations", "entries", "examples"}}"""
+        with self._lock:
+            return {name: dict(zip(("records", "pronunciations", "entries", "examples"), values))
+                    for name, values in sorted(self._totals.items())}
+
+    def page_coverage(self, image_files):
+        """[(页, 已提交, 图片数)]，image_files为image目录中的图片，不符合命名规则的不计"""
+        totals = {}
+        for path in image_files:
+            key = parse_image_key(path)
+            if key:
+                totals[key[0]] = totals.get(key[0], 0) + 1
+        with self._lock:
+            pages = dict(self._pages)
+        return [(page, pages.get(page, 0), totals.get(page, 0)) for page in sorted(set(totals) | set(pages))]
+
+    def summary(self, image_files=(), by="day", annotator=None):
+        coverage = self.page_coverage(image_files)
+        return {
+            "generated_at": datetime.now().isoformat(timespec="seconds"),
+            "records": len(self.docs),
+            "totals": self.totals(),
+            "throughput": {"by": by, "annotators": self.throughput(by, annotator)},
+            "pages": [{"page": page, "annotated": done, "images": total} for page, done, total in coverage],
+        }
+
+
+class ThumbnailCache:
+    """
+    磁盘缩略图缓存（cache/thumbnails）。
+
+    以 路径+mtime+size+尺寸 的哈希为文件名保存预先缩好的小图，命中时只需解码一张几KB的PNG。
+    总大小超过上限时按最近使用时间淘汰，命中时刷新文件mtime作为LRU依据。
+    """
+
+    def __init__(self, cache_dir=None, size=(50, 50), max_bytes=64 * 1024 * 1024):
+        self.cache_dir = cache_dir or os.path.join(CACHE_DIR, "thumbnails")
+        self.size = size
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._entries = {}  # 缓存文件名 -> (最近使用时间, 字节数)
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.is_file():
+                    st = entry.stat()
+                    self._entries[entry.name] = (st.st_mtime, st.st_size)
+        self._bytes = sum(size for _, size in self._entries.values())
+
+    def key_for(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        raw = f"{os.path.abspath(path)}|{st.st_mtime_ns}|{st.st_size}|{self.size[0]}x{self.size[1]}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest() + ".png"
+
+    def _touch(self, name, nbytes):
+        now = time.time()
+        with self._lock:
+            old = self._entries.get(name)
+            if old:
+                self._bytes -= old[1]
+            self._entries[name] = (now, nbytes)
+            self._bytes += nbytes
+        try:
+            os.utime(os.path.join(self.cache_dir, name), (now, now))
+        except OSError:
+            pass
+
+    def _store(self, name, img):
+        cache_path = os.path.join(self.cache_dir, name)
+        tmp_path = cache_path + ".tmp"
+        img.save(tmp_path, "PNG")
+        os.replace(tmp_path, cache_path)
+        self._touch(name, os.path.getsize(cache_path))
+        self.evict()
+
+    def get(self, path):
+        """返回path的缩略图，未缓存时解码原图并写入缓存"""
+        name = self.key_for(path)
+        if name is None:
+            raise FileNotFoundError(path)
+        cache_path = os.path.join(self.cache_dir, name)
+        if name in self._entries:
+            try:
+                img = Image.open(cache_path)
+                img.load()
+                self._touch(name, self._entries[name][1])
+                return img
+            except Exception:
+                with self._lock:
+                    self._bytes -= self._entries.pop(name, (0, 0))[1]
+        elif os.path.exists(cache_path):
+            # 程序运行期间由pregen等其他进程生成的缩略图
+            try:
+                img = Image.open(cache_path)
+                img.load()
+                self._touch(name, os.path.getsize(cache_path))
+                return img
+            except Exception:
+                pass
+        with TRACER.span("thumbnail"):
+            img = Image.open(path)
+            img.thumbnail(self.size)
+            if img.mode not in ("RGB", "RGBA", "L", "LA", "P"):
+                img = img.convert("RGB")
+            self._store(name, img)
+        return img
+
+    def adopt(self, old_name, new_path):
+        """文件被移动后，把旧路径的缩略图转到新路径名下；没有旧缩略图时重新生成"""
+        new_name = self.key_for(new_path)
+        if new_name is None:
+            return
+        old_path = os.path.join(self.cache_dir, old_name) if old_name else None
+        if old_path and old_name in self._entries and os.path.exists(old_path):
+            os.replace(old_path, os.path.join(self.cache_dir, new_name))
+            with self._lock:
+                _, nbytes = self._entries.pop(old_name)
+                self._bytes -= nbytes
+            self._touch(new_name, nbytes)
+        else:
+            self.get(new_path)
+
+    def evict(self):
+        with self._lock:
+            if self._bytes <= self.max_bytes:
+                return
+            victims = sorted(self._entries.items(), key=lambda item: item[1][0])
+            removed = []
+            for name, (_, nbytes) in victims:
+                if self._bytes <= self.max_bytes * 0.9:
+                    break
+                self._bytes -= nbytes
+                del self._entries[name]
+                removed.append(name)
+        for name in removed:
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                pass
+
+
+def display_derivative_path(path, size=(1000, 1000), cache_dir=None):
+    """
+    原图预先缩小的显示用图片在cache/display中的路径（按 路径+mtime+size+尺寸 命名），原图不存在时返回None。
+    原图本身在cache中时（例如cache/enhanced中的增强图）放在其所在目录的display子目录，
+    cache/display只保存image中原图的显示图，pregen --prune可以放心清理。
+
+    显示图统一保存为JPEG（透明部分铺白底），解码比同尺寸PNG快数倍。
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    source = os.path.abspath(path)
+    raw = f"{source}|{st.st_mtime_ns}|{st.st_size}|{size[0]}x{size[1]}"
+    name = hashlib.sha1(raw.encode("utf-8")).hexdigest()
+    if cache_dir is None:
+        if source.startswith(os.path.abspath(CACHE_DIR) + os.sep):
+            cache_dir = os.path.join(os.path.dirname(path), "display")
+        else:
+            cache_dir = os.path.join(CACHE_DIR, "display")
+    return os.path.join(cache_dir, name + ".jpg")
+
+
+def _generate_derivatives(task):
+    """进程池中执行：为一张原图生成缺少的显示图和缩略图，返回(生成数量, 错误)"""
+    path, jobs = task
+    try:
+        made = 0
+        img = None
+        for target, size in sorted(jobs, key=lambda job: -job[1][0]):  # 先生成大图，缩略图由大图缩小
+            if os.path.exists(target):
+                continue
+            if img is None:
+                img = Image.open(path)
+                img.thumbnail(size)
+                if img.mode not in ("RGB", "RGBA", "L", "LA", "P"):
+                    img = img.convert("RGB")
+            else:
+                img = img.copy()
+                img.thumbnail(size)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if target.endswith(".jpg"):
+                out = img
+                if img.mode in ("RGBA", "LA", "P"):
+                    out = Image.new("RGB", img.size, "white")
+                    out.paste(img.convert("RGBA"), mask=img.convert("RGBA").split()[-1])
+                out.save(target + ".tmp", "JPEG", quality=90)
+            else:
+                img.save(target + ".tmp", "PNG", compress_level=1)
+            os.replace(target + ".tmp", target)
+            made += 1
+        return made, None
+    except Exception as e:
+        return 0, str(e)
+
+
+def pregenerate_derivatives(image_files, display_size=(1000, 1000), thumbnail_size=(50, 50), display_dir=None,
+                            thumbnail_dir=None, workers=None, batch_size=256, prune=False, progress=None):
+    """
+    按image_files的顺序（sort_key）用进程池预先生成显示图（cache/display）和缩略图（cache/thumbnails）。
+
+    文件名由原图路径、mtime和尺寸决定，已存在的直接跳过，因此可以随时中断后重新运行；
+    原图修改后生成新的文件，prune为True时删除display_dir中不再对应任何原图的显示图
+    （增强图的显示图在cache/enhanced/display中，不受影响）。返回统计信息。
+    """
+    display_dir = display_dir or os.path.join(CACHE_DIR, "display")
+    thumbnails = ThumbnailCache(thumbnail_dir, thumbnail_size, max_bytes=float("inf"))
+    stats = {"images": len(image_files), "generated": 0, "skipped": 0, "errors": {}}
+    tasks = []
+    for path in image_files:
+        jobs = []
+        target = display_derivative_path(path, display_size, display_dir)
+        if target:
+            jobs.append((target, display_size))
+        name = thumbnails.key_for(path)
+        if name:
+            jobs.append((os.path.join(thumbnails.cache_dir, name), thumbnail_size))
+        pending = [job for job in jobs if not os.path.exists(job[0])]
+        if pending:
+            tasks.append((path, pending))
+        else:
+            stats["skipped"] += 1
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for start in range(0, len(tasks), batch_size):
+            batch = tasks[start:start + batch_size]
+            for (path, _), (made, error) in zip(batch, pool.map(_generate_derivatives, batch, chunksize=8)):
+                stats["generated"] += made
+                if error:
+                    stats["errors"][path] = error
+            if progress:
+                progress(min(start + batch_size, len(tasks)), len(tasks))
+
+    if prune and os.path.isdir(display_dir):
+        valid = {os.path.basename(display_derivative_path(path, display_size, display_dir) or "")
+                 for path in image_files}
+        stats["pruned"] = 0
+        for name in os.listdir(display_dir):
+            if name not in valid:
+                os.remove(os.path.join(display_dir, name))
+                stats["pruned"] += 1
+    return stats
+
+
+ENHANCE_STAGES = ("contrast", "trim", "deskew", "binarize")  # 按此顺序执行
+
+
+def stretch_contrast(gray, low=1.0, high=99.0):
+    """按灰度分位数线性拉伸到0-255"""
+    lo, hi = np.percentile(gray, (low, high))
+    if hi - lo < 1:
+        return gray
+    out = (gray.astype(np.float32) - lo) * (255.0 / (hi - lo))
+    return np.clip(out, 0, 255).astype(np.uint8)
+
+
+def otsu_threshold(gray):
+    """大津法阈值：按直方图一次算出所有候选阈值的类间方差，取最大者"""
+    hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    w0 = np.cumsum(hist)
+    w1 = w0[-1] - w0
+    m = np.cumsum(hist * np.arange(256))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        between = w0 * w1 * (m / w0 - (m[-1] - m) / w1) ** 2
+    return int(np.argmax(np.nan_to_num(between)))
+
+
+def estimate_skew(gray, max_angle=3.0, step=0.25, max_points=200000):
+    """
+    用投影轮廓估计倾斜角（度）：把墨迹点沿各候选角度投影到纵轴，文字行对齐时轮廓的起伏最大。
+
+    所有候选角度在一次bincount中同时计算；墨迹点过多时等间隔抽样。
+    """
+    ys, xs = np.nonzero(gray <= otsu_threshold(gray))
+    if len(ys) < 100:
+        return 0.0
+    if len(ys) > max_points:
+        pick = slice(None, None, len(ys) // max_points + 1)
+        ys, xs = ys[pick], xs[pick]
+    angles = np.arange(-max_angle, max_angle + step / 2, step)
+    slopes = np.tan(np.radians(angles))[:, None]
+    rows = np.rint(ys[None, :] - (xs[None, :] - gray.shape[1] / 2) * slopes).astype(np.int64)
+    rows -= rows.min()
+    height = int(rows.max()) + 1
+    offsets = (np.arange(len(angles)) * height)[:, None]
+    profiles = np.bincount((rows + offsets).ravel(), minlength=len(angles) * height).reshape(len(angles), height)
+    scores = (np.diff(profiles.astype(np.float64), axis=1) ** 2).sum(axis=1)
+    return float(angles[int(np.argmax(scores))])
+
+
+def _edge_span(profile, fraction):
+    """去掉两端比例超过fraction的行/列后剩下的[start, end)"""
+    inside = np.nonzero(profile <= fraction)[0]
+    if len(inside) == 0:
+        return 0, len(profile)
+    return int(inside[0]), int(inside[-1]) + 1
+
+
+def trim_borders(gray, margin=8, border_fraction=0.6, ink_fraction=0.002):
+    """
+    返回去掉扫描黑边和空白边后的裁剪框(left, top, right, bottom)。
+
+    边缘上深色比例超过border_fraction的整行/整列视为黑边；黑边以内重新求阈值，
+    按墨迹比例超过ink_fraction的行列确定内容范围，四周留margin像素。
+    """
+    dark = gray <= otsu_threshold(gray)
+    top, bottom = _edge_span(dark.mean(axis=1), border_fraction)
+    left, right = _edge_span(dark.mean(axis=0), border_fraction)
+    inner = gray[top:bottom, left:right]
+    if inner.size == 0:
+        return 0, 0, gray.shape[1], gray.shape[0]
+    ink = inner <= otsu_threshold(inner)
+    box = []
+    for profile, low, high in ((ink.mean(axis=0), left, right), (ink.mean(axis=1), top, bottom)):
+        content = np.nonzero(profile > ink_fraction)[0]
+        if len(content) == 0:
+            box.append((low, high))
+        else:
+            box.append((max(low, low + int(content[0]) - margin), min(high, low + int(content[-1]) + 1 + margin)))
+    (left, right), (top, bottom) = box
+    return left, top, right, bottom
+
+
+def enhance_image(img, stages=ENHANCE_STAGES, timings=None):
+    """
+    对扫描图依次做对比度拉伸、裁边、纠偏和二值化，返回灰度PIL图片。
+
+    先裁掉与图片边缘平行的扫描黑边再估计倾斜角，避免黑边干扰投影轮廓；纠偏时露出的角落填白色。
+    timings为字典时累加各阶段耗时（毫秒）。
+    """
+    def timed(stage, func, value):
+        start = time.perf_counter()
+        result = func(value)
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + (time.perf_counter() - start) * 1000
+        return result
+
+    gray = np.asarray(img.convert("L"))
+    if "contrast" in stages:
+        gray = timed("contrast", stretch_contrast, gray)
+    if "trim" in stages:
+        def trim(array):
+            left, top, right, bottom = trim_borders(array)
+            return array[top:bottom, left:right]
+        gray = timed("trim", trim, gray)
+    if "deskew" in stages:
+        def deskew(array):
+            angle = estimate_skew(array)
+            if not angle:
+                return array
+            rotated = Image.fromarray(array).rotate(angle, Image.BILINEAR, expand=True, fillcolor=255)
+            return np.asarray(rotated)
+        gray = timed("deskew", deskew, gray)
+    if "binarize" in stages:
+        gray = timed("binarize", lambda array: np.where(array > otsu_threshold(array), 255, 0).astype(np.uint8), gray)
+    return Image.fromarray(np.ascontiguousarray(gray))
+
+
+def enhanced_image_path(path, stages=ENHANCE_STAGES, cache_dir=None):
+    """增强后的原尺寸图片在cache/enhanced中的路径（按 路径+mtime+size+阶段 命名），原图不存在时返回None"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    raw = f"{os.path.abspath(path)}|{st.st_mtime_ns}|{st.st_size}|{','.join(stages)}"
+    name = hashlib.sha1(raw.encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir or os.path.join(CACHE_DIR, "enhanced"), name + ".png")
+
+
+def _enhance_batch(task):
+    """进程池中执行：增强一批图片并生成对应的显示图，返回[(错误, 各阶段耗时)]"""
+    items, stages, display_size = task
+    results = []
+    for path, target in items:
+        timings = {}
+        try:
+            with Image.open(path) as img:
+                enhanced = enhance_image(img, stages, timings)
+            start = time.perf_counter()
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            enhanced.save(target + ".tmp", "PNG")
+            os.replace(target + ".tmp", target)
+            display = display_derivative_path(target, display_size)
+            _, error = _generate_derivatives((target, [(display, display_size)]))
+            timings["write"] = (time.perf_counter() - start) * 1000
+            results.append((error, timings))
+        except Exception as e:
+            results.append((str(e), timings))
+    return results
+
+
+def enhance_images(image_files, stages=ENHANCE_STAGES, display_size=(1000, 1000), cache_dir=None, workers=None,
+                   batch_size=16, progress=None):
+    """
+    用进程池为image_files生成增强图（cache/enhanced）及其显示图，每个任务处理batch_size张。
+
+    已生成的跳过，可随时中断后重新运行。返回统计信息，timings为各阶段耗时的汇总。
+    """
+    if np is None:
+        raise RuntimeError("图像增强需要numpy，请先执行 pip install numpy")
+    unknown = set(stages) - set(ENHANCE_STAGES)
+    if unknown:
+        raise ValueError(f"未知的增强步骤: {', '.join(sorted(unknown))}，可选: {', '.join(ENHANCE_STAGES)}")
+    stages = tuple(stage for stage in ENHANCE_STAGES if stage in stages)
+    stats = {"images": len(image_files), "generated": 0, "skipped": 0, "errors": {}}
+    pending = []
+    for path in image_files:
+        target = enhanced_image_path(path, stages, cache_dir)
+        if target is None:
+            continue
+        if os.path.exists(target):
+            stats["skipped"] += 1
+        else:
+            pending.append((path, target))
+    tasks = [(pending[start:start + batch_size], stages, display_size)
+             for start in range(0, len(pending), batch_size)]
+    samples = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for done, (task, results) in enumerate(zip(tasks, pool.map(_enhance_batch, tasks)), 1):
+            for (path, _), (error, timings) in zip(task[0], results):
+                if error:
+                    stats["errors"][path] = error
+                else:
+                    stats["generated"] += 1
+                for stage, ms in timings.items():
+                    samples.setdefault(stage, []).append(ms)
+            if progress:
+                progress(min(done * batch_size, len(pending)), len(pending))
+    stats["timings"] = {stage: summarize_timings(samples[stage])
+                        for stage in ENHANCE_STAGES + ("write",) if stage in samples}
+    return stats
+
+
+PAGE_NUMBER_PATTERN = re.compile(r"(\d+)(?!.*\d)")  # 文件名中最后一组数字作为页数
+
+
+def _true_runs(mask):
+    """布尔数组中连续True段的[(start, end)]数组，形状为(n, 2)"""
+    padded = np.concatenate(([False], mask, [False]))
+    return np.flatnonzero(padded[1:] != padded[:-1]).reshape(-1, 2)
+
+
+def _group_runs(runs, min_gap):
+    """合并间隔小于min_gap的相邻段"""
+    if len(runs) == 0:
+        return runs
+    split = np.flatnonzero(runs[1:, 0] - runs[:-1, 1] >= min_gap)
+    starts = np.concatenate(([0], split + 1))
+    ends = np.concatenate((split, [len(runs) - 1]))
+    return np.stack([runs[starts, 0], runs[ends, 1]], axis=1)
+
+
+def segment_page(gray, min_col_gap=None, min_row_gap=None, min_height=None, ink_fraction=0.002):
+    """
+    用行、列投影轮廓把整页扫描切成词条块，返回按栏从左到右、栏内从上到下排列的[(left, top, right, bottom)]。
+
+    先裁掉黑边和空白边；列轮廓中宽度不小于min_col_gap（默认内容宽度的3%）的空白列把页面分栏；
+    每栏的行轮廓中高度不小于min_row_gap的空白行分隔词条，默认取行间空白高度中位数的2倍，
+    即比普通行距明显更宽的空白才视为词条之间的间隔。高度小于min_height（默认页高的1%）的块视为噪点丢弃。
+    """
+    left, top, right, bottom = trim_borders(gray, margin=0)
+    region = gray[top:bottom, left:right]
+    if region.size == 0:
+        return []
+    ink = region <= otsu_threshold(region)
+    height, width = ink.shape
+    min_col_gap = min_col_gap or max(4, int(width * 0.03))
+    min_height = min_height or max(4, int(gray.shape[0] * 0.01))
+
+    columns = _group_runs(_true_runs(ink.mean(axis=0) > ink_fraction), min_col_gap)
+    boxes = []
+    for c0, c1 in columns:
+        lines = _true_runs(ink[:, c0:c1].mean(axis=1) > ink_fraction)
+        if len(lines) == 0:
+            continue
+        gap = min_row_gap
+        if gap is None:
+            gaps = lines[1:, 0] - lines[:-1, 1]
+            gap = max(3, int(np.median(gaps) * 2) + 1) if len(gaps) else height
+        for r0, r1 in _group_runs(lines, gap):
+            if r1 - r0 < min_height:
+                continue
+            # 块内再按列轮廓收紧左右边界
+            used = np.flatnonzero(ink[r0:r1, c0:c1].mean(axis=0) > ink_fraction)
+            if len(used) == 0:
+                continue
+            boxes.append((left + int(c0 + used[0]), top + int(r0), left + int(c0 + used[-1]) + 1, top + int(r1)))
+    return boxes
+
+
+def segment_manifest_path(image_dir="image"):
+    return os.path.join(image_dir, ".segments.json")
+
+
+def load_segment_manifest(image_dir="image"):
+    """
+    自动切图记录：{"pages": {整页路径: {"signature", "page", "crops"}}, "crops": {切图名: {...}},
+    "pending": {已开始切分但还没有结果的整页路径: 页}}
+    """
+    manifest = load_config(segment_manifest_path(image_dir))
+    manifest.setdefault("pages", {})
+    manifest.setdefault("crops", {})
+    manifest.setdefault("pending", {})
+    return manifest
+
+
+def _segment_page_file(task):
+    """进程池中执行：切分一张整页扫描并写出zhuang_<页>_crop_<序号>.jpg，返回(切图列表, 错误)"""
+    source, page, image_dir, margin, params = task
+    try:
+        with Image.open(source) as img:
+            img = img.convert("L")
+        gray = np.asarray(img)
+        crops = []
+        for n, (left, top, right, bottom) in enumerate(segment_page(gray, **params), 1):
+            box = (max(0, left - margin), max(0, top - margin),
+                   min(img.width, right + margin), min(img.height, bottom + margin))
+            name = f"zhuang_{page}_crop_{n}.jpg"
+            target = os.path.join(image_dir, name)
+            img.crop(box).save(target + ".tmp", "JPEG", quality=95)
+            os.replace(target + ".tmp", target)
+            crops.append((name, list(box)))
+        return crops, None
+    except Exception as e:
+        return [], str(e)
+
+
+def segment_pages(page_files, image_dir="image", workers=None, batch_size=32, margin=6, force=False,
+                  progress=None, **params):
+    """
+    用进程池把整页扫描切成词条图片写入image_dir，返回统计信息。
+
+    页数取文件名中最后一组数字。每批开始前把该批的页记为pending，每页切完后立即把源文件签名和切图的裁剪框
+    写入image/.segments.json，已切过且源文件未变的页跳过；中断时pending页已写出的切图视为本程序生成的，
+    因此可以随时中断后重新运行。image_dir中已有同页的切图但不是本程序生成的
+    （例如手工切的）时跳过该页，force为True时覆盖。多个文件对应同一页数时都不切分（force也不覆盖），
+    这些文件和跳过的页一起记入conflicts（{文件: 原因}）。
+    """
+    if np is None:
+        raise RuntimeError("自动切图需要numpy，请先执行 pip install numpy")
+    os.makedirs(image_dir, exist_ok=True)
+    manifest = load_segment_manifest(image_dir)
+    existing = {}
+    for name in os.listdir(image_dir):
+        key = parse_image_key(name)
+        if key:
+            existing.setdefault(key[0], set()).add(name)
+    stats = {"pages": len(page_files), "segmented": 0, "skipped": 0, "crops": 0, "conflicts": {}, "errors": {}}
+    pages = {}
+    for source in page_files:
+        match = PAGE_NUMBER_PATTERN.search(os.path.splitext(os.path.basename(source))[0])
+        if not match:
+            stats["errors"][source] = "文件名中没有页数"
+            continue
+        pages.setdefault(int(match.group(1)), []).append(source)
+    tasks = []
+    for page, sources in sorted(pages.items()):
+        if len(sources) > 1:
+            # 例如page_12.jpg和page_012.png，无法判断哪个是对的，切图会互相覆盖
+            for source in sources:
+                stats["conflicts"][source] = f"与{len(sources) - 1}个文件的页数重复（第{page}页）"
+            continue
+        source = sources[0]
+        st = os.stat(source)
+        signature = f"{st.st_mtime_ns}:{st.st_size}"
+        done = manifest["pages"].get(source)
+        if done and done["signature"] == signature:
+            stats["skipped"] += 1
+            continue
+        own = set(done["crops"]) if done else set()
+        if manifest["pending"].get(source) == page:
+            own |= existing.get(page, set())  # 上次中断时已写出的切图
+        foreign = existing.get(page, set()) - own
+        if foreign and not force:
+            stats["conflicts"][source] = "已有手工切图（加--force覆盖）"
+            continue
+        tasks.append((source, page, signature, own | foreign))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for start in range(0, len(tasks), batch_size):
+            batch = tasks[start:start + batch_size]
+            for source, page, _, _ in batch:
+                manifest["pending"][source] = page
+            write_json_atomic(segment_manifest_path(image_dir), manifest, ensure_ascii=False)
+            results = pool.map(_segment_page_file, [(source, page, image_dir, margin, params)
+                                                    for source, page, _, _ in batch])
+            for (source, page, signature, old_crops), (crops, error) in zip(batch, results):
+                if error:
+                    stats["errors"][source] = error
+                    continue  # 保留pending，已写出的部分切图下次仍视为本程序生成的
+                names = {name for name, _ in crops}
+                for name in old_crops - names:  # 重新切分后多出的旧切图
+                    manifest["crops"].pop(name, None)
+                    if os.path.exists(os.path.join(image_dir, name)):
+                        os.remove(os.path.join(image_dir, name))
+                for n, (name, box) in enumerate(crops, 1):
+                    manifest["crops"][name] = {"source": source, "page": page, "index": n, "box": box}
+                manifest["pages"][source] = {"signature": signature, "page": page, "crops": sorted(names)}
+                manifest["pending"].pop(source, None)
+                write_json_atomic(segment_manifest_path(image_dir), manifest, ensure_ascii=False)
+                stats["segmented"] += 1
+                stats["crops"] += len(crops)
+            if progress:
+                progress(min(start + batch_size, len(tasks)), len(tasks))
+    return stats
+
+
+class PageImageCache:
+    """
+    已缩放页面图片的LRU缓存。
+
+    缓存中保存的是已经thumbnail过的PIL图片，翻页时只需要做PhotoImage转换；
+    后台线程按请求顺序预解码相邻页面。hits/misses计数用于调整预读数量和内存上限。
+    """
+
+    def __init__(self, size=(1000, 1000), max_items=32, max_bytes=256 * 1024 * 1024, derivative_dir=None):
+        self.size = size
+        self.derivative_dir = derivative_dir
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()  # path -> (PIL图片, 估算字节数)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._generation = 0  # 每次prefetch递增，丢弃过期的预读请求
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def _decode(self, path):
+        # 有预先生成的显示图（python main.py pregen）时只需解码小图
+        derivative = display_derivative_path(path, self.size, self.derivative_dir)
+        if derivative and os.path.exists(derivative):
+            try:
+                with TRACER.span("decode_derivative"):
+                    img = Image.open(derivative)
+                    img.load()
+                return img
+            except Exception as e:
+                print(f"显示图读取失败，改用原图: {derivative} {str(e)}")
+        return load_display_image(path, self.size)
+
+    def _put(self, path, img):
+        nbytes = img.width * img.height * len(img.getbands())
+        with self._lock:
+            if path in self._items:
+                return
+            self._items[path] = (img, nbytes)
+            self._bytes += nbytes
+            while self._items and (len(self._items) > self.max_items or self._bytes > self.max_bytes):
+                _, (_, old_bytes) = self._items.popitem(last=False)
+                self._bytes -= old_bytes
+
+    def get(self, path):
+        """返回缩放后的图片，未命中时在当前线程解码"""
+        with self._lock:
+            if path in self._items:
+                self._items.move_to_end(path)
+                self.hits += 1
+                return self._items[path][0]
+            self.misses += 1
+        img = self._decode(path)
+        self._put(path, img)
+        return img
+
+    def prefetch(self, paths):
+        """按顺序预读给定图片，之前尚未处理的预读请求作废"""
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+        for path in paths:
+            self._queue.put((generation, path))
+
+    def _run(self):
+        while True:
+            generation, path = self._queue.get()
+            if path is None:
+                return
+            with self._lock:
+                if generation != self._generation or path in self._items:
+                    continue
+            try:
+                self._put(path, self._decode(path))
+                with self._lock:
+                    self.prefetched += 1
+            except Exception as e:
+                print(f"预读图片失败: {path} {str(e)}")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "prefetched": self.prefetched,
+                "items": len(self._items),
+                "bytes": self._bytes,
+            }
+
+    def close(self):
+        self._queue.put((None, None))
+
+
+class TilePyramidCache:
+    """
+    页面图片的多分辨率瓦片金字塔（cache/tiles/<哈希>/）。
+
+    第L层是原图缩小2^L倍，每层切成tile×tile的PNG瓦片。某一层第一次被请求时由后台线程用draft按比例解码原图
+    得到该层，再逐层用reduce(2)从上一层缩小得到更粗的各层，内存中同时只保留相邻两层；
+    之后放大查看只解码可见区域的几个瓦片，不再解码整张原图。内存中的瓦片按字节数LRU淘汰，
+    磁盘上按整个金字塔的最近使用时间淘汰。
+    """
+
+    def __init__(self, cache_dir=None, tile=256, max_bytes=64 * 1024 * 1024, max_disk_bytes=1024 * 1024 * 1024):
+        self.cache_dir = cache_dir or os.path.join(CACHE_DIR, "tiles")
+        self.tile = tile
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._tiles = OrderedDict()  # (金字塔, 层, 列, 行) -> (PIL图片, 字节数)
+        self._bytes = 0
+        self._meta = {}  # 金字塔 -> 金字塔信息
+        self._pending = set()  # 排队或正在生成的(路径, 层)
+        self.failed = set()
+        self._disk = {}  # 金字塔 -> (最近使用时间, 字节数)
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                meta_path = os.path.join(entry.path, "meta.json")
+                if entry.is_dir() and os.path.exists(meta_path):
+                    self._disk[entry.name] = (os.path.getmtime(meta_path), load_config(meta_path).get("bytes", 0))
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def key_for(self, path):
+        st = os.stat(path)
+        raw = f"{os.path.abspath(path)}|{st.st_mtime_ns}|{st.st_size}|{self.tile}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def info(self, path):
+        """返回金字塔信息{key, width, height, levels, done, bytes}，第一次访问时只读取原图文件头"""
+        key = self.key_for(path)  # 原图修改后对应新的金字塔
+        with self._lock:
+            meta = self._meta.get(key)
+        if meta is not None:
+            return meta
+        meta_path = os.path.join(self.cache_dir, key, "meta.json")
+        meta = load_config(meta_path)
+        if not meta:
+            with Image.open(path) as img:
+                width, height = img.size
+            levels = 1
+            while max(width, height) > self.tile * 2 ** (levels - 1):
+                levels += 1
+            meta = {"width": width, "height": height, "levels": levels, "done": [], "bytes": 0}
+        meta["key"] = key
+        with self._lock:
+            self._meta[key] = meta
+        if key in self._disk:
+            self._disk[key] = (time.time(), meta["bytes"])
+            try:
+                os.utime(meta_path)
+            except OSError:
+                pass
+        return meta
+
+    def level_size(self, meta, level):
+        scale = 2 ** level
+        return -(-meta["width"] // scale), -(-meta["height"] // scale)
+
+    def has_level(self, path, level):
+        return level in self.info(path)["done"]
+
+    def request_level(self, path, level):
+        """在后台生成某一层，已生成或正在生成时返回True，生成失败过时返回False"""
+        if (path, level) in self.failed:
+            return False
+        if self.has_level(path, level):
+            return True
+        with self._lock:
+            if (path, level) in self._pending:
+                return True
+            self._pending.add((path, level))
+        self._queue.put((path, level))
+        return True
+
+    def generate_level(self, path, level):
+        with TRACER.span("tile_generate", level=level):
+            self._generate_level(path, level)
+
+    def _generate_level(self, path, level):
+        meta = self.info(path)
+        if level in meta["done"]:
+            return
+        width, height = self.level_size(meta, level)
+        with Image.open(path) as src:
+            if level > 0:
+                src.draft(src.mode, (width, height))  # JPEG按比例缩小解码，减少内存和时间
+            img = src if src.mode in ("RGB", "RGBA", "L", "LA") else src.convert("RGB")
+            if img.size != (width, height):
+                img = img.resize((width, height), Image.LANCZOS)
+            else:
+                img.load()
+        # 更粗的层依次从上一层缩小一半（与level_size一样向上取整），写完即释放
+        for current in range(level, meta["levels"]):
+            if current > level:
+                img = img.reduce(2)
+            if current not in meta["done"]:
+                self._write_level(meta, current, img)
+        self.evict_disk(keep=meta["key"])
+
+    def _write_level(self, meta, level, img):
+        width, height = img.size
+        level_dir = os.path.join(self.cache_dir, meta["key"], str(level))
+        os.makedirs(level_dir, exist_ok=True)
+        nbytes = 0
+        for row in range(-(-height // self.tile)):
+            for col in range(-(-width // self.tile)):
+                box = (col * self.tile, row * self.tile,
+                       min(width, (col + 1) * self.tile), min(height, (row + 1) * self.tile))
+                tile_path = os.path.join(level_dir, f"{col}_{row}.png")
+                img.crop(box).save(tile_path + ".tmp", "PNG", compress_level=1)
+                os.replace(tile_path + ".tmp", tile_path)
+                nbytes += os.path.getsize(tile_path)
+        with self._lock:
+            meta["done"] = sorted(set(meta["done"]) | {level})
+            meta["bytes"] += nbytes
+            self._disk[meta["key"]] = (time.time(), meta["bytes"])
+            data = {k: v for k, v in meta.items() if k != "key"}
+        write_json_atomic(os.path.join(self.cache_dir, meta["key"], "meta.json"), data)
+
+    def _run(self):
+        while True:
+            path, level = self._queue.get()
+            if path is None:
+                return
+            try:
+                self.generate_level(path, level)
+            except Exception as e:
+                self.failed.add((path, level))
+                print(f"瓦片生成失败: {path} 第{level}层 {str(e)}")
+            finally:
+                with self._lock:
+                    self._pending.discard((path, level))
+
+    def get_tile(self, path, level, col, row):
+        meta = self.info(path)
+        cache_key = (meta["key"], level, col, row)
+        with self._lock:
+            if cache_key in self._tiles:
+                self._tiles.move_to_end(cache_key)
+                return self._tiles[cache_key][0]
+        tile = Image.open(os.path.join(self.cache_dir, meta["key"], str(level), f"{col}_{row}.png"))
+        tile.load()
+        nbytes = tile.width * tile.height * len(tile.getbands())
+        with self._lock:
+            self._tiles[cache_key] = (tile, nbytes)
+            self._bytes += nbytes
+            while len(self._tiles) > 1 and self._bytes > self.max_bytes:
+                _, (_, old_bytes) = self._tiles.popitem(last=False)
+                self._bytes -= old_bytes
+        return tile
+
+    def compose(self, path, level, box):
+        """拼接第level层中box=(左, 上, 右, 下)范围内的瓦片，返回该区域的图片；该层未生成时返回None"""
+        meta = self.info(path)
+        if level not in meta["done"]:
+            return None
+        width, height = self.level_size(meta, level)
+        left, top = max(0, box[0]), max(0, box[1])
+        right, bottom = min(width, box[2]), min(height, box[3])
+        region = None
+        for row in range(top // self.tile, (bottom - 1) // self.tile + 1):
+            for col in range(left // self.tile, (right - 1) // self.tile + 1):
+                tile = self.get_tile(path, level, col, row)
+                if region is None:
+                    region = Image.new(tile.mode, (right - left, bottom - top))
+                region.paste(tile, (col * self.tile - left, row * self.tile - top))
+        return region
+
+    def preview(self, path, size):
+        """用已生成的最小的、不小于size的层拼出预览图，没有合适的层时返回None"""
+        meta = self.info(path)
+        scale = min(size[0] / meta["width"], size[1] / meta["height"], 1.0)
+        for level in sorted(meta["done"], reverse=True):
+            width, height = self.level_size(meta, level)
+            if width >= meta["width"] * scale and height >= meta["height"] * scale:
+                img = self.compose(path, level, (0, 0, width, height))
+                img.thumbnail(size)
+                return img
+        return None
+
+    def evict_disk(self, keep=None):
+        with self._lock:
+            total = sum(nbytes for _, nbytes in self._disk.values())
+            victims = []
+            for key, (_, nbytes) in sorted(self._disk.items(), key=lambda item: item[1][0]):
+                if total <= self.max_disk_bytes * 0.9:
+                    break
+                if key == keep:
+                    continue
+                total -= nbytes
+                victims.append(key)
+                del self._disk[key]
+            for key in victims:
+                self._meta.pop(key, None)
+        for key in victims:
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+
+    def close(self):
+        self._queue.put((None, None))
+
+
+class TiledImageView:
+    """
+    画布上可缩放、拖动的图片视图。
+
+    缩放比例不超过预览图（PageImageCache中的显示尺寸图片）时直接从预览图裁剪可见区域；
+    继续放大时改用TilePyramidCache中相应层的瓦片，只拼接可见区域，该层还未生成时先显示放大的预览图。
+    滚轮以鼠标位置为中心缩放，左键拖动平移，右键恢复初始大小。
+    """
+
+    ZOOM_STEP = 1.25
+    MAX_ZOOM = 8.0
+
+    def __init__(self, canvas, tiles):
+        self.canvas = canvas
+        self.tiles = tiles
+        self.path = None
+        self.preview = None
+        self.size = (1, 1)
+        self.preview_scale = 1.0
+        self.zoom = 1.0
+        self.center = (0.0, 0.0)
+        self.photo = None
+        self._render_id = None
+        self._drag = None
+        canvas.bind("<MouseWheel>", lambda e: self.zoom_at(self.ZOOM_STEP if e.delta > 0 else 1 / self.ZOOM_STEP, e.x, e.y))
+        canvas.bind("<Button-4>", lambda e: self.zoom_at(self.ZOOM_STEP, e.x, e.y))
+        canvas.bind("<Button-5>", lambda e: self.zoom_at(1 / self.ZOOM_STEP, e.x, e.y))
+        canvas.bind("<ButtonPress-1>", self._start_drag)
+        canvas.bind("<B1-Motion>", self._drag_to)
+        canvas.bind("<Button-3>", lambda e: self.reset())
+        canvas.bind("<Configure>", lambda e: self.schedule_render())
+
+    def set_image(self, path, preview):
+        """显示path，preview为已缩小的整张图片（决定初始缩放比例）"""
+        try:
+            with Image.open(path) as img:
+                self.size = img.size  # 只读取文件头
+        except Exception:
+            self.size = preview.size
+        self.path = path
+        self.preview = preview
+        self.preview_scale = preview.width / self.size[0]
+        self.reset()
+
+    def clear(self):
+        self.path = None
+        self.preview = None
+        self.photo = None
+        self.canvas.delete("view")
+
+    def reset(self):
+        self.zoom = self.preview_scale
+        self.center = (self.size[0] / 2, self.size[1] / 2)
+        self.render()
+
+    def canvas_size(self):
+        width, height = self.canvas.winfo_width(), self.canvas.winfo_height()
+        if width <= 1 or height <= 1:  # 尚未显示时使用设定的尺寸
+            width, height = int(self.canvas["width"]), int(self.canvas["height"])
+        return width, height
+
+    def zoom_at(self, factor, x, y):
+        if self.preview is None:
+            return
+        width, height = self.canvas_size()
+        min_zoom = min(self.preview_scale, width / self.size[0], height / self.size[1])
+        zoom = max(min_zoom, min(self.MAX_ZOOM, self.zoom * factor))
+        # 保持鼠标下的点不动
+        px = self.center[0] + (x - width / 2) / self.zoom
+        py = self.center[1] + (y - height / 2) / self.zoom
+        self.center = (px - (x - width / 2) / zoom, py - (y - height / 2) / zoom)
+        self.zoom = zoom
+        self.schedule_render()
+
+    def _start_drag(self, event):
+        self._drag = (event.x, event.y)
+
+    def _drag_to(self, event):
+        if self._drag is None or self.preview is None:
+            return
+        dx, dy = event.x - self._drag[0], event.y - self._drag[1]
+        self._drag = (event.x, event.y)
+        self.center = (self.center[0] - dx / self.zoom, self.center[1] - dy / self.zoom)
+        self.schedule_render()
+
+    def schedule_render(self, delay=None):
+        """合并连续的滚轮、拖动事件，空闲时只绘制一次"""
+        if self._render_id is not None:
+            return
+        if delay is None:
+            self._render_id = self.canvas.after_idle(self.render)
+        else:
+            self._render_id = self.canvas.after(delay, self.render)
+
+    def level_for(self, zoom):
+        """不低于当前缩放所需分辨率的最粗的一层"""
+        level = 0
+        while 2 ** -(level + 1) >= zoom:
+            level += 1
+        return min(level, self.tiles.info(self.path)["levels"] - 1)
+
+    def render(self):
+        if self._render_id is not None:
+            self.canvas.after_cancel(self._render_id)
+            self._render_id = None
+        if self.preview is None:
+            return
+        with TRACER.span("render_view"):
+            self._render()
+
+    def _render(self):
+        width, height = self.canvas_size()
+        zoom = self.zoom
+        x0 = self.center[0] - width / 2 / zoom
+        y0 = self.center[1] - height / 2 / zoom
+        # 可见区域与图片的交集（原图坐标）
+        left, top = max(0.0, x0), max(0.0, y0)
+        right = min(float(self.size[0]), x0 + width / zoom)
+        bottom = min(float(self.size[1]), y0 + height / zoom)
+        self.canvas.delete("view")
+        if right <= left or bottom <= top:
+            return
+        out_size = (max(1, round((right - left) * zoom)), max(1, round((bottom - top) * zoom)))
+
+        region = None
+        if zoom > self.preview_scale * 1.01:
+            try:
+                level = self.level_for(zoom)
+                if self.tiles.has_level(self.path, level):
+                    scale = 2 ** level
+                    region = self.tiles.compose(self.path, level, (
+                        int(left / scale), int(top / scale), math.ceil(right / scale), math.ceil(bottom / scale)))
+                elif self.tiles.request_level(self.path, level):
+                    self.schedule_render(200)  # 瓦片生成后重新绘制
+            except Exception as e:
+                print(f"瓦片读取失败: {str(e)}")
+        if region is None:
+            s = self.preview_scale
+            region = self.preview.crop((int(left * s), int(top * s), math.ceil(right * s), math.ceil(bottom * s)))
+        if region.size != out_size:
+            region = region.resize(out_size, Image.BILINEAR)
+        self.photo = ImageTk.PhotoImage(region)
+        self.canvas.create_image(round((left - x0) * zoom), round((top - y0) * zoom),
+                                 anchor=tk.NW, image=self.photo, tags="view")
+
+
+def outline_node_text(kind, index, node, max_len=24):
+    """结构树中读音/词性/例句节点显示的文字"""
+    if kind == "pron":
+        text = f"读音{index + 1} {node.get('zhuang_spelling', '')} {node.get('ipa', '')}"
+    elif kind == "entry":
+        text = f"词性{index + 1} {node.get('part_of_speech', '')} {node.get('meaning', '')}"
+    else:
+        text = f"例句{index + 1} {node.get('壮文', '')}"
+    text = text.strip()
+    return text if len(text) <= max_len else text[:max_len - 1] + "…"
+
+
+def set_entry_text(entry, value):
+    """内容不同时才改写输入框，避免无意义的删除和插入"""
+    value = str(value)
+    if entry.get() != value:
+        entry.delete(0, tk.END)
+        entry.insert(0, value)
+
+
+class ThumbnailStrip:
+    """
+    虚拟化的截图缩略图条。
+
+    画布上只保留能看到的数量的槽位（缩略图+边框），滚动时把槽位移到新位置并换上对应的缩略图，
+    不再为每张截图创建、销毁Label；缩略图由后台线程解码，完成后在界面线程填入。
+    每次刷新的开销只与可见槽位数有关，与截图总数无关。
+    """
+
+    SLOT = 56
+    MAX_PHOTOS = 256
+
+    def __init__(self, parent, thumbnail_cache, on_click):
+        self.thumbnail_cache = thumbnail_cache
+        self.on_click = on_click
+        self.frame = tk.Frame(parent)
+        self.canvas = tk.Canvas(self.frame, height=self.SLOT, highlightthickness=0)
+        self.scrollbar = tk.Scrollbar(self.frame, orient=tk.HORIZONTAL, command=self.canvas.xview)
+        self.canvas.configure(xscrollcommand=self._on_scroll)
+        self.canvas.pack(fill=tk.X)
+        self.items = []  # [(路径, 是否为未提交的截图)]
+        self.slots = []  # [(图片id, 边框id, 文字id)]
+        self._photos = OrderedDict()  # 路径 -> PhotoImage（最近使用的若干张）
+        self._failed = set()
+        self._pending = set()
+        self._generation = 0
+        self._poll_id = None
+        self._requests = queue.Queue()
+        self._results = queue.Queue()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+        self.canvas.bind("<Configure>", lambda e: self.layout())
+        self.canvas.bind("<Button-1>", self._click)
+        self.canvas.bind("<MouseWheel>", lambda e: self.canvas.xview_scroll(-1 if e.delta > 0 else 1, "units"))
+        self.canvas.bind("<Button-4>", lambda e: self.canvas.xview_scroll(-1, "units"))
+        self.canvas.bind("<Button-5>", lambda e: self.canvas.xview_scroll(1, "units"))
+
+    def pack(self, **kwargs):
+        self.frame.pack(**kwargs)
+
+    def set_items(self, items):
+        if items == self.items:
+            self.layout()
+            return
+        self.items = list(items)
+        self._generation += 1
+        self._pending.clear()
+        self._failed.clear()
+        self.canvas.configure(scrollregion=(0, 0, max(1, len(self.items) * self.SLOT), self.SLOT),
+                              xscrollincrement=self.SLOT)
+        self.canvas.xview_moveto(0)
+        self.layout()
+
+    def _on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        overflow = float(first) > 0 or float(last) < 1
+        if overflow and not self.scrollbar.winfo_ismapped():
+            self.scrollbar.pack(fill=tk.X)
+        elif not overflow and self.scrollbar.winfo_ismapped():
+            self.scrollbar.pack_forget()
+        self.layout()
+
+    def _visible_range(self):
+        width = max(self.canvas.winfo_width(), self.SLOT)
+        first = max(0, int(self.canvas.canvasx(0) // self.SLOT))
+        return first, min(len(self.items), first + width // self.SLOT + 2)
+
+    def layout(self):
+        """把槽位分配给当前可见的截图，槽位不够时补建，多余的隐藏"""
+        first, last = self._visible_range()
+        while len(self.slots) < last - first:
+            self.slots.append((self.canvas.create_image(0, 0, anchor=tk.CENTER),
+                               self.canvas.create_rectangle(0, 0, 0, 0),
+                               self.canvas.create_text(0, 0, text="", fill="gray")))
+        for k, (image_id, border_id, text_id) in enumerate(self.slots):
+            index = first + k
+            if index >= last:
+                for item in (image_id, border_id, text_id):
+                    self.canvas.itemconfigure(item, state=tk.HIDDEN)
+                continue
+            path, pending = self.items[index]
+            x = index * self.SLOT + self.SLOT // 2
+            y = self.SLOT // 2
+            photo = self._photos.get(path)
+            if photo is not None:
+                self._photos.move_to_end(path)
+            elif path not in self._failed:
+                self._request(path)
+            self.canvas.coords(image_id, x, y)
+            self.canvas.itemconfigure(image_id, image=photo if photo is not None else "", state=tk.NORMAL)
+            self.canvas.coords(border_id, x - 26, y - 26, x + 26, y + 26)
+            # 未提交的截图用红色粗边框标出
+            self.canvas.itemconfigure(border_id, outline="red" if pending else "black",
+                                      width=2 if pending else 1, state=tk.NORMAL)
+            self.canvas.coords(text_id, x, y)
+            text = "缺失" if path in self._failed else ("" if photo is not None else "…")
+            self.canvas.itemconfigure(text_id, text=text, state=tk.NORMAL)
+
+    def _request(self, path):
+        if path in self._pending:
+            return
+        self._pending.add(path)
+        self._requests.put((self._generation, path))
+        if self._poll_id is None:
+            self._poll_id = self.canvas.after(30, self._poll)
+
+    def _run(self):
+        while True:
+            generation, path = self._requests.get()
+            if path is None:
+                return
+            if generation != self._generation:
+                continue  # 已切换到其他读音或页面
+            try:
+                self._results.put((generation, path, self.thumbnail_cache.get(path), None))
+            except Exception as e:
+                self._results.put((generation, path, None, str(e)))
+
+    def _poll(self):
+        self._poll_id = None
+        changed = False
+        while True:
+            try:
+                generation, path, img, error = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if generation != self._generation:
+                continue
+            self._pending.discard(path)
+            changed = True
+            if error:
+                self._failed.add(path)
+                print(f"缩略图加载失败: {error}")
+                TRACER.instant("error", where="ThumbnailStrip", message=error)
+                continue
+            self._photos[path] = ImageTk.PhotoImage(img)
+            while len(self._photos) > self.MAX_PHOTOS:
+                self._photos.popitem(last=False)
+        if changed:
+            self.layout()
+        if self._pending:
+            self._poll_id = self.canvas.after(30, self._poll)
+
+    def _click(self, event):
+        index = int(self.canvas.canvasx(event.x) // self.SLOT)
+        if 0 <= index < len(self.items) and self.items[index][0] not in self._failed:
+            self.on_click(self.items[index][0])
+
+    def close(self):
+        self._requests.put((None, None))
+
+
 class ImageViewerApp:
-    def __init__(self, root):
+    # 开启trace_enabled时计时的界面回调
+    TRACED_CALLBACKS = (
+        "show_previous_image", "show_next_image", "show_previous_unannotated", "show_next_unannotated",
+        "jump_to_page", "submit_data", "capture_screen", "import_image", "load_current_image",
+        "update_form", "save_current_form", "update_thumbnail_panel", "flush_draft", "search_annotations",
+        "show_enlarged_image", "add_new_pronunciation", "previous_pronunciation", "next_pronunciation",
+        "delete_pronunciation", "add_new_entry", "previous_entry", "next_entry", "delete_entry",
+        "add_new_example", "previous_example", "next_example", "delete_example", "navigate_to", "refresh_outline",
+        "show_stats_panel"
+    )
+
+    def __init__(self, root, annotator=None):
         self.root = root
         self.root.geometry("600x1400")
         self.root.title("字典json生成0320v2.0.4")
@@ -44,30 +4010,121 @@ class ImageViewerApp:
         # 加载图片文件
         image_dir = "image"
         output_dir = "output"
-        image_extensions = ["*.png", "*.jpg", "*.jpeg"]
-        self.image_files = sorted(
-            [f for ext in image_extensions for f in glob.glob(os.path.join(image_dir, ext))],
-            key=self.sort_key  # 正确引用静态方法
-        )#默认是按照什么排序的 a:默认是按照文件名排序的
+        # 通过持久化索引获取排好序的文件列表，先按页数再按字数排序
+        self.directory_index = ImageDirectoryIndex(image_dir)
+        self.image_files = self.directory_index.refresh()
+        if self.directory_index.fallback:
+            print(f"以下文件不符合zhuang_<页>_crop_<序号>命名，已排在最后: {self.directory_index.fallback}")
 
         # 加载配置文件
-        config_path = "config.json"
         self.current_image_index = 0
         self.current_pronunciation_index = 0  # 当前读音索引
         self.current_entry_index = 0  # 当前词性条目索引
         self.current_example_index = 0
-        if os.path.exists(config_path):
-            try:
-                with open(config_path, "r") as f:
-                    config = json.load(f)
-                    last_index = config.get("last_index", 0)#get（）使用方法，如果键不存在，返回默认值
-                    if 0 <= last_index < len(self.image_files):
-                        self.current_image_index = last_index
-            except:
-                pass
+        self.config = load_config()
+
+        # 耗时追踪，关闭时不做任何包装
+        TRACER.configure(self.config.get("trace_enabled", False), self.config.get("trace_capacity", 20000),
+                         self.config.get("trace_slow_ms", 200))
+        if TRACER.enabled:
+            self.enable_tracing()
+
+        # 标注存储与状态索引，启动时读取一次已提交的图片名
+        self.store = open_annotation_store(self.config.get("storage_backend", "file"), output_dir)
+        self.status_index = AnnotationStatusIndex(self.image_files, self.store.stems())
+
+        # 多人标注：图片租约、按范围分配，浏览进度和日志按标注者分开保存
+        self.annotator_id = annotator or default_annotator_id()
+        self.multi_annotator = bool(self.config.get("multi_annotator", False))
+        self.session_path = CONFIG_PATH
+        journal_dir = JOURNAL_DIR
+        self.leases = None
+        self.allocator = None
+        self.allocation = None
+        self.lease_holder = None  # 当前图片被他人持有时为对方的租约内容
+        self.loaded_version = ANY_VERSION
+        if self.multi_annotator:
+            session_dir = os.path.join(output_dir, ".sessions")
+            self.session_path = os.path.join(session_dir, f"{self.annotator_id}.json")
+            journal_dir = os.path.join(JOURNAL_DIR, self.annotator_id)
+            self.leases = LeaseManager(os.path.join(output_dir, ".leases"), self.annotator_id,
+                                       ttl=self.config.get("lease_seconds", 300))
+            self.allocator = PageAllocator(session_dir, self.annotator_id,
+                                           size=self.config.get("allocation_size", 50),
+                                           expire_hours=self.config.get("allocation_expire_hours", 24))
+            print(f"多人标注模式，标注者: {self.annotator_id}")
+            if self.store.name == "jsonl":
+                # 所有人共用一个日志文件，追加要排队加锁，每次读取都要补读其他人追加的记录
+                messagebox.showwarning("提示", "多人标注模式不建议使用jsonl存储方式，请在config.json中把storage_backend改为file")
+
+        last_index = load_config(self.session_path).get("last_index", 0)#get（）使用方法，如果键不存在，返回默认值
+        if isinstance(last_index, int) and 0 <= last_index < len(self.image_files):
+            self.current_image_index = last_index
+        if self.allocator:
+            self.claim_allocation(create=True, move=False)
+
+        self.last_capture_timings = {}
+
+        # 自动切图的记录，新页面据此预填页码和字位置
+        self.segment_crops = load_segment_manifest()["crops"]
+
+        # 显示增强后的图片（对比度拉伸、裁边、纠偏、二值化）
+        self.enhance_stages = None
+        if self.config.get("enhance_display", False):
+            stages = self.config.get("enhance_stages", list(ENHANCE_STAGES))
+            self.enhance_stages = tuple(stage for stage in ENHANCE_STAGES if stage in stages)
+
+        # 主图片缓存与相邻页预读
+        self.prefetch_radius = self.config.get("prefetch_radius", 3)
+        self.image_cache = PageImageCache(
+            max_items=self.config.get("image_cache_items", 32),
+            max_bytes=self.config.get("image_cache_mb", 256) * 1024 * 1024
+        )
+        self.thumbnail_cache = ThumbnailCache(
+            max_bytes=self.config.get("thumbnail_cache_mb", 64) * 1024 * 1024
+        )
+        # 放大查看时使用的瓦片金字塔
+        self.tile_cache = TilePyramidCache(
+            max_bytes=self.config.get("tile_cache_mb", 64) * 1024 * 1024,
+            max_disk_bytes=self.config.get("tile_disk_cache_mb", 1024) * 1024 * 1024
+        )
+
+        # 搜索索引在后台线程中加载并与存储同步
+        self.search_index = AnnotationSearchIndex(output_dir)
+        threading.Thread(target=self._load_search_index, daemon=True).start()
+
+        # 标注量统计，提交时即时更新
+        self.annotation_stats = AnnotationStats(output_dir)
+        threading.Thread(target=self._load_annotation_stats, daemon=True).start()
+
+        # 草稿日志，恢复上次未提交的修改
+        self.draft_journal = DraftJournal(os.path.join(journal_dir, "drafts.jsonl"))
+        self._draft_flush_id = None
+        for stem in self.draft_journal.drafts:
+            if stem in self.status_index.positions and \
+                    self.status_index.get_status(self.status_index.positions[stem]) == AnnotationStatusIndex.UNANNOTATED:
+                self.status_index.set_status_by_stem(stem, AnnotationStatusIndex.DRAFT)
+        if self.draft_journal.drafts:
+            print(f"已恢复 {len(self.draft_journal.drafts)} 个未提交的草稿")
+
+        # 后台提交线程，先重放上次未完成的提交
+        self.image_index = OutputImageIndex(threshold=self.config.get("dedupe_threshold", 10))
+        self._submitted_records = {}  # 图片名 -> 已交给后台、还没有结果的提交记录（按提交顺序）
+        self.submit_writer = SubmitWriter(self.store, os.path.join(journal_dir, "submit"),
+                                          thumbnail_cache=self.thumbnail_cache, image_index=self.image_index)
+        recovered = self.submit_writer.recover()
+        if recovered:
+            print(f"已恢复 {recovered} 个未完成的提交")
+
+        # 后台回收temp和output_image中没有被引用的文件
+        if self.config.get("gc_mode", "report") != "off":
+            threading.Thread(target=self._collect_orphans, daemon=True).start()
 
         # 创建界面
         self.create_widgets()
+        self.root.after(200, self.poll_submit_results)
+        if self.leases:
+            self.root.after(self.leases.ttl * 1000 // 3, self.renew_leases)
 
         # 加载当前图片
         if self.image_files:
@@ -75,15 +4132,36 @@ class ImageViewerApp:
         else:
             self.show_empty_message()
 
+    def enable_tracing(self):
+        """用计时包装替换界面回调（须在创建控件之前），F12导出当前的追踪记录"""
+        for name in self.TRACED_CALLBACKS:
+            setattr(self, name, TRACER.wrap(getattr(self, name), name))
+
+        def report_callback_exception(exc, val, tb):
+            TRACER.instant("exception", message=f"{exc.__name__}: {val}")
+            tk.Tk.report_callback_exception(self.root, exc, val, tb)
+
+        self.root.report_callback_exception = report_callback_exception
+        self.root.bind("<F12>", lambda e: self.export_trace())
+        print("已开启耗时追踪，按F12导出到traces目录")
+
+    def export_trace(self):
+        try:
+            path = TRACER.export()
+        except Exception as e:
+            messagebox.showerror("错误", f"追踪记录导出失败: {str(e)}")
+            return
+        messagebox.showinfo("追踪记录", f"已导出到：\n{path}\n可用chrome://tracing或ui.perfetto.dev打开")
+
     @staticmethod#静态方法 a:静态方法（static method）是Python中的一个特殊类型方法，它与普通方法不同，它没有self参数，而是直接使用类名调用。静态方法通常用于定义一些与类相关的函数，而不依赖于类的实例。
     def sort_key(file_path):
-        filename = os.path.basename(file_path)
-        main_name = os.path.splitext(filename)[0]
-        parts = main_name.split('_')
-        num1 = int(parts[1])
-        num2 = int(parts[3])
-        return (num1, num2)
+        key = parse_image_key(file_path)
+        if key is None:
+            # 不符合命名规则的文件排在最后，按文件名排序
+            return (float("inf"), os.path.basename(file_path))
+        return key
     def show_empty_message(self):
+        self.image_view.clear()
         self.img_canvas.delete("all")
         self.img_canvas.create_text(250, 250, text="找不到图片,请在目录中创建image文件夹", fill="red")
         self.title_label.config(text="错误状态")
@@ -108,14 +4186,21 @@ class ImageViewerApp:
         self.title_label = tk.Label(left_frame, text="", font=("微软雅黑", 12))
         self.title_label.pack(pady=5)
 
+        # 后台提交状态
+        self.submit_status_label = tk.Label(left_frame, text="", fg="gray")
+        self.submit_status_label.pack()
+
         self.img_canvas = tk.Canvas(left_frame, width=100, height=100, bg='#e0e0e0')
         self.img_canvas.pack()
+        # 滚轮缩放、拖动平移、右键还原
+        self.image_view = TiledImageView(self.img_canvas, self.tile_cache)
 
-        # 缩略图容器
-        self.thumbnail_frame = tk.Frame(left_frame, height=80)
-        self.thumbnail_frame.pack(pady=5, fill=tk.X)
-        self.thumbnail_labels = []
-        self.thumbnail_images = []
+        # 缩略图条：当前读音（或勾选后整页全部读音）的所有截图，点击放大
+        self.thumbnail_strip = ThumbnailStrip(left_frame, self.thumbnail_cache, self.show_enlarged_image)
+        self.thumbnail_strip.pack(pady=5, fill=tk.X)
+        self.thumbnail_all_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(left_frame, text="显示整页全部读音的截图", variable=self.thumbnail_all_var,
+                       command=self.update_thumbnail_panel).pack()
 
         nav_frame1 = tk.Frame(left_frame)
         nav_frame1.pack(pady=5)
@@ -141,81 +4226,52 @@ class ImageViewerApp:
 
         second_row_btns = [
             ("导入图片", self.import_image),
-            ("实时截图", self.capture_screen)
+            ("实时截图", self.capture_screen),
+            ("上一未标注", self.show_previous_unannotated),
+            ("下一未标注", self.show_next_unannotated),
+            ("统计", self.show_stats_panel)
         ]
+        if self.allocator:
+            second_row_btns.append(("领取范围", self.request_new_allocation))
 
         for text, cmd in second_row_btns:
             tk.Button(nav_frame2, text=text, width=8, command=cmd).pack(side=tk.LEFT, padx=2)
 
-    def update_thumbnail_panel(self):
-        """更新缩略图显示（显示当前读音的截图）"""
-        # 清空现有缩略图
-        for label in self.thumbnail_labels:
-            label.destroy()
-        self.thumbnail_labels.clear()
-        self.thumbnail_images.clear()
-
-        # 获取当前读音数据
-        pron = self.current_data["pronunciations"][self.current_pronunciation_index]
-
-        # 优先级：临时图片 > 已提交图片
-        temp_path = pron.get("imported_source_path", "")
-        if temp_path and os.path.exists(temp_path):
-            try:
-                img = Image.open(temp_path)
-                img.thumbnail((50, 50))
-                photo = ImageTk.PhotoImage(img)
-                label = tk.Label(self.thumbnail_frame, image=photo,
-                                 borderwidth=2, relief="solid",
-                                 highlightbackground="red")
-                label.bind("<Button-1>", lambda e, path=temp_path: self.show_enlarged_image(path))
-                label.image = photo
-                label.pack(side=tk.LEFT, padx=2)
-                self.thumbnail_labels.append(label)
-                self.thumbnail_images.append(photo)
-                return
-            except Exception as e:
-                print(f"临时缩略图加载失败: {str(e)}")
+        # 搜索：汉字、壮文、国际音标、意思
+        search_frame = tk.Frame(left_frame)
+        search_frame.pack(pady=5)
+        self.search_entry = tk.Entry(search_frame, width=20)
+        self.search_entry.pack(side=tk.LEFT, padx=2)
+        self.search_entry.bind("<Return>", lambda e: self.search_annotations())
+        self.search_mode_var = tk.StringVar(value="精确")
+        tk.OptionMenu(search_frame, self.search_mode_var, "精确", "前缀", "包含").pack(side=tk.LEFT, padx=2)
+        tk.Button(search_frame, text="搜索", width=6, command=self.search_annotations).pack(side=tk.LEFT, padx=2)
 
-        # 显示已提交的图片（只显示最新一张）
-        input_dir = "output_image"
-        if pron.get("imported_image"):
-            latest_image = pron["imported_image"][-1]
-            img_path = os.path.join(input_dir, latest_image)
-            if os.path.exists(img_path):
-                try:
-                    img = Image.open(img_path)
-                    img.thumbnail((50, 50))
-                    photo = ImageTk.PhotoImage(img)
-                    label = tk.Label(self.thumbnail_frame, image=photo,
-                                     borderwidth=1, relief="solid")
-                    label.image = photo
-                    label.pack(side=tk.LEFT, padx=2)
-                    label.bind("<Button-1>", lambda e, path=img_path: self.show_enlarged_image(path))
-                    self.thumbnail_labels.append(label)
-                    self.thumbnail_images.append(photo)
-                except Exception as e:
-                    print(f"缩略图加载失败: {str(e)}")
+    def update_thumbnail_panel(self):
+        """更新缩略图条（未提交的截图在前，红框标出），缩略图在后台解码"""
+        pron_index = None if self.thumbnail_all_var.get() else self.current_pronunciation_index
+        self.thumbnail_strip.set_items(record_thumbnail_items(self.current_data, pron_index))
 
     def capture_screen(self):
+        """
+        实时截图：全屏画面只保存在内存中，选区预览使用快速缩放，
+        只有选中的区域按配置的格式编码写入temp目录。各阶段耗时记录在self.last_capture_timings，
+        开启trace_enabled时同时记入TRACER。
+        """
+        timer = StageTimer()
         try:
             # 确保临时目录存在
             self.temp_dir = os.path.abspath("temp")
             os.makedirs(self.temp_dir, exist_ok=True)
 
-            # 阶段1：截取全屏 -------------------------------------------------
+            # 阶段1：截取全屏（保留在内存中） ---------------------------------
             self.root.withdraw()  # 隐藏主窗口
             time.sleep(0.3)  # 等待窗口完全隐藏
 
-
-            # 生成唯一文件名
-            os.makedirs('temp', exist_ok=True)
             timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-            fullscreen_temp_path = os.path.join(self.temp_dir, f"fullscreen_{timestamp}.png")
-
-            # 截取并保存全屏
-            screenshot = ImageGrab.grab()
-            screenshot.save(fullscreen_temp_path, "PNG")
+            with timer.stage("grab"):
+                img = ImageGrab.grab()
+            img_width, img_height = img.size
 
             # 阶段2：在全屏截图上选区 -------------------------------------------
             selector_window = tk.Toplevel(self.root)
@@ -223,20 +4279,20 @@ class ImageViewerApp:
             selector_window.attributes('-topmost', True)
             selector_window.configure(cursor="crosshair")
 
-            # 加载并显示全屏截图
-            img = Image.open(fullscreen_temp_path)
-            img_width, img_height = img.size
-
             # 计算适合屏幕的缩放比例
             screen_width = selector_window.winfo_screenwidth()
             screen_height = selector_window.winfo_screenheight()
             scale = min(screen_width / img_width, screen_height / img_height)
 
-            # 高质量缩放
+            # 预览只用于框选，使用快速缩放；裁剪仍在原始分辨率上进行
             scaled_width = int(img_width * scale)
             scaled_height = int(img_height * scale)
-            scaled_img = img.resize((scaled_width, scaled_height), Image.LANCZOS)
-            photo = ImageTk.PhotoImage(scaled_img)
+            with timer.stage("preview"):
+                if (scaled_width, scaled_height) == img.size:
+                    scaled_img = img
+                else:
+                    scaled_img = img.resize((scaled_width, scaled_height), Image.BILINEAR, reducing_gap=2.0)
+                photo = ImageTk.PhotoImage(scaled_img)
 
             # 创建画布
             canvas = tk.Canvas(selector_window, highlightthickness=0)
@@ -276,12 +4332,12 @@ class ImageViewerApp:
                     selector_window.destroy()
                     return
                 selector_window.withdraw()
-                # 保存最终截图
+                # 只编码并保存选中的区域
                 try:
-                    cropped = img.crop((raw_left, raw_top, raw_right, raw_bottom))
-                    final_filename = f"cropped_{timestamp}.png"
-                    final_path = os.path.join(self.temp_dir, final_filename)
-                    cropped.save(final_path)
+                    with timer.stage("crop"):
+                        cropped = img.crop((raw_left, raw_top, raw_right, raw_bottom))
+                    with timer.stage("encode"):
+                        final_path = self.save_capture_region(cropped, timestamp)
 
                     # 更新数据
                     pron = self.current_data["pronunciations"][self.current_pronunciation_index]
@@ -295,10 +4351,6 @@ class ImageViewerApp:
                     messagebox.showerror("保存失败", f"无法保存文件：{str(save_error)}")
                 finally:
                     selector_window.destroy()
-                    try:
-                        os.remove(fullscreen_temp_path)  # 清理全屏临时文件
-                    except Exception as clean_error:
-                        print(f"清理临时文件失败：{str(clean_error)}")
 
             # 事件绑定
             canvas.bind("<ButtonPress-1>", on_press)
@@ -314,12 +4366,26 @@ class ImageViewerApp:
             messagebox.showerror("严重错误", f"截图过程失败：{str(main_error)}")
         finally:
             self.root.deiconify()
-            if 'fullscreen_temp_path' in locals():
-                try:
-                    if os.path.exists(fullscreen_temp_path):
-                        os.remove(fullscreen_temp_path)
-                except Exception as e:
-                    print(f"最终清理失败：{str(e)}")
+            self.last_capture_timings = dict(timer.timings)
+
+    def save_capture_region(self, region, timestamp):
+        """按config中的capture_format等配置编码选区并写入temp目录，返回文件路径"""
+        fmt = self.config.get("capture_format", "png").lower()
+        if fmt == "jpg":
+            fmt = "jpeg"
+        options = {}
+        if fmt == "png":
+            options["compress_level"] = self.config.get("capture_compress_level", 1)
+        elif fmt in ("jpeg", "webp"):
+            options["quality"] = self.config.get("capture_quality", 90)
+            if region.mode not in ("RGB", "L"):
+                region = region.convert("RGB")
+        else:
+            raise ValueError(f"不支持的截图格式: {fmt}")
+        ext = ".jpg" if fmt == "jpeg" else f".{fmt}"
+        final_path = os.path.join(self.temp_dir, f"cropped_{timestamp}{ext}")
+        region.save(final_path, fmt.upper(), **options)
+        return final_path
 
     def save_captured_area(self, start_point, end_point):
 
@@ -371,6 +4437,7 @@ class ImageViewerApp:
         canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
 
         # 创建表单内容
+        self.create_outline_section(scrollable_frame)
         self.create_annotation_info_section(scrollable_frame)
         self.create_pronunciation_section(scrollable_frame)
         self.create_pos_section(scrollable_frame)
@@ -398,6 +4465,125 @@ class ImageViewerApp:
         # 添加触摸板滚动支持（可选）
         canvas.bind("<Shift-MouseWheel>", lambda e: canvas.xview_scroll(int(-1 * (e.delta)), "units"))
 
+    def create_outline_section(self, parent):
+        """读音/词性/例句的结构树，展开时才创建子节点，点选任意节点直接跳转"""
+        frame = tk.LabelFrame(parent, text="结构", font=("微软雅黑", 10), padx=10, pady=5)
+        frame.pack(fill=tk.X, pady=5)
+        self.outline = ttk.Treeview(frame, show="tree", height=6, selectmode="browse")
+        outline_scrollbar = tk.Scrollbar(frame, orient=tk.VERTICAL, command=self.outline.yview)
+        self.outline.configure(yscrollcommand=outline_scrollbar.set)
+        outline_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.outline.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.outline.bind("<<TreeviewOpen>>", self.on_outline_open)
+        self.outline.bind("<<TreeviewSelect>>", self.on_outline_select)
+
+    @staticmethod
+    def outline_iid(pron_index, entry_index=None, example_index=None):
+        iid = f"p{pron_index}"
+        if entry_index is not None:
+            iid += f"e{entry_index}"
+            if example_index is not None:
+                iid += f"x{example_index}"
+        return iid
+
+    def refresh_outline(self):
+        """结构变化（换页、增删节点）后重建：只创建读音节点和已展开的节点"""
+        opened = {iid for iid in self._outline_all_iids() if self.outline.item(iid, "open")}
+        self.outline.delete(*self.outline.get_children())
+        for i, pron in enumerate(self.current_data["pronunciations"]):
+            iid = self.outline_iid(i)
+            self.outline.insert("", tk.END, iid=iid, text=outline_node_text("pron", i, pron))
+            self._outline_placeholder(iid, pron.get("entries"))
+        for iid in sorted(opened, key=len):
+            if self.outline.exists(iid):
+                self.outline.item(iid, open=True)
+                self._populate_outline(iid)
+        self.sync_outline_selection()
+
+    def _outline_all_iids(self, parent=""):
+        for iid in self.outline.get_children(parent):
+            yield iid
+            yield from self._outline_all_iids(iid)
+
+    def _outline_placeholder(self, iid, children):
+        if children:
+            self.outline.insert(iid, tk.END, iid=iid + "_", text="")  # 占位，展开时替换为真正的子节点
+
+    def _outline_node(self, iid):
+        """把节点iid解析为(读音, 词性, 例句)索引，未指定的层为None"""
+        match = re.fullmatch(r"p(\d+)(?:e(\d+))?(?:x(\d+))?", iid)
+        if not match:
+            return None
+        return tuple(int(group) if group is not None else None for group in match.groups())
+
+    def _populate_outline(self, iid):
+        if not self.outline.exists(iid + "_"):
+            return  # 已创建子节点
+        self.outline.delete(iid + "_")
+        pron_index, entry_index, _ = self._outline_node(iid)
+        pron = self.current_data["pronunciations"][pron_index]
+        if entry_index is None:
+            for j, entry in enumerate(pron["entries"]):
+                child = self.outline_iid(pron_index, j)
+                self.outline.insert(iid, tk.END, iid=child, text=outline_node_text("entry", j, entry))
+                self._outline_placeholder(child, entry.get("examples"))
+        else:
+            for k, example in enumerate(pron["entries"][entry_index]["examples"]):
+                self.outline.insert(iid, tk.END, iid=self.outline_iid(pron_index, entry_index, k),
+                                    text=outline_node_text("example", k, example))
+
+    def on_outline_open(self, event):
+        iid = self.outline.focus()
+        if iid:
+            self._populate_outline(iid)
+
+    def on_outline_select(self, event):
+        selection = self.outline.selection()
+        node = self._outline_node(selection[0]) if selection else None
+        if node is None:
+            return
+        pron_index, entry_index, example_index = node
+        self.navigate_to(pron_index, entry_index or 0, example_index or 0)
+
+    def sync_outline_selection(self):
+        """让树中选中的节点与当前编辑的例句一致，必要时展开父节点"""
+        p, e, x = self.current_pronunciation_index, self.current_entry_index, self.current_example_index
+        for iid in (self.outline_iid(p), self.outline_iid(p, e)):
+            if self.outline.exists(iid) and not self.outline.item(iid, "open"):
+                self.outline.item(iid, open=True)
+                self._populate_outline(iid)
+        target = self.outline_iid(p, e, x)
+        if self.outline.exists(target) and self.outline.selection() != (target,):
+            self.outline.selection_set(target)
+            self.outline.see(target)
+
+    def update_outline_labels(self):
+        """表单内容保存后只刷新当前读音、词性、例句三个节点的文字"""
+        p, e, x = self.current_pronunciation_index, self.current_entry_index, self.current_example_index
+        pron = self.current_data["pronunciations"][p]
+        entry = pron["entries"][e]
+        for iid, kind, index, node in ((self.outline_iid(p), "pron", p, pron),
+                                       (self.outline_iid(p, e), "entry", e, entry),
+                                       (self.outline_iid(p, e, x), "example", x, entry["examples"][x])):
+            if self.outline.exists(iid):
+                text = outline_node_text(kind, index, node)
+                if self.outline.item(iid, "text") != text:
+                    self.outline.item(iid, text=text)
+
+    def navigate_to(self, pron_index, entry_index=0, example_index=0):
+        """保存表单后直接跳到指定的读音/词性/例句，只更新内容有变化的输入框"""
+        if (pron_index, entry_index, example_index) == (
+                self.current_pronunciation_index, self.current_entry_index, self.current_example_index):
+            return
+        self.save_current_form()
+        pron_changed = pron_index != self.current_pronunciation_index
+        self.current_pronunciation_index = pron_index
+        self.current_entry_index = entry_index
+        self.current_example_index = example_index
+        self.update_form()
+        if pron_changed:
+            self.update_thumbnail_panel()
+
     def create_annotation_info_section(self, parent):
         frame = tk.LabelFrame(parent, text="标注信息", font=("微软雅黑", 10), padx=10, pady=10)
         frame.pack(fill=tk.X, pady=5)
@@ -495,41 +4681,49 @@ class ImageViewerApp:
             if not self.image_files:
                 return
 
+            # 离开当前页面前把修改写入草稿日志
+            self.stash_current_draft()
+
             image_path = self.image_files[self.current_image_index]
             current_image_filename = os.path.basename(image_path)#basename() 方法返回文件名
-            json_path = os.path.join("output", os.path.splitext(current_image_filename)[0] + ".json")
-
-            new_data_template = {
-                "image": current_image_filename,
-                "annotator": self.current_data.get("annotator", ""),
-                "page_info": self.current_data.get("page_info", {"page_num": "", "word_num": ""}),
-                "simplified_Chinese_character": "",
-                "pronunciations": [{
-                    "zhuang_spelling": "",
-                    "ipa": "",
-                    "imported_source_path": "",
-                    "imported_image": [],
-                    "old_image_path": "",
-                    "entries": [{
-                        "part_of_speech": "",
-                        "meaning": "",
-                        "examples": [{"壮文": "", "中文": ""}]
-                    }]
-                }]
-            }
-
-            if os.path.exists(json_path):
-                with open(json_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)#load（）方法将json数据转换为python对象
-                    if isinstance(data, list) and len(data) > 0:#isinstance()用法    a:isinstance() 函数来判断一个对象是否是一个已知的类型，类似 type()。
-                        self.current_data = data[0]
-                        if not self.current_data["pronunciations"]:
-                            self.current_data["pronunciations"] = new_data_template["pronunciations"].copy()
-                        self.current_data["annotator"] = data[0] ["annotator"]
-                        self.current_data["page_info"] = data[0] ["page_info"]
 
+            # 新页面沿用上一页的标注作者和页码信息
+            new_data_template = Annotation.new(
+                image=current_image_filename,
+                annotator=self.current_data.get("annotator", ""),
+                page_info=PageInfo.from_dict(self.current_data.get("page_info") or {}, fill_defaults=True)
+            ).to_dict()
+
+            stem = os.path.splitext(current_image_filename)[0]
+            if self.leases:
+                self.acquire_page_lease(stem)
+            # 提交时据此检查记录是否已被其他人修改
+            self.loaded_version = self.store.version(stem)
+            record = self.store.load(stem)
+            if record is not None:
+                if self.status_index.get_status(self.current_image_index) != AnnotationStatusIndex.SUBMITTED:
+                    self.status_index.set_status(self.current_image_index, AnnotationStatusIndex.SUBMITTED)
+                self.current_data = record
+                if not self.current_data["pronunciations"]:
+                    self.current_data["pronunciations"] = [Pronunciation.new().to_dict()]
             else:
                 self.current_data = new_data_template
+                crop = self.segment_crops.get(current_image_filename)
+                if crop:
+                    # 自动切图（python main.py segment）记录了页数和在页中的序号
+                    self.current_data["page_info"] = PageInfo.new(
+                        page_num=str(crop["page"]), word_num=str(crop["index"])).to_dict()
+            self.draft_journal.begin(stem, self.current_data, self.loaded_version)
+            draft = self.draft_journal.get(stem)
+            if draft is not None:
+                self.current_data = draft
+                # 按草稿开始时的版本提交，草稿之后记录被他人修改过时提交会报冲突
+                base_version = self.draft_journal.base_version(stem, self.loaded_version)
+                if base_version != self.loaded_version:
+                    self.submit_status_label.config(text="已恢复草稿，但该图片在草稿之后已被修改，请核对", fg="red")
+                else:
+                    self.submit_status_label.config(text="已恢复未提交的草稿", fg="orange")
+                self.loaded_version = base_version
 
             # 更新表单字段
             self.annotator_entry.delete(0, tk.END)
@@ -545,50 +4739,75 @@ class ImageViewerApp:
             self.current_pronunciation_index = 0
             self.current_entry_index = 0
             self.current_example_index = 0
-            # 加载主图片
-            img = Image.open(image_path)#image.open()方法用于打开一个图片
-            img.thumbnail((1000, 1000))#thumbnail()方法用于将图像调整为给定的尺寸。
-            photo = ImageTk.PhotoImage(img)#ImageTk.PhotoImage()方法用于将图片转换为Tkinter的PhotoImage。
+            # 加载主图片（缓存中已是缩放后的图片，放大超过该尺寸时才读取瓦片）
+            display_path = self.display_path(image_path)
+            img = self.image_cache.get(display_path)
+            self.image_cache.prefetch([self.display_path(path) for path in self.neighbour_image_paths()])
 
-            self.img_canvas.image = photo
             self.img_canvas.delete("all")
-            self.img_canvas.create_image(50, 50, image=photo)
-            self.title_label.config(
-                text=f"{self.current_data['image']} (第{self.current_image_index + 1}页/共{len(self.image_files)}页)")
+            self.image_view.set_image(display_path, img)
+            self.update_title()
 
             # 更新缩略图
             self.update_thumbnail_panel()
 
 
             self.update_form()
+            self.refresh_outline()
         except Exception as e:
+            self.image_view.clear()
             self.img_canvas.delete("all")
             self.img_canvas.create_text(250, 250, text="图片加载失败", fill="red")
             print(f"错误: {str(e)}")
+            TRACER.instant("error", where="load_current_image", message=str(e))
+
+    def update_title(self):
+        status_text = {
+            AnnotationStatusIndex.UNANNOTATED: "未标注",
+            AnnotationStatusIndex.DRAFT: "草稿",
+            AnnotationStatusIndex.SUBMITTED: "已提交"
+        }[self.status_index.get_status(self.current_image_index)]
+        range_text = ""
+        if self.allocation:
+            range_text = f" 范围: 第{self.allocation[0] + 1}-{self.allocation[1] + 1}页"
+        self.title_label.config(
+            text=f"{self.current_data['image']} (第{self.current_image_index + 1}页/共{len(self.image_files)}页) {status_text}{range_text}")
+
+    def display_path(self, path):
+        """开启enhance_display且已生成增强图（python main.py enhance）时显示增强图，否则显示原图"""
+        if self.enhance_stages:
+            enhanced = enhanced_image_path(path, self.enhance_stages)
+            if enhanced and os.path.exists(enhanced):
+                return enhanced
+        return path
+
+    def neighbour_image_paths(self):
+        """按距离由近到远返回前后相邻的图片路径，下一页优先"""
+        paths = []
+        for offset in range(1, self.prefetch_radius + 1):
+            for index in (self.current_image_index + offset, self.current_image_index - offset):
+                if 0 <= index < len(self.image_files):
+                    paths.append(self.image_files[index])
+        return paths
 
     def update_form(self):
         pron = self.current_data["pronunciations"][self.current_pronunciation_index]#pron是什么意思 a:pron是pronunciation的缩写，意思是发音
 
-        self.chinese_char_entry.delete(0, tk.END)
-        self.chinese_char_entry.insert(0, self.current_data.get("simplified_Chinese_character", ""))
+        # 只改写内容有变化的输入框
+        set_entry_text(self.chinese_char_entry, self.current_data.get("simplified_Chinese_character", ""))
 
-        self.zh_wen_entry.delete(0, tk.END)
-        self.zh_wen_entry.insert(0, pron.get("zhuang_spelling", ""))
-        self.ipa_entry.delete(0, tk.END)
-        self.ipa_entry.insert(0, pron.get("ipa", ""))
+        set_entry_text(self.zh_wen_entry, pron.get("zhuang_spelling", ""))
+        set_entry_text(self.ipa_entry, pron.get("ipa", ""))
         dialect_type = pron.get("dialect_type", 0)
-        self.dialect_var.set(dialect_type)
+        if self.dialect_var.get() != dialect_type:
+            self.dialect_var.set(dialect_type)
         entry = pron["entries"][self.current_entry_index]
-        self.pos_entries["part_of_speech"].delete(0, tk.END)
-        self.pos_entries["part_of_speech"].insert(0, entry.get("part_of_speech", ""))
-        self.pos_entries["meaning"].delete(0, tk.END)
-        self.pos_entries["meaning"].insert(0, entry.get("meaning", ""))
+        set_entry_text(self.pos_entries["part_of_speech"], entry.get("part_of_speech", ""))
+        set_entry_text(self.pos_entries["meaning"], entry.get("meaning", ""))
 
         example = entry["examples"][self.current_example_index]
-        self.pos_entries["example_zhuang"].delete(0, tk.END)
-        self.pos_entries["example_zhuang"].insert(0, example.get("壮文", ""))
-        self.pos_entries["example_chinese"].delete(0, tk.END)
-        self.pos_entries["example_chinese"].insert(0, example.get("中文", ""))
+        set_entry_text(self.pos_entries["example_zhuang"], example.get("壮文", ""))
+        set_entry_text(self.pos_entries["example_chinese"], example.get("中文", ""))
 
         self.pronunciation_page.config(
             text=f"{self.current_pronunciation_index + 1}/{len(self.current_data['pronunciations'])}")
@@ -596,6 +4815,7 @@ class ImageViewerApp:
             text=f"{self.current_entry_index + 1}/{len(pron['entries'])}")
         self.example_page.config(
             text=f"{self.current_example_index + 1}/{len(entry['examples'])}")
+        self.sync_outline_selection()
 
     def save_current_form(self):#保存当前表单
         self.current_data["annotator"] = self.annotator_entry.get()
@@ -615,6 +4835,38 @@ class ImageViewerApp:
         example = entry["examples"][self.current_example_index]
         example["壮文"] = self.pos_entries["example_zhuang"].get()
         example["中文"] = self.pos_entries["example_chinese"].get()
+        self.update_outline_labels()
+        self.schedule_draft_flush()
+
+    def schedule_draft_flush(self, delay=1000):
+        """合并短时间内的多次修改，延迟写入草稿日志"""
+        if self._draft_flush_id is not None:
+            self.root.after_cancel(self._draft_flush_id)
+        self._draft_flush_id = self.root.after(delay, self.flush_draft)
+
+    def flush_draft(self):
+        self._draft_flush_id = None
+        stem = os.path.splitext(self.current_data.get("image", ""))[0]
+        if not stem:
+            return
+        try:
+            changed = self.draft_journal.record(stem, self.current_data)
+        except Exception as e:
+            print(f"草稿保存失败: {str(e)}")
+            return
+        index = self.status_index.positions.get(stem)
+        if changed and index is not None and \
+                self.status_index.get_status(index) == AnnotationStatusIndex.UNANNOTATED:
+            self.status_index.set_status(index, AnnotationStatusIndex.DRAFT)
+
+    def stash_current_draft(self):
+        """读取表单并立即写入草稿日志（切换页面、关闭窗口时调用）"""
+        if not self.current_data.get("image") or not self.current_data.get("pronunciations"):
+            return
+        self.save_current_form()
+        if self._draft_flush_id is not None:
+            self.root.after_cancel(self._draft_flush_id)
+        self.flush_draft()
 
     def show_previous_image(self):
         if self.current_image_index > 0:
@@ -626,6 +4878,79 @@ class ImageViewerApp:
             self.current_image_index += 1
             self.load_current_image()
 
+    def show_previous_unannotated(self):
+        index = self.status_index.previous_unannotated(self.current_image_index)
+        if index is None:
+            messagebox.showinfo("提示", "前面没有未标注的图片")
+            return
+        self.current_image_index = index
+        self.load_current_image()
+
+    def show_next_unannotated(self):
+        index = self.status_index.next_unannotated(self.current_image_index)
+        if self.allocation and (index is None or index > self.allocation[1]):
+            # 多人标注时只在自己的范围内查找
+            index = self.status_index.next_unannotated(self.allocation[0] - 1)
+            if index is None or index > self.allocation[1]:
+                if messagebox.askyesno("提示", "当前范围已全部提交，是否领取新的范围？"):
+                    self.request_new_allocation()
+                return
+        if index is None:
+            messagebox.showinfo("提示", "后面没有未标注的图片")
+            return
+        self.current_image_index = index
+        self.load_current_image()
+
+    def claim_allocation(self, create=True, move=True):
+        """确认或领取自己的图片范围，当前图片不在范围内时跳到范围内第一张未标注的图片"""
+        submitted = set(self.store.stems())
+        for stem in submitted:
+            self.status_index.set_status_by_stem(stem, AnnotationStatusIndex.SUBMITTED)
+        try:
+            self.allocation = self.allocator.allocate(self.annotator_id, self.status_index.stems, submitted, create)
+        except TimeoutError as e:
+            print(f"领取范围失败: {str(e)}")
+            return
+        if self.allocation is None:
+            return
+        start, end = self.allocation
+        if not start <= self.current_image_index <= end:
+            index = self.status_index.next_unannotated(start - 1)
+            self.current_image_index = index if index is not None and index <= end else start
+            if move:
+                self.load_current_image()
+
+    def request_new_allocation(self):
+        self.stash_current_draft()
+        self.claim_allocation(create=True)
+        if self.allocation is None:
+            messagebox.showinfo("提示", "所有图片都已分配或提交")
+            return
+        self.update_title()
+
+    def acquire_page_lease(self, stem):
+        """切换到新图片时释放旧图片的租约并获取新图片的租约"""
+        for name in list(self.leases.held):
+            if name != stem:
+                self.leases.release(name)
+        self.lease_holder = self.leases.acquire(stem)
+        if self.lease_holder:
+            expires = datetime.fromtimestamp(self.lease_holder.get("expires", 0)).strftime("%H:%M")
+            self.submit_status_label.config(
+                text=f"该图片正在由 {self.lease_holder.get('owner', '?')} 标注（租约到{expires}），只能查看", fg="red")
+        else:
+            self.submit_status_label.config(text="", fg="gray")
+
+    def renew_leases(self):
+        """定时续约当前图片的租约"""
+        for name in list(self.leases.held):
+            try:
+                if not self.leases.renew(name):
+                    self.update_submit_status(f"{name} 的租约已被他人接管", "red")
+            except OSError as e:
+                print(f"租约续约失败: {str(e)}")
+        self.root.after(self.leases.ttl * 1000 // 3, self.renew_leases)
+
     def jump_to_page(self):
         page = self.page_entry.get()
         try:
@@ -640,106 +4965,224 @@ class ImageViewerApp:
 
     def submit_data(self):
         """
-        提交数据函数，负责保存当前表单数据，清理旧图片，并将新图片移动到指定目录，
-        更新数据记录，并将当前数据保存为JSON格式文件。
+        提交数据函数，负责保存当前表单数据，为新图片分配output_image中的文件名并更新数据记录，
+        然后把图片移动、旧图片清理和JSON写入作为一个整体交给后台提交线程。
+        提交先写入日志（journal/submit），程序中途崩溃时下次启动会重新执行。
         """
         # 保存当前表单数据
         self.save_current_form()
-        # 清理旧图片
-        #self.cleanup_old_images()
-        #self.current_data["imported_image"] = []  # 清空历史记录
-        # 获取已导入的图片列表
-        imported_images = []
-        # 获取导入的源文件路径
-
-        for pron in self.current_data["pronunciations"]:
-            temp_source = pron.get("imported_source_path", "")
-            old_source_path = pron.get("old_image_path", "")
-            # 生成时间戳（每个文件独立）
-            timestamp = datetime.now().strftime("%Y%m%d%H%M%S%f")#怎么生成毫秒级时间戳 a:datetime.now()返回当前日期和时间。strftime()方法用于将日期时间对象转换为字符串。
-            if  temp_source == old_source_path:
-                continue  # 没有需要处理的文件
+        stem = os.path.splitext(self.current_data['image'])[0]
+        if self.leases:
+            # 租约可能已过期或已被对方释放，提交前再尝试一次
+            self.lease_holder = self.leases.acquire(stem)
+            if self.lease_holder:
+                messagebox.showerror("错误", f"该图片正在由 {self.lease_holder.get('owner', '?')} 标注，不能提交")
+                return
+        try:
+            moves, removes = plan_submission(self.current_data)
+        except FileNotFoundError as e:
+            messagebox.showerror("错误", f"文件处理失败: {str(e)}")
+            return
 
-            try:
-                # 保存旧文件信息
-                #old_imported_images = pron.get("imported_image", [])
+        # 交给后台线程写入标注存储（默认每张图片一个JSON文件）；草稿和索引在写入成功后才更新，
+        # 写入失败（例如版本冲突）时修改仍保留在草稿日志中
+        self.draft_journal.record(stem, self.current_data)
+        try:
+            self.submit_writer.submit(stem, self.current_data, moves, removes, self.loaded_version)
+        except Exception as e:
+            messagebox.showerror("错误", f"提交失败: {str(e)}")
+            return
+        self._submitted_records.setdefault(stem, deque()).append(copy.deepcopy(self.current_data))
+        self.update_submit_status()
+        """# 显示下一张图片
+        self.show_next_image()"""
 
+    def _collect_orphans(self):
+        collector = OrphanCollector(self.store, image_index=self.image_index,
+                                    min_age=self.config.get("gc_min_age_hours", 1) * 3600)
 
-                # 创建输入目录
-                input_dir = "output_image"
-                os.makedirs(input_dir, exist_ok=True)
+        def live_references():
+            # 界面中正在编辑、还未写入草稿日志的截图
+            try:
+                return record_file_references(copy.deepcopy(self.current_data))
+            except Exception:
+                return []
 
+        try:
+            stats = collector.collect(dry_run=self.config.get("gc_mode", "report") != "delete",
+                                      extra_references=live_references)
+        except Exception as e:
+            print(f"孤儿文件回收失败: {str(e)}")
+            return
+        if stats["orphans"]:
+            action = f"已删除{stats['removed']}个" if stats["removed"] else "可用python main.py gc --apply删除"
+            print(f"temp和output_image中有{len(stats['orphans'])}个未被引用的文件"
+                  f"（{stats['bytes'] / 1024 / 1024:.1f}MB），{action}")
 
+    def _load_search_index(self):
+        try:
+            self.search_index.load()
+            self.search_index.refresh(self.store)
+        except Exception as e:
+            print(f"搜索索引加载失败: {str(e)}")
 
-                # 获取读音名称并清理非法字符
-                pron_name = pron.get("zhuang_spelling", "unnamed")
-                pron_name_clean = re.sub(r'[\\/*?:"<>|]', "", pron_name)
+    def _load_annotation_stats(self):
+        try:
+            self.annotation_stats.load()
+            self.annotation_stats.refresh(self.store)
+        except Exception as e:
+            print(f"统计数据加载失败: {str(e)}")
 
-                # 处理文件扩展名
-                _, ext = os.path.splitext(temp_source)
-                ext = ext if ext else ".jpg"
+    def show_stats_panel(self):
+        """列出各标注者今天、本小时和累计的提交量，以及当前页的完成情况"""
+        if not self.annotation_stats.ready:
+            messagebox.showinfo("提示", "统计数据正在加载，请稍后再试")
+            return
+        now = datetime.now()
+        today = now.strftime(AnnotationStats.BUCKET_FORMATS["day"])
+        this_hour = now.strftime(AnnotationStats.BUCKET_FORMATS["hour"])
+        daily = self.annotation_stats.throughput("day")
+        hourly = self.annotation_stats.throughput("hour")
+        lines = [f"{'标注者':<16}{'本小时':>8}{'今天':>8}{'累计':>8}{'读音':>8}{'词性':>8}{'例句':>8}"]
+        for name, totals in self.annotation_stats.totals().items():
+            lines.append(f"{name:<16}{hourly.get(name, {}).get(this_hour, 0):>8}{daily.get(name, {}).get(today, 0):>8}"
+                         f"{totals['records']:>8}{totals['pronunciations']:>8}{totals['entries']:>8}"
+                         f"{totals['examples']:>8}")
+        coverage = self.annotation_stats.page_coverage(self.image_files)
+        done_pages = sum(1 for _, done, total in coverage if total and done >= total)
+        lines.append("")
+        lines.append(f"已完成{done_pages}/{len(coverage)}页")
+        if self.image_files:
+            key = parse_image_key(self.image_files[self.current_image_index])
+            for page, done, total in coverage:
+                if key and page == key[0]:
+                    lines.append(f"当前第{page}页: 已提交{done}/{total}张")
+
+        win = tk.Toplevel(self.root)
+        win.title("标注统计")
+        text = tk.Text(win, width=72, height=min(30, len(lines) + 1), font=("Consolas", 10))
+        text.insert(tk.END, "\n".join(lines))
+        text.config(state=tk.DISABLED)
+        text.pack(fill=tk.BOTH, expand=True)
+
+    def search_annotations(self):
+        query = self.search_entry.get()
+        if not query.strip():
+            return
+        if not self.search_index.ready:
+            messagebox.showinfo("提示", "搜索索引正在加载，请稍后再试")
+            return
+        mode = {"精确": "exact", "前缀": "prefix", "包含": "ngram"}[self.search_mode_var.get()]
+        stems = self.search_index.search(query, mode)
+        indexes = sorted(self.status_index.positions[stem] for stem in stems if stem in self.status_index.positions)
+        if not indexes:
+            messagebox.showinfo("搜索结果", f"没有找到“{query}”")
+            return
+        if len(indexes) == 1:
+            self.current_image_index = indexes[0]
+            self.load_current_image()
+            return
 
-                # 生成新文件名和路径
-                new_filename = f"{pron_name_clean}_{timestamp}{ext}"
-                dest_path = os.path.join(input_dir, new_filename)
+        # 多个结果时列出，双击跳转
+        win = tk.Toplevel(self.root)
+        win.title(f"搜索结果：{query}（{len(indexes)}条）")
+        listbox = tk.Listbox(win, width=40, height=min(20, len(indexes)))
+        scrollbar = tk.Scrollbar(win, orient=tk.VERTICAL, command=listbox.yview)
+        listbox.configure(yscrollcommand=scrollbar.set)
+        for index in indexes:
+            listbox.insert(tk.END, f"第{index + 1}页  {self.status_index.stems[index]}")
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        def jump(event):
+            selection = listbox.curselection()
+            if selection:
+                self.current_image_index = indexes[selection[0]]
+                self.load_current_image()
 
-                #移动临时文件
-                shutil.move(temp_source, dest_path)
-                """# 移动或复制文件
-                if temp_source.startswith(tempfile.gettempdir()):
-                    shutil.move(temp_source, dest_path)
-                else:
-                    shutil.copyfile(temp_source, dest_path)"""
-
-                # 更新数据
-                pron["imported_source_path"] = dest_path
-                pron["old_image_path"] = dest_path
-                pron["imported_image"] = [new_filename]
-
-                if os.path.exists(old_source_path):
-                    os.remove(old_source_path)
-                    print(f"已删除历史文件: {old_source_path}")
-                """# 删除旧文件（仅在output_image目录中的文件）
-                # 1. 删除历史记录文件
-                for old_file in old_imported_images:
-                    old_path = os.path.join(input_dir, old_file)
-                    if os.path.exists(old_path) and old_path != dest_path:
-                        os.remove(old_path)
-                        print(f"已删除历史文件: {old_path}")"""
-
-                # 2. 删除旧的source文件（如果与新文件不同且在input目录）
-                if (old_source_path.startswith(input_dir)
-                        and old_source_path != dest_path
-                        and os.path.exists(old_source_path)):
-                    os.remove(old_source_path)
-                    print(f"已删除旧源文件: {old_source_path}")
+        listbox.bind("<Double-Button-1>", jump)
+        listbox.bind("<Return>", jump)
+
+    def update_submit_status(self, text=None, color="gray"):
+        pending = self.submit_writer.pending
+        if text is None:
+            text = f"正在保存({pending})..." if pending else ""
+        elif pending:
+            text = f"{text}  正在保存({pending})..."
+        self.submit_status_label.config(text=text, fg=color)
+
+    def poll_submit_results(self):
+        """定时检查后台提交结果，刷新状态栏（Tk控件只能在主线程操作）"""
+        for stem, error, renames in self.submit_writer.poll_results():
+            submitted = self._submitted_records.get(stem)
+            record = submitted.popleft() if submitted else None
+            if submitted is not None and not submitted:
+                del self._submitted_records[stem]
+            if error:
+                # 草稿仍保留在草稿日志中，索引没有更新
+                self.update_submit_status(f"保存失败: {stem}", "red")
+                messagebox.showerror("错误", f"{stem} 保存失败: {error}\n提交记录已移到{self.submit_writer.failed_dir}")
+            else:
+                self.on_submit_saved(stem, record, renames)
+                self.update_submit_status(f"已保存: {self.store.describe(stem)}", "green")
+                if self.image_files and stem == os.path.splitext(self.current_data.get("image", ""))[0]:
+                    # 重复的截图已改用已有文件，内存中的数据同步修改
+                    if renames:
+                        replace_image_references(self.current_data, renames)
+                    self.update_thumbnail_panel()
+        self.root.after(200, self.poll_submit_results)
 
-            except Exception as e:
-                messagebox.showerror("错误",
-                                     f"文件处理失败: {str(e)}\n"
-                                     f"读音：{pron.get('zhuang_spelling', '未知')}\n"
-                                     f"原路径：{temp_source}"
-                                     )
+    def on_submit_saved(self, stem, record, renames):
+        """后台写入成功后丢弃草稿、更新搜索/统计索引和页面状态；record为None表示启动时重放的提交"""
+        if record is None:
+            record = self.store.load(stem)
+            if record is None:
                 return
-
-        # 确保输出目录存在
-        os.makedirs("output", exist_ok=True)#os.makedirs() 方法用于递归创建目录。像 mkdir() 一样，但创建的所有中间级目录都将创建。
-        # 构造JSON文件名
-        filename = f"{os.path.splitext(self.current_data['image'])[0]}.json"
-        full_path = os.path.join("output", filename)
-
-        # 将当前数据保存为JSON格式文件
-        with open(full_path, 'w', encoding='utf-8') as f:
-            json.dump([self.current_data], f, ensure_ascii=False, indent=2)
-
-        # 显示成功消息
-        messagebox.showinfo("成功", f"数据已保存到\n{full_path}")
-        """# 显示下一张图片
-        self.show_next_image()"""
+        else:
+            # 提交后又修改并写入了草稿时保留草稿
+            draft = self.draft_journal.get(stem)
+            stale_draft = draft is not None and draft != record
+            if renames:
+                replace_image_references(record, renames)
+            if not stale_draft:
+                self.draft_journal.clear(stem, record)
+        self.search_index.update(stem, record)
+        self.annotation_stats.update(stem, record)
+        self.status_index.set_status_by_stem(stem, AnnotationStatusIndex.SUBMITTED)
+        if self.image_files and stem == os.path.splitext(self.current_data.get("image", ""))[0]:
+            self.update_title()
 
     def on_close(self):
-        with open("config.json", "w") as f:
-            json.dump({"last_index": self.current_image_index}, f)
+        try:
+            self.stash_current_draft()
+        except Exception as e:
+            print(f"草稿保存失败: {str(e)}")
+        save_config({"last_index": self.current_image_index}, self.session_path)
+        if self.search_index.dirty:
+            try:
+                self.search_index.save()
+            except Exception as e:
+                print(f"搜索索引保存失败: {str(e)}")
+        if self.annotation_stats.dirty:
+            try:
+                self.annotation_stats.save()
+            except Exception as e:
+                print(f"统计数据保存失败: {str(e)}")
+        print(f"图片缓存统计: {self.image_cache.stats()}")
+        if TRACER.enabled:
+            try:
+                print(f"追踪记录已导出到: {TRACER.export()}")
+            except Exception as e:
+                print(f"追踪记录导出失败: {str(e)}")
+        self.image_cache.close()
+        self.tile_cache.close()
+        self.thumbnail_strip.close()
+        if not self.submit_writer.close(timeout=10):
+            print("仍有提交未完成，下次启动时会继续执行")
+        self.store.close()
+        self.image_index.close()
+        if self.leases:
+            self.leases.release_all()
         self.root.destroy()
 
     def delete_pronunciation(self):
@@ -760,29 +5203,19 @@ class ImageViewerApp:
 
             input_dir="output_image"
             old_path=pron.get("imported_source_path","")
-            if os.path.exists(old_path):
-                os.remove(old_path)
+            # 截图可能被其他记录共用，由内容索引按引用数决定是否删除
+            if old_path and self.image_index.release(old_path):
                 print(f"已删除历史文件: {old_path}")
             del self.current_data["pronunciations"][original_index]    #del是什么意思 a:del是delete的缩写，意思是删除
 
             if not self.current_data["pronunciations"]:
-                self.current_data["pronunciations"].append({
-            "zhuang_spelling": "",
-            "ipa": "",
-            "imported_source_path": "",  # 新增
-            "imported_image": [],  # 新增
-            "dialect_type": 0,
-            "entries": [{
-                "part_of_speech": "",
-                "meaning": "",
-                "examples": [{"壮文": "", "中文": ""}]
-            }]
-        })
+                self.current_data["pronunciations"].append(Pronunciation.new().to_dict())
 
             self.current_pronunciation_index = min(original_index, len(self.current_data["pronunciations"]) - 1)
             self.current_entry_index = 0 #为什么要置0 a:因为删除了当前读音，所以要重新从0开始q:从1开始会怎么样 a:会报错，因为删除了当前读音，所以当前读音的索引就是0
             self.current_example_index = 0
             self.update_form()
+            self.refresh_outline()
             self.update_thumbnail_panel()
 
     def delete_entry(self):
@@ -792,7 +5225,9 @@ class ImageViewerApp:
                 self.save_current_form()
                 del pron["entries"][self.current_entry_index]
                 self.current_entry_index = max(0, self.current_entry_index - 1)
+                self.current_example_index = 0
                 self.update_form()
+                self.refresh_outline()
 
     def delete_example(self):
         entry = self.current_data["pronunciations"][self.current_pronunciation_index]["entries"][
@@ -803,59 +5238,36 @@ class ImageViewerApp:
                 del entry["examples"][self.current_example_index]
                 self.current_example_index = max(0, self.current_example_index - 1)
                 self.update_form()
+                self.refresh_outline()
 
     def add_new_pronunciation(self):
         self.save_current_form()
-        new_pron = {
-            "zhuang_spelling": "",
-            "ipa": "",
-            "imported_source_path": "",  # 新增
-            "old_image_path": "",  # 新增
-            "imported_image": [],  # 新增
-            "dialect_type": 0,
-            "entries": [{
-                "part_of_speech": "",
-                "meaning": "",
-                "examples": [{"壮文": "", "中文": ""}]
-            }]
-        }
+        new_pron = Pronunciation.new().to_dict()
 
         self.current_data["pronunciations"].append(new_pron)
         self.current_pronunciation_index = len(self.current_data["pronunciations"]) - 1
         self.current_entry_index = 0
         self.current_example_index = 0
         self.update_form()
+        self.refresh_outline()
         self.update_thumbnail_panel()
 
     def previous_pronunciation(self):
         if self.current_pronunciation_index > 0:
-            self.save_current_form()
-            self.current_pronunciation_index -= 1
-            self.current_entry_index = 0
-            self.current_example_index = 0
-            self.update_form()
-            self.update_thumbnail_panel()
+            self.navigate_to(self.current_pronunciation_index - 1)
 
     def next_pronunciation(self):
         if self.current_pronunciation_index < len(self.current_data["pronunciations"]) - 1:
-            self.save_current_form()
-            self.current_pronunciation_index += 1
-            self.current_entry_index = 0
-            self.current_example_index = 0
-            self.update_form()
-            self.update_thumbnail_panel()
+            self.navigate_to(self.current_pronunciation_index + 1)
 
     def add_new_entry(self):
         self.save_current_form()
         pron = self.current_data["pronunciations"][self.current_pronunciation_index]
-        pron["entries"].append({
-            "part_of_speech": "",
-            "meaning": "",
-            "examples": [{"壮文": "", "中文": ""}]
-        })
+        pron["entries"].append(Entry.new().to_dict())
         self.current_entry_index = len(pron["entries"]) - 1
         self.current_example_index = 0
         self.update_form()
+        self.refresh_outline()
 
     def previous_entry(self):
         if self.current_entry_index > 0:
@@ -876,9 +5288,10 @@ class ImageViewerApp:
         self.save_current_form()
         entry = self.current_data["pronunciations"][self.current_pronunciation_index]["entries"][
             self.current_entry_index]
-        entry["examples"].append({"壮文": "", "中文": ""})
+        entry["examples"].append(Example.new().to_dict())
         self.current_example_index = len(entry["examples"]) - 1
         self.update_form()
+        self.refresh_outline()
 
     def previous_example(self):
         if self.current_example_index > 0:
@@ -900,6 +5313,7 @@ class ImageViewerApp:
             filetypes=[
                 ("PNG文件", "*.png"),
                 ("JPEG文件", "*.jpg *.jpeg"),
+                ("WebP文件", "*.webp"),
                 ("所有文件", "*.*")
             ]
         )
@@ -930,26 +5344,932 @@ class ImageViewerApp:
         """显示放大后的图片"""
         try:
             win = tk.Toplevel(self.root)
-            win.title("放大预览")
+            win.title("放大预览（滚轮缩放，拖动平移，右键还原）")
 
-            img = Image.open(image_path)
-            # 根据屏幕尺寸调整图片大小
+            # 根据屏幕尺寸调整图片大小，已有瓦片时不再解码原图
             screen_width = self.root.winfo_screenwidth()
             screen_height = self.root.winfo_screenheight()
-            img.thumbnail((screen_width - 100, screen_height - 100))
+            size = (screen_width - 100, screen_height - 100)
+            img = self.tile_cache.preview(image_path, size) or load_display_image(image_path, size)
 
-            photo = ImageTk.PhotoImage(img)
-            label = tk.Label(win, image=photo)
-            label.image = photo  # 保持引用
-            label.pack(padx=10, pady=10)
+            canvas = tk.Canvas(win, width=img.width, height=img.height, highlightthickness=0)
+            canvas.pack(padx=10, pady=10)
+            view = TiledImageView(canvas, self.tile_cache)
+            view.set_image(image_path, img)
+            canvas.view = view  # 保持引用
 
             # 双击关闭窗口
-            label.bind("<Double-Button-1>", lambda e: win.destroy())
+            canvas.bind("<Double-Button-1>", lambda e: win.destroy())
         except Exception as e:
             messagebox.showerror("错误", f"无法加载图片：{str(e)}")
 
 
-if __name__ == "__main__":
+def summarize_timings(samples_ms):
+    """把一组耗时（毫秒）汇总为次数、合计、均值和分位数"""
+    if not samples_ms:
+        return {"n": 0}
+    ordered = sorted(samples_ms)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+    return {
+        "n": len(ordered),
+        "total_ms": round(sum(ordered), 3),
+        "mean_ms": round(statistics.mean(ordered), 3),
+        "p50_ms": round(percentile(50), 3),
+        "p95_ms": round(percentile(95), 3),
+        "p99_ms": round(percentile(99), 3),
+        "max_ms": round(ordered[-1], 3),
+    }
+
+
+def _time_each(func, items):
+    samples = []
+    for item in items:
+        start = time.perf_counter()
+        func(item)
+        samples.append((time.perf_counter() - start) * 1000)
+    return summarize_timings(samples)
+
+
+def _time_once(func):
+    start = time.perf_counter()
+    func()
+    return summarize_timings([(time.perf_counter() - start) * 1000])
+
+
+def generate_benchmark_corpus(root, pages=10, crops=10, resolution=(1600, 2400), capture_size=(600, 200)):
+    """在root下生成合成数据：image/中的zhuang_<页>_crop_<序号>.jpg、output/中的记录和temp/中的截图"""
+    image_dir = os.path.join(root, "image")
+    output_dir = os.path.join(root, "output")
+    temp_dir = os.path.join(root, "temp")
+    for directory in (image_dir, output_dir, temp_dir):
+        os.makedirs(directory, exist_ok=True)
+    # 噪声图接近扫描件的解码开销；同一张底图反复编码保存即可
+    page_img = Image.effect_noise(resolution, 64).convert("RGB")
+    capture_img = Image.effect_noise(capture_size, 64).convert("RGB")
+    stems = []
+    for page in range(1, pages + 1):
+        for crop in range(1, crops + 1):
+            stem = f"zhuang_{page}_crop_{crop}"
+            page_img.save(os.path.join(image_dir, f"{stem}.jpg"), "JPEG", quality=85)
+            capture_path = os.path.join(temp_dir, f"cropped_{stem}.png")
+            capture_img.save(capture_path, "PNG", compress_level=1)
+            record = {
+                "image": f"{stem}.jpg",
+                "annotator": "bench",
+                "page_info": {"page_num": str(page), "word_num": str(crop)},
+                "simplified_Chinese_character": "字",
+                "pronunciations": [{
+                    "zhuang_spelling": f"sawq{crop}",
+                    "ipa": "θaɯ˧˥",
+                    "imported_source_path": capture_path,
+                    "imported_image": [],
+                    "old_image_path": "",
+                    "dialect_type": 0,
+                    "entries": [{
+                        "part_of_speech": "名词",
+                        "meaning": "字；文字",
+                        "examples": [{"壮文": "sawq cuengh", "中文": "壮文"}] * 3
+                    }] * 2
+                }]
+            }
+            write_json_atomic(os.path.join(output_dir, f"{stem}.json"), [record], ensure_ascii=False, indent=2)
+            stems.append(stem)
+    return stems
+
+
+def run_benchmarks(root, pages=10, crops=10, resolution=(1600, 2400)):
+    """生成合成数据并测量启动扫描、JSON读取、主图解码、缩略图和提交各热点路径的耗时"""
+    start = time.perf_counter()
+    stems = generate_benchmark_corpus(root, pages, crops, resolution)
+    generate_ms = (time.perf_counter() - start) * 1000
+    image_dir = os.path.join(root, "image")
+    output_dir = os.path.join(root, "output")
+    cache_dir = os.path.join(root, "cache")
+    results = {}
+
+    # 1. 目录扫描与排序：原来的glob+sort_key，对比持久化索引的冷/热启动
+    def legacy_scan():
+        sorted([f for ext in ["*.png", "*.jpg", "*.jpeg"] for f in glob.glob(os.path.join(image_dir, ext))],
+               key=ImageViewerApp.sort_key)
+
+    index_path = os.path.join(cache_dir, "image_index.json")
+    results["scan_glob_sort"] = _time_once(legacy_scan)
+    results["scan_index_cold"] = _time_once(lambda: ImageDirectoryIndex(image_dir, index_path).refresh())
+    results["scan_index_warm"] = _time_once(lambda: ImageDirectoryIndex(image_dir, index_path).refresh())
+    image_files = ImageDirectoryIndex(image_dir, index_path).refresh()
+
+    # 2. load_current_image中的JSON读取
+    store = FileAnnotationStore(output_dir)
+    results["json_load"] = _time_each(store.load, stems)
+    records = [store.load(stem) for stem in stems]
+
+    # 3. 主图解码+缩放
+    results["decode_thumbnail"] = _time_each(load_display_image, image_files)
+
+    # 3.1 预先生成显示图（pregen）后翻页只需解码小图
+    display_dir = os.path.join(cache_dir, "display")
+    results["pregen"] = _time_once(lambda: pregenerate_derivatives(
+        image_files, display_dir=display_dir, thumbnail_dir=os.path.join(cache_dir, "pregen_thumbnails")))
+    derivative_cache = PageImageCache(derivative_dir=display_dir)
+    results["decode_derivative"] = _time_each(derivative_cache._decode, image_files)
+    derivative_cache.close()
+
+    # 4. update_thumbnail_panel的等价工作：首次生成与缓存命中
+    thumbnail_cache = ThumbnailCache(os.path.join(cache_dir, "thumbnails"))
+    thumb_paths = [pronunciation_thumbnail_paths(record["pronunciations"][0])[0] for record in records]
+    results["thumbnail_panel_cold"] = _time_each(thumbnail_cache.get, thumb_paths)
+    results["thumbnail_panel_warm"] = _time_each(thumbnail_cache.get, thumb_paths)
+
+    # 5. submit_data：界面线程上的规划+入队耗时，以及后台写入全部完成的总耗时
+    writer = SubmitWriter(store, os.path.join(root, "journal", "submit"), thumbnail_cache)
+    input_dir = os.path.join(root, "output_image")
+
+    def submit(item):
+        stem, record = item
+        moves, removes = plan_submission(record, input_dir)
+        writer.submit(stem, record, moves, removes)
+
+    start = time.perf_counter()
+    results["submit_enqueue"] = _time_each(submit, list(zip(stems, records)))
+    writer.close()
+    results["submit_drain"] = summarize_timings([(time.perf_counter() - start) * 1000])
+    errors = [error for _, error, _ in writer.poll_results() if error]
+
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "environment": {
+            "python": sys.version.split()[0],
+            "pillow": Image.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "params": {"pages": pages, "crops": crops, "images": len(stems), "resolution": list(resolution),
+                   "generate_ms": round(generate_ms, 3)},
+        "results": results,
+        "errors": errors,
+    }
+
+
+class HttpError(Exception):
+    def __init__(self, status, message=""):
+        super().__init__(message)
+        self.status = status
+        self.message = message or HTTPStatus(status).phrase
+
+
+class AnnotationServer:
+    """
+    无界面的标注服务：基于asyncio的HTTP接口，与图形界面使用同一套目录（image、output、output_image）。
+
+    - GET  /api/images?offset=&limit=           图片名和标注状态
+    - GET  /api/records/<图片名>                 记录（与submit_data写入的JSON相同），ETag为store.version()
+    - PUT  /api/records/<图片名>                 保存记录；带If-Match时版本不一致返回412，图片被他人租用时返回409
+    - POST /api/next?annotator=&after=           分配下一张未提交的图片并获取租约
+    - DELETE /api/leases/<图片名>?annotator=     释放租约
+    - GET  /images/<文件名>?variant=display|thumbnail|original   页面图片，显示图/缩略图不存在时当场生成
+    - GET  /output_image/<文件名>                截图
+
+    图片和记录都带ETag，If-None-Match命中时返回304不再发送内容。租约与多人模式的桌面程序共用
+    output/.leases，双方不会分到同一张图片。磁盘读写和图片缩放在线程池中执行，不阻塞事件循环。
+    客户端只能引用output_image中已有的截图，不能上传文件。
+    """
+
+    MAX_BODY = 10 * 1024 * 1024
+    MAX_PROBE = 200  # 分配时最多跳过的被他人租用的图片数
+    CONTENT_TYPES = {".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".webp": "image/webp"}
+
+    def __init__(self, store, image_dir="image", output_dir="output", output_image_dir="output_image",
+                 lease_ttl=300, display_size=(1000, 1000), thumbnail_size=(50, 50)):
+        self.store = store
+        self.image_dir = image_dir
+        self.output_image_dir = output_image_dir
+        self.lease_dir = os.path.join(output_dir, ".leases")
+        self.lease_ttl = lease_ttl
+        self.display_size = display_size
+        self.thumbnails = ThumbnailCache(size=thumbnail_size, max_bytes=float("inf"))
+        self.directory_index = ImageDirectoryIndex(image_dir)
+        self.image_files = self.directory_index.refresh()
+        self.paths = {os.path.splitext(os.path.basename(path))[0]: path for path in self.image_files}
+        self.status_index = AnnotationStatusIndex(self.image_files, store.stems())
+        self.annotation_stats = AnnotationStats(output_dir)
+        self._leases = {}  # 标注者 -> LeaseManager
+        self._write_lock = None  # 事件循环启动后创建
+        self._derive_locks = {}  # (原图, 类型) -> asyncio.Lock
+        self.requests = 0
+
+    def leases_for(self, annotator):
+        if annotator not in self._leases:
+            self._leases[annotator] = LeaseManager(self.lease_dir, annotator, self.lease_ttl)
+        return self._leases[annotator]
+
+    # ---- HTTP ----
+
+    async def handle_connection(self, reader, writer):
+        """一个连接上依次处理多个请求（HTTP/1.1 keep-alive）"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self._send(writer, 400, {"error": "请求行格式错误"})
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    length = int(headers.get("content-length") or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self._send(writer, 400, {"error": "Content-Length无效"})
+                    break
+                if length > self.MAX_BODY:
+                    await self._send(writer, 413, {"error": "请求内容过大"})
+                    break
+                body = await reader.readexactly(length) if length else b""
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                self.requests += 1
+                with TRACER.span("http_request", method=method, target=target):
+                    try:
+                        status, payload, extra = await self.dispatch(method, target, headers, body)
+                    except HttpError as e:
+                        status, payload, extra = e.status, {"error": e.message}, {}
+                    except Exception as e:
+                        print(f"请求处理失败: {method} {target} {str(e)}")
+                        status, payload, extra = 500, {"error": str(e)}, {}
+                await self._send(writer, status, payload, extra, keep_alive, head=method == "HEAD")
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _send(self, writer, status, payload, extra=None, keep_alive=False, head=False):
+        headers = dict(extra or {})
+        if isinstance(payload, (dict, list)):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            headers.setdefault("Content-Type", "application/json; charset=utf-8")
+        else:
+            body = payload or b""
+        headers["Content-Length"] = str(len(body))
+        headers["Connection"] = "keep-alive" if keep_alive else "close"
+        lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}"] + [f"{k}: {v}" for k, v in headers.items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        if not head and status != 304:
+            writer.write(body)
+        await writer.drain()
+
+    async def dispatch(self, method, target, headers, body):
+        """返回(状态码, 内容, 额外响应头)，内容为dict/list时按JSON发送，bytes原样发送"""
+        parts = urlsplit(target)
+        query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        segments = [unquote(segment) for segment in parts.path.strip("/").split("/")]
+        if method in ("GET", "HEAD"):
+            if segments == ["api", "images"]:
+                offset = self._int_param(query, "offset", 0)
+                limit = self._int_param(query, "limit", 1000)
+                return 200, self.list_images(offset, limit), {}
+            if len(segments) == 3 and segments[:2] == ["api", "records"]:
+                return await self.get_record(segments[2], headers)
+            if len(segments) == 2 and segments[0] == "images":
+                return await self.get_image(segments[1], query.get("variant", "display"), headers)
+            if len(segments) == 2 and segments[0] == "output_image":
+                return await self.get_output_image(segments[1], headers)
+        elif method == "PUT" and len(segments) == 3 and segments[:2] == ["api", "records"]:
+            return await self.put_record(segments[2], headers, body, query.get("annotator"))
+        elif method == "POST" and segments == ["api", "next"]:
+            return await self.next_assignment(query.get("annotator"), query.get("after"))
+        elif method == "DELETE" and len(segments) == 3 and segments[:2] == ["api", "leases"]:
+            return await self.release_lease(segments[2], query.get("annotator"))
+        raise HttpError(404, f"未知的接口: {method} {parts.path}")
+
+    @staticmethod
+    def _int_param(query, name, default):
+        """读取非负整数参数，格式错误时返回400"""
+        try:
+            value = int(query.get(name, default))
+        except ValueError:
+            raise HttpError(400, f"{name}必须是整数")
+        if value < 0:
+            raise HttpError(400, f"{name}不能为负数")
+        return value
+
+    @staticmethod
+    def _etag(version):
+        return f'"{version}"'
+
+    @staticmethod
+    def _not_modified(headers, etag):
+        tags = [tag.strip() for tag in headers.get("if-none-match", "").split(",")]
+        return etag in tags or "*" in tags
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    # ---- 记录 ----
+
+    def list_images(self, offset=0, limit=1000):
+        stems = self.status_index.stems[offset:offset + limit]
+        return {
+            "total": len(self.status_index.stems),
+            "counts": self.status_index.counts(),
+            "images": [{"image": os.path.basename(self.paths[stem]), "stem": stem,
+                        "status": self.status_index.status[offset + i]} for i, stem in enumerate(stems)],
+        }
+
+    def _stem(self, stem):
+        if stem not in self.paths:
+            raise HttpError(404, f"没有图片: {stem}")
+        return stem
+
+    async def get_record(self, stem, headers):
+        stem = self._stem(stem)
+        version, record = await self._run(lambda: (self.store.version(stem), self.store.load(stem)))
+        if record is None:
+            raise HttpError(404, f"{stem}尚未提交")
+        etag = self._etag(version)
+        if self._not_modified(headers, etag):
+            return 304, b"", {"ETag": etag}
+        return 200, record, {"ETag": etag, "Cache-Control": "no-cache"}
+
+    async def put_record(self, stem, headers, body, annotator=None):
+        stem = self._stem(stem)
+        try:
+            record = json.loads(body.decode("utf-8"))
+        except ValueError as e:
+            raise HttpError(400, f"不是有效的JSON: {str(e)}")
+        if not isinstance(record, dict) or not isinstance(record.get("pronunciations"), list):
+            raise HttpError(400, "记录必须是包含pronunciations列表的对象")
+        record.setdefault("image", os.path.basename(self.paths[stem]))
+        annotator = annotator or record.get("annotator") or None
+        if not annotator:
+            raise HttpError(400, "缺少annotator参数（或记录中的annotator字段），无法检查租约")
+        expected = headers.get("if-match", "").strip()
+
+        def save():
+            self.check_references(record)
+            holder = self.leases_for(annotator).acquire(stem)
+            if holder:
+                raise HttpError(409, f"该图片正在由 {holder.get('owner', '?')} 标注")
+            current = self.store.version(stem)
+            if expected and expected != "*" and expected != self._etag(current):
+                raise HttpError(412, "记录已被修改，请重新获取后再提交")
+            if expected == "*" and current is None:
+                raise HttpError(412, "记录不存在")
+            self.store.save(stem, record)
+            self.leases_for(annotator).release(stem)
+            return self.store.version(stem)
+
+        async with self._write_lock:  # 同一图片的版本检查和写入不与其他写入交错
+            version = await self._run(save)
+        self.status_index.set_status_by_stem(stem, AnnotationStatusIndex.SUBMITTED)
+        self.annotation_stats.update(stem, record)
+        return 200, {"image": stem, "version": version}, {"ETag": self._etag(version)}
+
+    def check_references(self, record):
+        """
+        记录中的截图只能引用output_image中已有的文件：imported_image为其中的文件名，
+        imported_source_path/old_image_path为output_image/<文件名>。桌面程序提交和删除读音时会移动、
+        删除这两个路径指向的文件，不检查的话客户端可以借此移动或删除任意文件。
+        """
+        items = [record] + list(record["pronunciations"])
+        for item in items:
+            if not isinstance(item, dict):
+                raise HttpError(400, "pronunciations中的每一项必须是对象")
+            names = item.get("imported_image") or []
+            if not isinstance(names, list):
+                raise HttpError(400, "imported_image必须是列表")
+            for name in names:
+                self._output_image_name(name, "imported_image")
+            for key in ("imported_source_path", "old_image_path"):
+                path = item.get(key)
+                if not path:
+                    continue
+                if not isinstance(path, str):
+                    raise HttpError(400, f"{key}必须是字符串")
+                directory, name = os.path.split(path.replace("\\", "/"))
+                if os.path.normpath(directory) != os.path.normpath(self.output_image_dir) or os.path.isabs(path):
+                    raise HttpError(400, f"{key}只能是{self.output_image_dir}/<文件名>: {path}")
+                self._output_image_name(name, key)
+            if (item.get("imported_source_path") or "") != (item.get("old_image_path") or ""):
+                # 两者不同时桌面程序会把前者当作新导入的截图移动，并删除后者
+                raise HttpError(400, "imported_source_path必须与old_image_path相同（服务不接受新导入的截图）")
+
+    def _output_image_name(self, name, field):
+        if not isinstance(name, str) or not name or name.startswith(".") or os.path.basename(name) != name \
+                or "\\" in name:
+            raise HttpError(400, f"{field}中的文件名无效: {name}")
+        if not os.path.isfile(os.path.join(self.output_image_dir, name)):
+            raise HttpError(400, f"{field}引用的截图不在{self.output_image_dir}中: {name}")
+
+    async def next_assignment(self, annotator, after=None):
+        if not annotator:
+            raise HttpError(400, "缺少annotator参数")
+        leases = self.leases_for(annotator)
+
+        def assign():
+            index = self.status_index.positions.get(after, -1)
+            refreshed = False
+            for _ in range(self.MAX_PROBE):
+                index = self.status_index.next_unannotated(index)
+                if index is None:
+                    return None
+                stem = self.status_index.stems[index]
+                if leases.acquire(stem) is not None:
+                    continue
+                if self.store.version(stem) is None:
+                    return stem
+                # 启动后已由桌面程序或其他服务提交，状态索引已过期
+                leases.release(stem)
+                self.status_index.set_status(index, AnnotationStatusIndex.SUBMITTED)
+                if not refreshed:
+                    self.status_index.mark_submitted(self.store.stems())
+                    refreshed = True
+            return None
+
+        async with self._write_lock:  # 与提交的状态更新不交错
+            stem = await self._run(assign)
+        if stem is None:
+            return 200, {"image": None}, {}
+        return 200, {"image": os.path.basename(self.paths[stem]), "stem": stem,
+                     "lease_expires": time.time() + self.lease_ttl}, {}
+
+    async def release_lease(self, stem, annotator):
+        if not annotator:
+            raise HttpError(400, "缺少annotator参数")
+        await self._run(self.leases_for(annotator).release, stem)
+        return 200, {"image": stem, "released": True}, {}
+
+    # ---- 图片 ----
+
+    def _derivative(self, path, variant):
+        """返回(要发送的文件, ETag)，显示图和缩略图不存在时生成"""
+        if variant == "original":
+            st = os.stat(path)
+            return path, f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+        if variant == "display":
+            target, size = display_derivative_path(path, self.display_size), self.display_size
+        elif variant == "thumbnail":
+            name = self.thumbnails.key_for(path)
+            target, size = (os.path.join(self.thumbnails.cache_dir, name) if name else None), self.thumbnails.size
+        else:
+            raise HttpError(400, f"未知的图片类型: {variant}")
+        if target is None:
+            raise HttpError(404, f"找不到图片: {path}")
+        if not os.path.exists(target):
+            with TRACER.span("http_derivative", variant=variant):
+                _, error = _generate_derivatives((path, [(target, size)]))
+            if error:
+                raise HttpError(500, f"生成{variant}失败: {error}")
+        # 文件名由原图路径、mtime和尺寸的哈希决定，可直接作为强ETag
+        return target, f'"{os.path.splitext(os.path.basename(target))[0]}"'
+
+    async def _send_file(self, path, etag, headers):
+        if self._not_modified(headers, etag):
+            return 304, b"", {"ETag": etag}
+        data = await self._run(lambda: open(path, "rb").read())
+        content_type = self.CONTENT_TYPES.get(os.path.splitext(path)[1].lower(), "application/octet-stream")
+        return 200, data, {"ETag": etag, "Content-Type": content_type, "Cache-Control": "no-cache"}
+
+    async def get_image(self, name, variant, headers):
+        path = self.paths.get(os.path.splitext(name)[0])
+        if path is None:
+            raise HttpError(404, f"没有图片: {name}")
+        # 同一张图的显示图只生成一次，其余请求等待后直接读取
+        async with self._derive_locks.setdefault((path, variant), asyncio.Lock()):
+            target, etag = await self._run(self._derivative, path, variant)
+        return await self._send_file(target, etag, headers)
+
+    async def get_output_image(self, name, headers):
+        if os.path.basename(name) != name or name.startswith("."):
+            raise HttpError(400, f"无效的文件名: {name}")
+        path = os.path.join(self.output_image_dir, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            raise HttpError(404, f"没有截图: {name}")
+        return await self._send_file(path, f'"{st.st_mtime_ns:x}-{st.st_size:x}"', headers)
+
+    # ---- 启动 ----
+
+    async def start(self, host="127.0.0.1", port=8765):
+        """开始监听，返回asyncio.Server（port为0时由系统分配端口）"""
+        self._write_lock = asyncio.Lock()
+        self.annotation_stats.load()
+        await self._run(self.annotation_stats.refresh, self.store)
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+    def close(self):
+        for leases in self._leases.values():
+            leases.release_all()
+        if self.annotation_stats.dirty:
+            try:
+                self.annotation_stats.save()
+            except Exception as e:
+                print(f"统计数据保存失败: {str(e)}")
+
+
+def run_gui(annotator=None):
     root = tk.Tk()
-    app = ImageViewerApp(root)
-    root.mainloop()
\ No newline at end of file
+    app = ImageViewerApp(root, annotator)
+    root.mainloop()
+
+
+def cmd_migrate(args):
+    source = open_annotation_store(args.source, args.output_dir)
+    target = open_annotation_store(args.target, args.output_dir)
+    try:
+        count = migrate_annotations(source, target)
+    finally:
+        source.close()
+        target.close()
+    print(f"已迁移 {count} 条记录: {args.source} -> {args.target}")
+    if args.set_default:
+        save_config({"storage_backend": args.target})
+        print(f"已将config.json中的storage_backend设置为 {args.target}")
+
+
+def cmd_export(args):
+    backend = load_config().get("storage_backend", "file")
+    if backend != "file":
+        # 非逐文件存储时直接从存储中按顺序读取
+        if args.incremental:
+            print(f"当前存储方式为{backend}，增量导出仅支持file存储，将执行全量导出")
+        store = open_annotation_store(backend, args.output_dir)
+        writer = AnnotationExportWriter(args.format, args.out, args.compact, args.compress)
+        try:
+            for stem in sorted(store.stems(), key=ImageViewerApp.sort_key):
+                writer.write(stem, [store.load(stem)])
+        except BaseException:
+            writer.abort()
+            raise
+        finally:
+            store.close()
+        writer.close()
+        print(f"已导出 {writer.count} 条记录到 {args.out}")
+        return
+    start = time.perf_counter()
+    stats = export_annotations(args.format, args.out, args.output_dir, args.incremental, args.workers,
+                               args.compact, args.compress)
+    print(f"已导出 {stats['records']} 条记录到 {args.out}，共{stats['files']}个文件，"
+          f"重新解析{stats['parsed']}个，移除{stats['removed']}个，耗时{time.perf_counter() - start:.2f}秒")
+    for stem, error in stats["errors"]:
+        print(f"解析失败: {stem}: {error}")
+
+
+def cmd_bench(args):
+    width, height = (int(value) for value in args.resolution.lower().split("x"))
+    root = args.workdir or tempfile.mkdtemp(prefix="pic_to_json_bench_")
+    try:
+        report = run_benchmarks(root, args.pages, args.crops, (width, height))
+    finally:
+        if not args.workdir:
+            shutil.rmtree(root, ignore_errors=True)
+    write_json_atomic(args.out, report, ensure_ascii=False, indent=2)
+    for name, stats in report["results"].items():
+        print(f"{name:<22} n={stats['n']:<5} mean={stats['mean_ms']:>9.3f}ms  p95={stats['p95_ms']:>9.3f}ms")
+    print(f"结果已写入 {args.out}")
+
+
+def cmd_search(args):
+    backend = load_config().get("storage_backend", "file")
+    store = open_annotation_store(backend, args.output_dir)
+    index = AnnotationSearchIndex(args.output_dir)
+    try:
+        index.load()
+        index.refresh(store)
+        if index.dirty:
+            index.save()
+    finally:
+        store.close()
+    fields = [args.field] if args.field else SEARCH_FIELDS
+    start = time.perf_counter()
+    stems = index.search(args.query, args.mode, fields)
+    elapsed = (time.perf_counter() - start) * 1000
+    for stem in sorted(stems, key=ImageViewerApp.sort_key):
+        print(stem)
+    print(f"共{len(stems)}条，查询耗时{elapsed:.2f}ms")
+
+
+def cmd_dedupe(args):
+    backend = load_config().get("storage_backend", "file")
+    store = open_annotation_store(backend, args.output_dir)
+    try:
+        stats = dedupe_output_images(store, args.image_dir, args.threshold, not args.apply, args.workers)
+    finally:
+        store.close()
+    for duplicate, kept in sorted(stats["groups"].items()):
+        print(f"{duplicate} -> {kept}")
+    action = "已删除" if args.apply else "可删除（加--apply执行）"
+    print(f"共{stats['files']}个文件，重复{stats['duplicates']}个，{action}，"
+          f"释放{stats['bytes_reclaimed'] / 1024 / 1024:.1f}MB，需要改写引用的记录{stats['records_updated']}条")
+
+
+def cmd_gc(args):
+    backend = load_config().get("storage_backend", "file")
+    store = open_annotation_store(backend, args.output_dir)
+    image_index = OutputImageIndex(args.image_dir) if args.apply else None
+    try:
+        collector = OrphanCollector(store, args.temp_dir, args.image_dir,
+                                    min_age=args.min_age_hours * 3600, image_index=image_index)
+        stats = collector.collect(dry_run=not args.apply)
+    finally:
+        store.close()
+        if image_index:
+            image_index.close()
+    for path in stats["orphans"]:
+        print(path)
+    action = f"已删除{stats['removed']}个" if args.apply else "加--apply删除"
+    print(f"共扫描{stats['scanned']}个文件，被引用{stats['referenced']}个，最近修改跳过{stats['recent']}个，"
+          f"未被引用{len(stats['orphans'])}个（{stats['bytes'] / 1024 / 1024:.1f}MB），{action}")
+
+
+def cmd_pregen(args):
+    image_files = ImageDirectoryIndex(args.image_dir).refresh()
+    config = load_config()
+
+    def progress(done, total):
+        print(f"{done}/{total}")
+
+    start = time.perf_counter()
+    stats = pregenerate_derivatives(image_files, workers=args.workers, prune=args.prune, progress=progress)
+    for path, error in stats["errors"].items():
+        print(f"生成失败: {path} {error}")
+    print(f"共{stats['images']}张图片，生成{stats['generated']}个文件，已是最新{stats['skipped']}张，"
+          f"失败{len(stats['errors'])}张，耗时{time.perf_counter() - start:.1f}秒")
+    if "pruned" in stats:
+        print(f"删除过期的显示图{stats['pruned']}个")
+    thumbnails = ThumbnailCache()
+    limit = config.get("thumbnail_cache_mb", 64) * 1024 * 1024
+    if thumbnails._bytes > limit:
+        print(f"缩略图缓存已有{thumbnails._bytes / 1024 / 1024:.0f}MB，超过thumbnail_cache_mb，"
+              f"程序运行时会淘汰一部分，请在config.json中调大")
+
+
+def cmd_enhance(args):
+    image_files = ImageDirectoryIndex(args.image_dir).refresh()
+    stages = args.stages.split(",") if args.stages else load_config().get("enhance_stages", list(ENHANCE_STAGES))
+
+    def progress(done, total):
+        print(f"{done}/{total}")
+
+    start = time.perf_counter()
+    stats = enhance_images(image_files, stages, workers=args.workers, batch_size=args.batch_size, progress=progress)
+    for path, error in stats["errors"].items():
+        print(f"增强失败: {path} {error}")
+    for stage, timing in stats["timings"].items():
+        print(f"{stage:<10} mean={timing['mean_ms']:>8.1f}ms  p95={timing['p95_ms']:>8.1f}ms  "
+              f"合计={timing['total_ms'] / 1000:>8.1f}s")
+    print(f"共{stats['images']}张图片，生成{stats['generated']}张，已是最新{stats['skipped']}张，"
+          f"失败{len(stats['errors'])}张，耗时{time.perf_counter() - start:.1f}秒")
+    if not load_config().get("enhance_display", False):
+        print("在config.json中设置\"enhance_display\": true后，程序会显示增强后的图片")
+
+
+def cmd_segment(args):
+    page_files = []
+    for path in sorted(glob.glob(os.path.join(args.pages_dir, "*"))):
+        if os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS + (".tif", ".tiff"):
+            page_files.append(path)
+    params = {"min_col_gap": args.min_col_gap, "min_row_gap": args.min_row_gap, "min_height": args.min_height}
+
+    def progress(done, total):
+        print(f"{done}/{total}")
+
+    start = time.perf_counter()
+    stats = segment_pages(page_files, args.image_dir, args.workers, force=args.force, progress=progress, **params)
+    for source, reason in stats["conflicts"].items():
+        print(f"跳过: {source} {reason}")
+    for source, error in stats["errors"].items():
+        print(f"切图失败: {source} {error}")
+    print(f"共{stats['pages']}页，切分{stats['segmented']}页得到{stats['crops']}张图片，已切过{stats['skipped']}页，"
+          f"跳过{len(stats['conflicts'])}页，失败{len(stats['errors'])}页，耗时{time.perf_counter() - start:.1f}秒")
+
+
+def cmd_serve(args):
+    config = load_config()
+    backend = config.get("storage_backend", "file")
+    store = open_annotation_store(backend, args.output_dir)
+    server = AnnotationServer(store, args.image_dir, args.output_dir, lease_ttl=config.get("lease_seconds", 300))
+
+    async def serve():
+        listener = await server.start(args.host, args.port)
+        address = listener.sockets[0].getsockname()
+        print(f"标注服务已启动: http://{address[0]}:{address[1]}/api/images ，共{len(server.image_files)}张图片，Ctrl+C停止")
+        async with listener:
+            await listener.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        store.close()
+        print(f"共处理{server.requests}个请求")
+
+
+def cmd_trace(args):
+    with open(args.trace, "r", encoding="utf-8") as f:
+        trace = json.load(f)
+    summary = summarize_trace_events(trace.get("traceEvents", []))
+    print(f"{'事件':<36}{'次数':>8}{'合计ms':>12}{'p50':>10}{'p95':>10}{'p99':>10}{'最大':>10}")
+    for key, stats in summary.items():
+        print(f"{key:<36}{stats['n']:>8}{stats['total_ms']:>12.1f}{stats['p50_ms']:>10.1f}"
+              f"{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}{stats['max_ms']:>10.1f}")
+    slow = [event for event in trace.get("traceEvents", [])
+            if event.get("cat") == "callback" and event.get("dur", 0) / 1000 > args.slow_ms]
+    if slow:
+        print(f"\n超过{args.slow_ms}ms的界面回调{len(slow)}次：")
+        for event in sorted(slow, key=lambda event: -event["dur"])[:20]:
+            print(f"  {event['name']} {event['dur'] / 1000:.0f}ms")
+    errors = [event for event in trace.get("traceEvents", []) if event.get("ph") == "i"]
+    for event in errors:
+        print(f"错误: {event['name']} {event.get('args', {})}")
+
+
+def cmd_stats(args):
+    backend = load_config().get("storage_backend", "file")
+    store = open_annotation_store(backend, args.output_dir)
+    stats = AnnotationStats(args.output_dir)
+    try:
+        stats.load()
+        stats.refresh(store)
+        if stats.dirty:
+            stats.save()
+    finally:
+        store.close()
+    image_files = ImageDirectoryIndex(args.image_dir).refresh() if args.pages else ()
+    summary = stats.summary(image_files, args.by, args.filter_annotator)
+    print(f"{'标注者':<16}{'记录':>8}{'读音':>8}{'词性':>8}{'例句':>8}")
+    for name, totals in summary["totals"].items():
+        if args.filter_annotator and name != args.filter_annotator:
+            continue
+        print(f"{name:<16}{totals['records']:>8}{totals['pronunciations']:>8}{totals['entries']:>8}"
+              f"{totals['examples']:>8}")
+    for name, buckets in summary["throughput"]["annotators"].items():
+        print(f"\n{name}")
+        for bucket, count in list(buckets.items())[-args.last:]:
+            print(f"  {bucket:<18}{count:>6}")
+    if args.pages:
+        print(f"\n{'页':>6}{'已提交':>8}{'图片':>8}")
+        for item in summary["pages"]:
+            print(f"{item['page']:>6}{item['annotated']:>8}{item['images']:>8}")
+    if args.out:
+        write_json_atomic(args.out, summary, ensure_ascii=False, indent=2)
+        print(f"统计已写入 {args.out}")
+
+
+def cmd_validate(args):
+    backend = load_config().get("storage_backend", "file")
+    store = open_annotation_store(backend, args.output_dir)
+    try:
+        validator = AnnotationValidator(store, args.image_dir, rules=args.rule)
+        report = validator.validate(args.workers)
+    finally:
+        store.close()
+    for issue in report["issues"][:args.show]:
+        print(f"{issue['image']} [{issue['rule']}] {issue['field']}: {issue['message']}")
+    if len(report["issues"]) > args.show:
+        print(f"……另有{len(report['issues']) - args.show}个问题" + ("，完整内容见报告文件" if args.out else "，加--out导出完整报告"))
+    for rule, count in sorted(report["counts"].items()):
+        print(f"{rule:<24}{count:>8}")
+    if args.out:
+        write_json_atomic(args.out, report, ensure_ascii=False, indent=2)
+        print(f"报告已写入 {args.out}")
+    print(f"共{report['records']}个文件，重新检查{report['checked']}个，使用缓存{report['cached']}个，"
+          f"发现问题{len(report['issues'])}个，耗时{report['elapsed_s']:.2f}秒")
+    if args.strict and report["issues"]:
+        sys.exit(1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="字典json生成工具，不带参数时启动图形界面")
+    parser.add_argument("--annotator", default=None,
+                        help="多人标注模式下的标注者标识，默认取环境变量PIC_TO_JSON_ANNOTATOR或<用户名>@<主机名>")
+    subparsers = parser.add_subparsers(dest="command")
+
+    migrate_parser = subparsers.add_parser("migrate", help="在不同存储方式之间迁移标注数据")
+    migrate_parser.add_argument("--from", dest="source", default="file", choices=list(ANNOTATION_STORES))
+    migrate_parser.add_argument("--to", dest="target", required=True, choices=list(ANNOTATION_STORES))
+    migrate_parser.add_argument("--output-dir", default="output")
+    migrate_parser.add_argument("--set-default", action="store_true", help="迁移后切换config.json中的存储方式")
+    migrate_parser.set_defaults(func=cmd_migrate)
+
+    export_parser = subparsers.add_parser("export", help="把全部标注合并导出为一个jsonl/csv/sqlite文件")
+    export_parser.add_argument("--format", default="jsonl", choices=EXPORT_FORMATS)
+    export_parser.add_argument("--out", required=True, help="导出文件路径")
+    export_parser.add_argument("--output-dir", default="output")
+    export_parser.add_argument("--incremental", action="store_true", help="只重新解析上次导出后修改过的文件")
+    export_parser.add_argument("--workers", type=int, default=None, help="解析进程数，默认等于CPU核数")
+    export_parser.add_argument("--compact", action="store_true", help="记录去掉空的默认字段且不缩进")
+    export_parser.add_argument("--compress", default=None, choices=["gzip", "lzma"], help="jsonl/csv输出压缩方式")
+    export_parser.set_defaults(func=cmd_export)
+
+    bench_parser = subparsers.add_parser("bench", help="在合成数据上测量各热点路径耗时（无需图形界面）")
+    bench_parser.add_argument("--pages", type=int, default=10)
+    bench_parser.add_argument("--crops", type=int, default=10, help="每页的裁剪图数量")
+    bench_parser.add_argument("--resolution", default="1600x2400", help="合成图片分辨率，宽x高")
+    bench_parser.add_argument("--out", default="bench_results.json")
+    bench_parser.add_argument("--workdir", default=None, help="保留合成数据的目录，默认使用临时目录并在结束后删除")
+    bench_parser.set_defaults(func=cmd_bench)
+
+    search_parser = subparsers.add_parser("search", help="在标注中搜索汉字、壮文、国际音标或意思")
+    search_parser.add_argument("query")
+    search_parser.add_argument("--mode", default="exact", choices=AnnotationSearchIndex.MODES)
+    search_parser.add_argument("--field", default=None, choices=SEARCH_FIELDS)
+    search_parser.add_argument("--output-dir", default="output")
+    search_parser.set_defaults(func=cmd_search)
+
+    dedupe_parser = subparsers.add_parser("dedupe", help="合并output_image中相同或几乎相同的截图")
+    dedupe_parser.add_argument("--apply", action="store_true", help="实际改写记录并删除重复文件，默认只报告")
+    dedupe_parser.add_argument("--threshold", type=int, default=10, help="感知哈希汉明距离阈值（共256位），0表示只合并完全相同的文件")
+    dedupe_parser.add_argument("--image-dir", default="output_image")
+    dedupe_parser.add_argument("--output-dir", default="output")
+    dedupe_parser.add_argument("--workers", type=int, default=None)
+    dedupe_parser.set_defaults(func=cmd_dedupe)
+
+    gc_parser = subparsers.add_parser("gc", help="列出或删除temp和output_image中没有被任何记录引用的文件")
+    gc_parser.add_argument("--apply", action="store_true", help="实际删除，默认只报告")
+    gc_parser.add_argument("--min-age-hours", type=float, default=1, help="修改时间不到该时长的文件不删除")
+    gc_parser.add_argument("--temp-dir", default="temp")
+    gc_parser.add_argument("--image-dir", default="output_image")
+    gc_parser.add_argument("--output-dir", default="output")
+    gc_parser.set_defaults(func=cmd_gc)
+
+    pregen_parser = subparsers.add_parser("pregen", help="用多进程预先生成全部图片的显示图和缩略图，翻页时不再解码原图")
+    pregen_parser.add_argument("--image-dir", default="image")
+    pregen_parser.add_argument("--workers", type=int, default=None, help="进程数，默认等于CPU核数")
+    pregen_parser.add_argument("--prune", action="store_true", help="删除原图已修改或已删除的显示图")
+    pregen_parser.set_defaults(func=cmd_pregen)
+
+    enhance_parser = subparsers.add_parser("enhance", help="用多进程为全部图片生成增强图（对比度拉伸、裁边、纠偏、二值化，需要numpy）")
+    enhance_parser.add_argument("--image-dir", default="image")
+    enhance_parser.add_argument("--stages", default=None,
+                                help=f"逗号分隔的步骤，默认取config.json中的enhance_stages，可选: {','.join(ENHANCE_STAGES)}")
+    enhance_parser.add_argument("--workers", type=int, default=None, help="进程数，默认等于CPU核数")
+    enhance_parser.add_argument("--batch-size", type=int, default=16, help="每个进程任务处理的图片数")
+    enhance_parser.set_defaults(func=cmd_enhance)
+
+    segment_parser = subparsers.add_parser("segment", help="把整页扫描自动切成zhuang_<页>_crop_<序号>.jpg写入image（需要numpy）")
+    segment_parser.add_argument("pages_dir", help="整页扫描所在目录，页数取文件名中最后一组数字")
+    segment_parser.add_argument("--image-dir", default="image")
+    segment_parser.add_argument("--workers", type=int, default=None, help="进程数，默认等于CPU核数")
+    segment_parser.add_argument("--min-col-gap", type=int, default=None, help="分栏的最小空白宽度（像素），默认内容宽度的3%%")
+    segment_parser.add_argument("--min-row-gap", type=int, default=None, help="分隔词条的最小空白高度（像素），默认行间空白中位数的2倍")
+    segment_parser.add_argument("--min-height", type=int, default=None, help="词条块的最小高度（像素），默认页高的1%%")
+    segment_parser.add_argument("--force", action="store_true", help="覆盖已有的手工切图")
+    segment_parser.set_defaults(func=cmd_segment)
+
+    serve_parser = subparsers.add_parser("serve", help="以HTTP服务方式提供图片、记录读写和未标注图片分配（无界面）")
+    serve_parser.add_argument("--host", default="127.0.0.1", help="监听地址，局域网内使用时设为0.0.0.0")
+    serve_parser.add_argument("--port", type=int, default=8765)
+    serve_parser.add_argument("--image-dir", default="image")
+    serve_parser.add_argument("--output-dir", default="output")
+    serve_parser.set_defaults(func=cmd_serve)
+
+    trace_parser = subparsers.add_parser("trace", help="汇总导出的追踪记录（traces/trace_*.json）中各事件的耗时分位数")
+    trace_parser.add_argument("trace")
+    trace_parser.add_argument("--slow-ms", type=float, default=200)
+    trace_parser.set_defaults(func=cmd_trace)
+
+    stats_parser = subparsers.add_parser("stats", help="按标注者统计每小时/每天的提交量，以及每页的完成情况")
+    stats_parser.add_argument("--by", default="day", choices=list(AnnotationStats.BUCKET_FORMATS))
+    stats_parser.add_argument("--annotator", dest="filter_annotator", default=None, help="只列出该标注者的提交量")
+    stats_parser.add_argument("--last", type=int, default=14, help="每人列出最近的时间段数")
+    stats_parser.add_argument("--pages", action="store_true", help="列出每页的完成情况（需读取image目录）")
+    stats_parser.add_argument("--out", default=None, help="把统计结果写入JSON文件")
+    stats_parser.add_argument("--image-dir", default="image")
+    stats_parser.add_argument("--output-dir", default="output")
+    stats_parser.set_defaults(func=cmd_stats)
+
+    validate_parser = subparsers.add_parser("validate", help="检查全部标注记录（空读音、缺失截图、失效路径、页码与文件名不一致等）")
+    validate_parser.add_argument("--out", default=None, help="JSON报告路径")
+    validate_parser.add_argument("--rule", action="append", choices=VALIDATION_RULES, help="只检查指定规则，可重复")
+    validate_parser.add_argument("--show", type=int, default=50, help="在控制台列出的问题数")
+    validate_parser.add_argument("--strict", action="store_true", help="发现问题时以返回码1退出")
+    validate_parser.add_argument("--workers", type=int, default=None, help="进程数，默认等于CPU核数")
+    validate_parser.add_argument("--image-dir", default="output_image")
+    validate_parser.add_argument("--output-dir", default="output")
+    validate_parser.set_defaults(func=cmd_validate)
+
+    args = parser.parse_args(argv)
+    if args.command is None:
+        run_gui(args.annotator)
+    else:
+        args.func(args)
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,45 @@
+"""记录模型和紧凑编码的往返测试"""
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main  # noqa: E402
+
+LEGACY_RECORD = {
+    "image": "zhuang_3_crop_7.jpg",
+    "annotator": "alice",
+    "page_info": {"page_num": "3"},
+    "simplified_Chinese_character": "字",
+    "imported_source_path": "",
+    "imported_image": [],
+    "pronunciations": [{
+        "zhuang_spelling": "saw",
+        "ipa": "",
+        "imported_image": ["zhuang_3_crop_7_1.png"],
+        "entries": [{"meaning": "字", "examples": [{"壮文": "", "中文": ""}]}],
+        "note": "旧版本的附加字段"
+    }]
+}
+
+
+@pytest.mark.parametrize("compression", [None, "gzip", "lzma"])
+@pytest.mark.parametrize("record", [main.Annotation.new().to_dict(), LEGACY_RECORD], ids=["new", "legacy"])
+def test_compact_round_trip(record, compression):
+    decoded = main.decode_compact(main.encode_compact(record, compression), compression).to_dict()
+    # 比较序列化结果，键的顺序也必须一致
+    assert json.dumps(decoded, ensure_ascii=False) == json.dumps(record, ensure_ascii=False)
+
+
+def test_compact_drops_defaults_of_new_record():
+    data = json.loads(main.encode_compact(main.Annotation.new().to_dict()))
+    assert data == {"pronunciations": [{"entries": [{"examples": [{}]}]}]}
+
+
+def test_legacy_record_does_not_gain_fields():
+    decoded = main.decode_compact(main.encode_compact(LEGACY_RECORD)).to_dict()
+    pron = decoded["pronunciations"][0]
+    assert "dialect_type" not in pron and "old_image_path" not in pron
+    assert "word_num" not in decoded["page_info"]
@@ -0,0 +1,149 @@
+"""用纯本地的http.client客户端测试python main.py serve的HTTP接口"""
+import asyncio
+import http.client
+import json
+import os
+import socket
+import sys
+import threading
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main  # noqa: E402
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("image")
+    os.makedirs("output_image")
+    for crop in range(1, 4):
+        Image.new("RGB", (400, 600), "white").save(f"image/zhuang_1_crop_{crop}.jpg")
+    Image.new("RGB", (60, 30), "gray").save("output_image/shot.png")
+
+    store = main.FileAnnotationStore("output")
+    app = main.AnnotationServer(store)
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    address = {}
+
+    def run():
+        asyncio.set_event_loop(loop)
+        listener = loop.run_until_complete(app.start("127.0.0.1", 0))
+        address["port"] = listener.sockets[0].getsockname()[1]
+        started.set()
+        loop.run_forever()
+        listener.close()
+        loop.run_until_complete(listener.wait_closed())
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    assert started.wait(10)
+    yield address["port"]
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(10)
+    app.close()
+    store.close()
+
+
+def request(port, method, path, body=None, headers=None):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    try:
+        if isinstance(body, dict):
+            body = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        conn.request(method, path, body=body, headers=headers or {})
+        response = conn.getresponse()
+        data = response.read()
+        return response.status, {k.lower(): v for k, v in response.getheaders()}, data
+    finally:
+        conn.close()
+
+
+def new_record(stem, annotator):
+    return main.Annotation.new(image=f"{stem}.jpg", annotator=annotator).to_dict()
+
+
+def test_image_etag_and_304(server):
+    status, headers, data = request(server, "GET", "/images/zhuang_1_crop_1.jpg")
+    assert status == 200 and headers["content-type"] == "image/jpeg" and data
+    status, _, data = request(server, "GET", "/images/zhuang_1_crop_1.jpg",
+                              headers={"If-None-Match": headers["etag"]})
+    assert status == 304 and data == b""
+
+
+def test_record_get_put_with_etag(server):
+    stem = "zhuang_1_crop_1"
+    assert request(server, "GET", f"/api/records/{stem}")[0] == 404
+    status, headers, _ = request(server, "PUT", f"/api/records/{stem}?annotator=alice", new_record(stem, "alice"))
+    assert status == 200
+    etag = headers["etag"]
+
+    status, headers, data = request(server, "GET", f"/api/records/{stem}")
+    assert status == 200 and headers["etag"] == etag and json.loads(data)["annotator"] == "alice"
+    assert request(server, "GET", f"/api/records/{stem}", headers={"If-None-Match": etag})[0] == 304
+
+    status, _, _ = request(server, "PUT", f"/api/records/{stem}?annotator=alice", new_record(stem, "alice"),
+                           headers={"If-Match": '"stale"'})
+    assert status == 412
+    status, headers, _ = request(server, "PUT", f"/api/records/{stem}?annotator=alice", new_record(stem, "alice"),
+                                 headers={"If-Match": etag})
+    assert status == 200 and headers["etag"] != etag
+
+
+def test_next_assignment_and_lease_conflict(server):
+    status, _, data = request(server, "POST", "/api/next?annotator=alice")
+    alice = json.loads(data)["stem"]
+    status, _, data = request(server, "POST", "/api/next?annotator=bob")
+    bob = json.loads(data)["stem"]
+    assert status == 200 and alice == "zhuang_1_crop_1" and bob == "zhuang_1_crop_2"
+
+    assert request(server, "PUT", f"/api/records/{alice}?annotator=bob", new_record(alice, "bob"))[0] == 409
+    # 没有标注者时不能绕过租约
+    record = new_record(alice, "")
+    assert request(server, "PUT", f"/api/records/{alice}", record)[0] == 400
+    assert request(server, "PUT", f"/api/records/{alice}?annotator=alice", new_record(alice, "alice"))[0] == 200
+
+    # 提交后租约释放，已提交的图片不再分配
+    status, _, data = request(server, "POST", "/api/next?annotator=carol")
+    assert json.loads(data)["stem"] == "zhuang_1_crop_3"
+
+
+def test_put_rejects_paths_outside_output_image(server):
+    stem = "zhuang_1_crop_1"
+    record = new_record(stem, "alice")
+    pron = record["pronunciations"][0]
+    pron["imported_image"] = ["shot.png"]
+    pron["imported_source_path"] = pron["old_image_path"] = os.path.join("output_image", "shot.png")
+    assert request(server, "PUT", f"/api/records/{stem}?annotator=alice", record)[0] == 200
+
+    for key, value in (("imported_image", ["missing.png"]), ("imported_image", ["../main.py"]),
+                       ("imported_source_path", "/etc/passwd"), ("old_image_path", "config.json")):
+        bad = new_record(stem, "alice")
+        bad["pronunciations"][0][key] = value
+        assert request(server, "PUT", f"/api/records/{stem}?annotator=alice", bad)[0] == 400, (key, value)
+
+
+def test_invalid_parameters_return_400(server):
+    assert request(server, "GET", "/api/images?offset=abc")[0] == 400
+    assert request(server, "GET", "/api/images?offset=-1")[0] == 400
+    status, _, data = request(server, "GET", "/api/images?offset=1&limit=1")
+    assert status == 200 and [item["stem"] for item in json.loads(data)["images"]] == ["zhuang_1_crop_2"]
+
+
+def test_invalid_content_length_returns_400(server):
+    with socket.create_connection(("127.0.0.1", server), timeout=10) as sock:
+        sock.sendall(b"PUT /api/records/zhuang_1_crop_1 HTTP/1.1\r\nContent-Length: abc\r\n\r\n")
+        assert sock.recv(1024).startswith(b"HTTP/1.1 400")
+
+
+def test_next_skips_pages_submitted_by_another_program(server):
+    # 服务启动后桌面程序提交了第一张图片
+    other = main.FileAnnotationStore("output")
+    other.save("zhuang_1_crop_1", new_record("zhuang_1_crop_1", "bob"))
+    other.save("zhuang_1_crop_2", new_record("zhuang_1_crop_2", "bob"))
+    status, _, data = request(server, "POST", "/api/next?annotator=alice")
+    assert status == 200 and json.loads(data)["stem"] == "zhuang_1_crop_3"
+    status, _, data = request(server, "GET", "/api/images")
+    assert json.loads(data)["counts"]["submitted"] == 2
@@ -0,0 +1,71 @@
+"""JSONL存储的偏移索引与追加锁、草稿日志重放"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main  # noqa: E402
+
+
+def test_jsonl_empty_store(tmp_path):
+    store = main.JsonlAnnotationStore(str(tmp_path / "output"))
+    assert list(store.items()) == [] and store.stems() == [] and store.version("a") is None
+    store.close()
+
+
+def test_jsonl_two_writers_share_the_log(tmp_path):
+    output = str(tmp_path / "output")
+    a = main.JsonlAnnotationStore(output)
+    b = main.JsonlAnnotationStore(output)
+    a.save("x", {"v": 1})
+    b.save("y", {"v": 2})
+    b.save("x", {"v": 3})
+    # 两个实例看到同样的版本号和最新记录
+    assert a.version("x") == b.version("x") and a.version("y") == b.version("y")
+    assert a.load("x") == {"v": 3} and dict(a.items()) == {"x": {"v": 3}, "y": {"v": 2}}
+    a.close()
+    b.close()
+    assert not os.path.exists(os.path.join(output, "annotations.jsonl.lease"))
+
+    # 重新打开时使用偏移索引
+    reopened = main.JsonlAnnotationStore(output)
+    assert reopened.load("y") == {"v": 2} and sorted(reopened.stems()) == ["x", "y"]
+    reopened.close()
+
+
+def test_jsonl_torn_tail_is_truncated_only_when_appending(tmp_path):
+    output = str(tmp_path / "output")
+    store = main.JsonlAnnotationStore(output)
+    store.save("x", {"v": 1})
+    store.close()
+    with open(os.path.join(output, "annotations.jsonl"), "ab") as f:
+        f.write(b'{"image": "y", "da')  # 写入者崩溃留下的残行
+
+    store = main.JsonlAnnotationStore(output)
+    assert store.stems() == ["x"]
+    store.save("z", {"v": 2})
+    assert store.load("z") == {"v": 2} and store.load("x") == {"v": 1}
+    with open(os.path.join(output, "annotations.jsonl"), "rb") as f:
+        assert all(line.endswith(b"\n") for line in f)
+    store.close()
+
+
+def test_draft_journal_replay_and_base_version(tmp_path):
+    path = str(tmp_path / "journal" / "drafts.jsonl")
+    base = main.Annotation.new(image="a.jpg").to_dict()
+    journal = main.DraftJournal(path)
+    journal.begin("a", base, "v1")
+    assert not journal.record("a", base)  # 未修改不写日志
+    edited = main.Annotation.new(image="a.jpg", annotator="alice").to_dict()
+    assert journal.record("a", edited)
+    edited["simplified_Chinese_character"] = "字"
+    assert journal.record("a", edited)
+
+    replayed = main.DraftJournal(path)
+    assert replayed.get("a") == edited and replayed.base_version("a") == "v1"
+    replayed.compact()
+    compacted = main.DraftJournal(path)
+    assert compacted.get("a") == edited and compacted.base_version("a") == "v1"
+
+    compacted.clear("a", edited)
+    cleared = main.DraftJournal(path)
+    assert cleared.get("a") is None and cleared.base_version("a") == main.ANY_VERSION
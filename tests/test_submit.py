@@ -0,0 +1,115 @@
+"""提交日志重放时的截图引用数，以及孤儿文件回收与未完成的提交"""
+import json
+import os
+import shutil
+import sys
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main  # noqa: E402
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("temp")
+    Image.effect_noise((64, 64), 40).convert("RGB").save("shot.png")
+    return tmp_path
+
+
+def refs(index, name):
+    row = index.conn.execute("SELECT refs FROM files WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else None
+
+
+def make_writer(store, index):
+    return main.SubmitWriter(store, os.path.join("journal", "submit"), image_index=index)
+
+
+def test_replayed_add_does_not_double_count(workdir):
+    index = main.OutputImageIndex("output_image")
+    shutil.copy("shot.png", "temp/a.png")
+    index.add("temp/a.png", "output_image/a.png")
+    store = main.FileAnnotationStore("output")
+    writer = make_writer(store, index)
+
+    shutil.copy("shot.png", "temp/b.png")  # 与a.png内容相同，提交时改用a.png
+    record = main.Annotation.new(image="zhuang_1_crop_1.jpg").to_dict()
+    record["pronunciations"][0]["imported_image"] = ["b.png"]
+    job = {"id": "job1", "stem": "zhuang_1_crop_1", "record": record,
+           "moves": [["temp/b.png", "output_image/b.png"]], "removes": [], "expected_version": main.ANY_VERSION}
+
+    def crash(stem, data):
+        raise RuntimeError("写入前崩溃")
+
+    save = store.save
+    store.save = crash
+    with pytest.raises(RuntimeError):
+        writer._apply(json.loads(json.dumps(job)))
+    store.save = save
+    assert refs(index, "a.png") == 2
+
+    # 重放同一日志
+    writer._apply(json.loads(json.dumps(job)))
+    assert refs(index, "a.png") == 2
+    assert store.load("zhuang_1_crop_1")["pronunciations"][0]["imported_image"] == ["a.png"]
+    writer.close()
+    index.close()
+
+
+def test_replayed_release_does_not_delete_shared_file(workdir):
+    index = main.OutputImageIndex("output_image")
+    for name in ("a", "b"):
+        shutil.copy("shot.png", f"temp/{name}.png")
+        index.add(f"temp/{name}.png", "output_image/a.png")
+    assert refs(index, "a.png") == 2
+    writer = make_writer(main.FileAnnotationStore("output"), index)
+    job = {"id": "job2", "stem": "zhuang_1_crop_1", "record": main.Annotation.new().to_dict(),
+           "moves": [], "removes": ["output_image/a.png"], "expected_version": main.ANY_VERSION}
+    writer._apply(job)
+    writer._apply(job)
+    assert refs(index, "a.png") == 1 and os.path.exists("output_image/a.png")
+
+    # 提交完成后清除步骤记录，恢复时清除已不在日志中的提交的记录
+    index.finish_job("job2")
+    writer._apply(dict(job, id="job3"))
+    index.prune_jobs([])
+    assert index.conn.execute("SELECT COUNT(*) FROM ops").fetchone()[0] == 0
+    writer.close()
+    index.close()
+
+
+def test_gc_keeps_files_of_submit_finishing_during_scan(workdir):
+    os.makedirs("output_image")
+    shutil.copy("shot.png", "output_image/new.png")
+    store = main.FileAnnotationStore("output")
+    record = main.Annotation.new(image="zhuang_1_crop_1.jpg").to_dict()
+    record["pronunciations"][0]["imported_image"] = ["new.png"]
+    journal_path = os.path.join("journal", "submit", "job.json")
+    main.write_json_atomic(journal_path, {"id": "job", "stem": "zhuang_1_crop_1", "record": record,
+                                          "moves": [["temp/new.png", "output_image/new.png"]], "removes": []})
+
+    collector = main.OrphanCollector(store, journal_dir="journal", state_path="cache/gc_refs.json", min_age=0)
+    store_references = collector.store_references
+
+    def finish_submit_after_store_read():
+        # 读完存储后提交线程写入记录并删除日志
+        yield from store_references()
+        store.save("zhuang_1_crop_1", record)
+        os.remove(journal_path)
+
+    collector.store_references = finish_submit_after_store_read
+    stats = collector.collect(dry_run=False)
+    assert os.path.exists("output_image/new.png") and stats["removed"] == 0
+
+
+def test_gc_removes_unreferenced_files(workdir):
+    os.makedirs("output_image")
+    shutil.copy("shot.png", "output_image/orphan.png")
+    collector = main.OrphanCollector(main.FileAnnotationStore("output"), journal_dir="journal",
+                                     state_path="cache/gc_refs.json", min_age=3600)
+    assert collector.collect(dry_run=False)["recent"] == 1  # 刚修改的文件不删除
+    collector.min_age = 0
+    assert collector.collect(dry_run=False)["removed"] == 1 and not os.path.exists("output_image/orphan.png")